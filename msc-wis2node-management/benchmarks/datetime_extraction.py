@@ -0,0 +1,126 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+# Datetime extraction benchmark
+#
+# Extracts datetimes from a corpus of Datamart relPaths with the
+# `msc-filename-datetime-regex` of each dataset, comparing precompiled
+# extractors against compiling (via the `re` module cache) on every call,
+# and reports how many filenames would fall back to message timestamps.
+#
+# Usage: python benchmarks/datetime_extraction.py --help
+
+from datetime import date, datetime
+from fnmatch import fnmatch
+from pathlib import Path
+import re
+import time
+
+import click
+import yaml
+
+from msc_wis2node.util import DatetimeExtractor, subtopic2dirpath
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+DEFAULT_CORPUS = BENCHMARK_DIR / 'data' / 'datamart-relpaths.txt'
+DEFAULT_DATASET_CONFIG = BENCHMARK_DIR / 'data' / 'datasets.yml'
+
+
+def match_corpus(relpaths: list, datasets: list) -> list:
+    """
+    Pair relPaths with the datetime regex of their dataset
+
+    :returns: `list` of (pattern, relPath) pairs
+    """
+
+    pairs = []
+
+    for relpath in relpaths:
+        for dataset in datasets:
+            if fnmatch(relpath, subtopic2dirpath(dataset['subtopic'])):
+                pattern = dataset.get('msc-filename-datetime-regex')
+                if pattern is not None:
+                    pairs.append((pattern, relpath))
+                break
+
+    return pairs
+
+
+def uncompiled(pattern: str, relpath: str):
+    """Previous extraction, compiling the pattern on every call"""
+
+    match = re.search(pattern, relpath)
+    if match is None:
+        return None
+
+    groups = [int(m) for m in match.groups()]
+    if len(groups) < 4:
+        return date(*groups).isoformat()
+
+    return datetime(*groups).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+@click.command()
+@click.option('--corpus', '-c', default=DEFAULT_CORPUS,
+              type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='File of Datamart relPaths (one per line)')
+@click.option('--dataset-config', '-d', default=DEFAULT_DATASET_CONFIG,
+              type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='Dataset definition configuration')
+@click.option('--iterations', '-n', default=20, type=int,
+              help='Number of times to replay the corpus')
+def datetime_extraction(corpus, dataset_config, iterations):
+    """Benchmark datetime extraction of Datamart filenames"""
+
+    relpaths = [line.strip() for line in corpus.read_text().splitlines()
+                if line.strip()]
+
+    with dataset_config.open() as fh:
+        datasets = yaml.load(fh, Loader=yaml.SafeLoader)['datasets']
+
+    pairs = match_corpus(relpaths, datasets)
+    extractors = {pattern: DatetimeExtractor(pattern)
+                  for pattern in set(pattern for pattern, _ in pairs)}
+
+    fallbacks = sum(1 for pattern, relpath in pairs
+                    if extractors[pattern].extract(relpath) is None)
+
+    click.echo(f'filenames: {len(pairs)} with a datetime regex '
+               f'(of {len(relpaths)}), fallbacks: {fallbacks}')
+
+    scenarios = {
+        'uncompiled re.search': lambda p, r: uncompiled(p, r),
+        'DatetimeExtractor': lambda p, r: extractors[p].extract(r)
+    }
+
+    click.echo(f"{'scenario':<24}{'us/filename':>14}")
+
+    for scenario, function in scenarios.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for pattern, relpath in pairs:
+                function(pattern, relpath)
+        elapsed = time.perf_counter() - start
+
+        per_filename = elapsed / (iterations * len(pairs)) * 1000000
+        click.echo(f'{scenario:<24}{per_filename:>14.2f}')
+
+
+if __name__ == '__main__':
+    datetime_extraction()
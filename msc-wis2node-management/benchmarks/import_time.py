@@ -0,0 +1,123 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+# CLI and flow callback import time benchmark
+#
+# Measures, with `python -X importtime`, the imports paid to resolve each
+# msc-wis2node subcommand, compared to eagerly importing all command
+# modules.
+#
+# Usage: python benchmarks/import_time.py --help
+
+import os
+import subprocess
+import sys
+
+import click
+
+RESOLVE_COMMAND = '''
+from msc_wis2node import cli
+ctx = cli.make_context('msc-wis2node', {args!r}, resilient_parsing=True)
+command = cli
+for name in {args!r}:
+    command = command.get_command(ctx, name)
+'''
+
+SCENARIOS = {
+    'eager (all command modules)': 'import msc_wis2node.dataset, msc_wis2node.health, msc_wis2node.metrics, msc_wis2node.profiling, msc_wis2node.publish, msc_wis2node.subscribe',  # noqa
+    'msc-wis2node (no subcommand)': 'import msc_wis2node',
+    'metrics get': RESOLVE_COMMAND.format(args=['metrics', 'get']),
+    'dataset setup': RESOLVE_COMMAND.format(args=['dataset', 'setup']),
+    'publish replay': RESOLVE_COMMAND.format(args=['publish', 'replay']),
+    'health serve': RESOLVE_COMMAND.format(args=['health', 'serve']),
+    'sr3 flow callback': 'import msc_wis2node.publisher'
+}
+
+
+def measure(code: str) -> dict:
+    """
+    Run code in a fresh interpreter with `-X importtime`
+
+    :param code: `str` of Python code
+
+    :returns: `dict` of number of modules imported and cumulative
+              import time (microseconds)
+    """
+
+    env = {key: value for key, value in os.environ.items()
+           if not key.startswith('MSC_WIS2NODE_')}
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, env=env)
+
+    if result.returncode != 0:
+        raise click.ClickException(result.stderr.strip().splitlines()[-1])
+
+    modules = 0
+    total = 0
+    heaviest = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_us, cumulative_us, name = line.replace(
+            'import time:', '', 1).split('|')
+        # nested imports are indented by two spaces per level
+        name = name[1:]
+
+        modules += 1
+        total += int(self_us.strip())
+
+        if not name.startswith(' '):
+            heaviest.append((int(cumulative_us.strip()), name.strip()))
+
+    heaviest.sort(reverse=True)
+
+    return {
+        'modules': modules,
+        'total_us': total,
+        'heaviest': heaviest[:5]
+    }
+
+
+@click.command()
+@click.option('--runs', '-n', default=5, type=int,
+              help='Number of runs per scenario (best run is reported)')
+@click.option('--top', is_flag=True, default=False,
+              help='Show heaviest top-level imports per scenario')
+def import_time(runs, top):
+    """Benchmark msc-wis2node import time per subcommand"""
+
+    click.echo(f"{'scenario':<32}{'modules':>10}{'import ms':>12}")
+
+    for scenario, code in SCENARIOS.items():
+        results = [measure(code) for _ in range(runs)]
+        best = min(results, key=lambda r: r['total_us'])
+
+        click.echo(f"{scenario:<32}{best['modules']:>10}"
+                   f"{best['total_us'] / 1000:>12.1f}")
+
+        if top:
+            for cumulative_us, name in best['heaviest']:
+                click.echo(f'    {name:<36}{cumulative_us / 1000:>10.1f} ms')
+
+
+if __name__ == '__main__':
+    import_time()
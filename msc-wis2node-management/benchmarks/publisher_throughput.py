@@ -0,0 +1,577 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+# Publisher throughput benchmark
+#
+# Replays a corpus of Datamart relPaths through WIS2FlowCB.after_accept
+# against local stand-ins for all external services:
+#
+# - an in-process MQTT broker (QoS 0/1 publishing only)
+# - fakeredis (or a local redis-server via --redis-url)
+# - a local HTTP server answering URL info requests
+#
+# Usage: python benchmarks/publisher_throughput.py --help
+
+from functools import wraps
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+from pathlib import Path
+import random
+import resource
+import socketserver
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Union
+
+import click
+
+LOGGER = logging.getLogger(__name__)
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+DEFAULT_CORPUS = BENCHMARK_DIR / 'data' / 'datamart-relpaths.txt'
+DEFAULT_DATASET_CONFIG = BENCHMARK_DIR / 'data' / 'datasets.yml'
+
+
+class FakeMQTTHandler(socketserver.BaseRequestHandler):
+    """Minimal MQTT 3.1.1 broker connection handler"""
+
+    def _read(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('connection closed')
+            data += chunk
+        return data
+
+    def _read_remaining_length(self) -> int:
+        multiplier = 1
+        value = 0
+        while True:
+            byte = self._read(1)[0]
+            value += (byte & 127) * multiplier
+            if byte & 128 == 0:
+                return value
+            multiplier *= 128
+
+    def handle(self) -> None:
+        try:
+            while True:
+                header = self._read(1)[0]
+                packet = self._read(self._read_remaining_length())
+                packet_type = header >> 4
+
+                if packet_type == 1:  # CONNECT
+                    self.request.sendall(b'\x20\x02\x00\x00')
+                elif packet_type == 3:  # PUBLISH
+                    qos = (header >> 1) & 3
+                    topic_length = int.from_bytes(packet[:2], 'big')
+                    topic = packet[2:2 + topic_length].decode()
+                    offset = 2 + topic_length
+                    if qos > 0:
+                        packet_id = packet[offset:offset + 2]
+                        offset += 2
+                        self.request.sendall(b'\x40\x02' + packet_id)
+                    self.server.record(topic, len(packet) - offset)
+                elif packet_type == 12:  # PINGREQ
+                    self.request.sendall(b'\xd0\x00')
+                elif packet_type == 14:  # DISCONNECT
+                    return
+        except (ConnectionError, OSError):
+            return
+
+
+class FakeMQTTBroker(socketserver.ThreadingTCPServer):
+    """In-process MQTT broker recording published messages"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeMQTTHandler)
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+        self.topics = {}
+
+    def record(self, topic: str, size: int) -> None:
+        with self.lock:
+            self.messages += 1
+            self.bytes += size
+            self.topics[topic] = self.topics.get(topic, 0) + 1
+
+
+class FakeDatamartHandler(BaseHTTPRequestHandler):
+    """HTTP handler serving deterministic content for any path"""
+
+    def do_GET(self):
+        size = self.server.payload_size
+        seed = hashlib.sha256(self.path.encode()).digest()
+        body = (seed * (size // len(seed) + 1))[:size]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDatamart(ThreadingHTTPServer):
+    """Local HTTP server standing in for the MSC Datamart"""
+
+    daemon_threads = True
+
+    def __init__(self, payload_size: int):
+        super().__init__(('127.0.0.1', 0), FakeDatamartHandler)
+        self.payload_size = payload_size
+
+
+class StageTimer:
+    """Collects per-stage latencies of wrapped callables"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def wrap(self, stage: str, function):
+        samples = self.samples.setdefault(stage, [])
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+
+        return timed
+
+    def instrument(self, owner, attribute: str, stage: str) -> None:
+        """Replace owner.attribute with a timed version, if it exists"""
+
+        function = getattr(owner, attribute, None)
+        if function is None:
+            LOGGER.warning(f'Cannot instrument {owner}.{attribute}')
+            return
+
+        setattr(owner, attribute, self.wrap(stage, function))
+
+    def report(self) -> dict:
+        report = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            samples_ = sorted(samples)
+            report[stage] = {
+                'count': len(samples_),
+                'total_s': round(sum(samples_), 6),
+                'mean_ms': round(statistics.fmean(samples_) * 1000, 4),
+                'p50_ms': round(percentile(samples_, 50) * 1000, 4),
+                'p95_ms': round(percentile(samples_, 95) * 1000, 4),
+                'p99_ms': round(percentile(samples_, 99) * 1000, 4)
+            }
+        return report
+
+
+class ModuleProxy:
+    """Module stand-in allowing selected functions to be timed"""
+
+    def __init__(self, module, **overrides):
+        self._module = module
+        self.__dict__.update(overrides)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+class TimedRedisFactory:
+    """Stand-in for `redis.Redis` returning timed fakeredis clients"""
+
+    def __init__(self, timer: StageTimer):
+        import fakeredis
+
+        self.timer = timer
+        self.server = fakeredis.FakeServer()
+        self.client_class = fakeredis.FakeRedis
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def from_url(self, url, **kwargs):
+        return TimedClient(self.client_class(server=self.server), self.timer)
+
+
+class TimedClient:
+    """Proxy timing every method call of a cache client"""
+
+    def __init__(self, client, timer: StageTimer):
+        self._client = client
+        self._timer = timer
+
+    def __getattr__(self, name):
+        value = getattr(self._client, name)
+        if callable(value):
+            return self._timer.wrap('cache', value)
+        return value
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+
+    :param sorted_values: `list` of sorted values
+    :param percent: `float` of percentile
+
+    :returns: `float` of percentile value
+    """
+
+    index = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def load_corpus(corpus: Path) -> list:
+    """
+    Load relPaths from a corpus file (one relPath per line)
+
+    :param corpus: `Path` of corpus file
+
+    :returns: `list` of relPaths
+    """
+
+    with corpus.open() as fh:
+        return [line.strip() for line in fh
+                if line.strip() and not line.startswith('#')]
+
+
+def setup_environment(broker: FakeMQTTBroker, dataset_config: Path,
+                      redis_url: str, mirrors: Union[list, None] = None,
+                      validation_sample_rate: float = 0,
+                      validation_schema: Union[Path, None] = None) -> None:
+    """
+    Point msc-wis2node settings at the local stand-ins.  Must be called
+    before `msc_wis2node.publisher` is imported.
+    """
+
+    if mirrors:
+        os.environ['MSC_WIS2NODE_BROKER_TARGETS'] = ','.join(
+            f'mqtt://benchmark:benchmark@{b.server_address[0]}:{b.server_address[1]}'  # noqa
+            for b in [broker] + mirrors)
+
+    if validation_schema is not None:
+        os.environ['MSC_WIS2NODE_VALIDATION_SCHEMA'] = str(validation_schema)
+
+    os.environ.update({
+        'MSC_WIS2NODE_BROKER_HOSTNAME': broker.server_address[0],
+        'MSC_WIS2NODE_BROKER_PORT': str(broker.server_address[1]),
+        'MSC_WIS2NODE_BROKER_USERNAME': 'benchmark',
+        'MSC_WIS2NODE_BROKER_PASSWORD': 'benchmark',
+        'MSC_WIS2NODE_MSC_DATAMART_AMQP': 'amqp://127.0.0.1',
+        'MSC_WIS2NODE_DATASET_CONFIG': str(dataset_config),
+        'MSC_WIS2NODE_TOPIC_PREFIX': 'origin/a/wis2',
+        'MSC_WIS2NODE_CACHE': redis_url,
+        'MSC_WIS2NODE_CENTRE_ID': 'ca-eccc-msc',
+        'MSC_WIS2NODE_VALIDATION_SAMPLE_RATE': str(validation_sample_rate),
+        'MSC_WIS2NODE_WIS2_GDC': 'http://127.0.0.1/collections/wis2-discovery-metadata'  # noqa
+    })
+
+
+def instrument_publisher(publisher, timer: StageTimer,
+                         use_fakeredis: bool) -> None:
+    """
+    Wrap the publisher pipeline stages with timers
+
+    :param publisher: `msc_wis2node.publisher` module
+    :param timer: `StageTimer` instance
+    :param use_fakeredis: whether to replace redis with fakeredis
+
+    :returns: `None`
+    """
+
+    cls = publisher.WIS2Publisher
+
+    timer.instrument(cls, 'identify', 'identify')
+    timer.instrument(cls, 'publish_to_wis2', 'publish-to-wis2')
+    timer.instrument(cls, '_update_dataset_distribution_metrics', 'metrics')
+    timer.instrument(publisher.MetricsAggregator, 'flush', 'metrics-flush')
+    timer.instrument(publisher, 'get_url_info', 'url-info')
+    timer.instrument(publisher, 'create_message', 'create-message')
+
+    timer.instrument(publisher.BrokerFanout, 'publish', 'mqtt-publish')
+    timer.instrument(publisher.MessageValidator, 'validate', 'validate')
+
+    publisher.json = ModuleProxy(
+        publisher.json, dumps=timer.wrap('serialize', publisher.json.dumps))
+
+    if use_fakeredis:
+        from msc_wis2node import cache
+
+        cache.redis = ModuleProxy(cache.redis, Redis=TimedRedisFactory(timer))
+
+
+def run_benchmark(relpaths: list, base_url: str, batch_size: int,
+                  iterations: int, trace_memory: bool,
+                  timer: StageTimer, duplicate_ratio: float = 0) -> dict:
+    """
+    Replay relPaths through `WIS2FlowCB.after_accept`
+
+    A `duplicate_ratio` share of notifications is announced twice with the
+    same checksum, as Datamart does when files are re-announced.
+
+    :returns: `dict` of results
+    """
+
+    from msc_wis2node.publisher import WIS2FlowCB
+
+    flowcb = WIS2FlowCB(SimpleNamespace())
+
+    batch_samples = []
+    messages = 0
+    failed = 0
+    rejected = 0
+    accepted = 0
+    rng = random.Random(0)
+
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+
+    for iteration in range(iterations):
+        for i in range(0, len(relpaths), batch_size):
+            incoming = []
+            for relpath in relpaths[i:i + batch_size]:
+                checksum = hashlib.sha512(
+                    f'{iteration}{relpath}'.encode()).hexdigest()
+                msg = {
+                    'baseUrl': base_url,
+                    'relPath': relpath,
+                    'identity': {'method': 'sha512', 'value': checksum}
+                }
+                incoming.append(msg)
+                if rng.random() < duplicate_ratio:
+                    incoming.append(dict(msg))
+
+            worklist = SimpleNamespace(incoming=incoming, ok=[], failed=[],
+                                       rejected=[])
+
+            batch_start = time.perf_counter()
+            flowcb.after_accept(worklist)
+            batch_samples.append(time.perf_counter() - batch_start)
+
+            messages += len(incoming)
+            failed += len(worklist.failed)
+            rejected += len(worklist.rejected)
+            accepted += len(worklist.incoming)
+
+    elapsed = time.perf_counter() - start
+
+    stop_flowcb = getattr(flowcb, 'on_stop', None)
+    if stop_flowcb is not None:
+        stop_flowcb()
+
+    memory = {
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory['traced_current_kb'] = round(current / 1024, 1)
+        memory['traced_peak_kb'] = round(peak / 1024, 1)
+
+    batch_samples.sort()
+
+    validator = flowcb.wis2_publisher.validator
+
+    return {
+        'messages': messages,
+        'accepted': accepted,
+        'rejected': rejected,
+        'failed': failed,
+        'validation_enabled': validator.enabled,
+        'validated': validator.checked,
+        'violations': validator.violations,
+        'elapsed_s': round(elapsed, 4),
+        'messages_per_second': round(messages / elapsed, 2),
+        'batch_p50_ms': round(percentile(batch_samples, 50) * 1000, 4),
+        'batch_p95_ms': round(percentile(batch_samples, 95) * 1000, 4),
+        'memory': memory
+    }
+
+
+def compare_to_baseline(results: dict, baseline: Path,
+                        tolerance: float) -> list:
+    """
+    Compare throughput against a previously saved benchmark result
+
+    :returns: `list` of regression descriptions (empty if none)
+    """
+
+    with baseline.open() as fh:
+        previous = json.load(fh)
+
+    regressions = []
+
+    previous_rate = previous['summary']['messages_per_second']
+    current_rate = results['summary']['messages_per_second']
+    if current_rate < previous_rate * (1 - tolerance):
+        regressions.append(
+            f'throughput {current_rate} msg/s < baseline {previous_rate} msg/s')  # noqa
+
+    for stage, values in results['stages'].items():
+        previous_stage = previous['stages'].get(stage)
+        if previous_stage is None:
+            continue
+        if values['p95_ms'] > previous_stage['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{stage} p95 {values['p95_ms']} ms > baseline {previous_stage['p95_ms']} ms")  # noqa
+
+    return regressions
+
+
+@click.command()
+@click.option('--corpus', '-c', default=DEFAULT_CORPUS,
+              type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='File of Datamart relPaths (one per line)')
+@click.option('--dataset-config', '-d', default=DEFAULT_DATASET_CONFIG,
+              type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='Dataset definition configuration')
+@click.option('--iterations', '-n', default=3, type=int,
+              help='Number of times to replay the corpus')
+@click.option('--batch-size', '-b', default=25, type=int,
+              help='Number of messages per worklist')
+@click.option('--duplicate-ratio', default=0.0, type=float,
+              help='Share of notifications announced twice')
+@click.option('--brokers', default=1, type=int,
+              help='Number of brokers to publish to (fan-out)')
+@click.option('--validation-sample-rate', default=0.0, type=float,
+              help='Share of messages validated against the WNM schema '
+                   '(fails the benchmark on violations)')
+@click.option('--validation-schema',
+              type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='WNM schema (default is the pywis-pubsub cached schema)')
+@click.option('--payload-size', default=65536, type=int,
+              help='Size in bytes of files served by the HTTP stand-in')
+@click.option('--redis-url', default=None,
+              help='Use a real Redis (e.g. local redis-server) instead of fakeredis')  # noqa
+@click.option('--trace-memory', is_flag=True, default=False,
+              help='Trace Python allocations (slows down the benchmark)')
+@click.option('--output', '-o',
+              type=click.Path(dir_okay=False, path_type=Path),
+              help='Write results as JSON')
+@click.option('--baseline',
+              type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='JSON results of a previous run to compare against')
+@click.option('--tolerance', default=0.1, type=float,
+              help='Allowed relative regression against baseline')
+def benchmark(corpus, dataset_config, iterations, batch_size,
+              duplicate_ratio, brokers, validation_sample_rate,
+              validation_schema, payload_size, redis_url, trace_memory,
+              output, baseline, tolerance):
+    """Benchmark WIS2FlowCB publishing throughput"""
+
+    logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
+
+    broker = FakeMQTTBroker()
+    mirrors = [FakeMQTTBroker() for _ in range(brokers - 1)]
+    datamart = FakeDatamart(payload_size)
+
+    for server in [broker, datamart] + mirrors:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    setup_environment(broker, dataset_config,
+                      redis_url or 'redis://127.0.0.1:6379/0', mirrors,
+                      validation_sample_rate, validation_schema)
+
+    from msc_wis2node import publisher
+
+    timer = StageTimer()
+    instrument_publisher(publisher, timer, redis_url is None)
+
+    relpaths = load_corpus(corpus)
+    base_url = f'http://{datamart.server_address[0]}:{datamart.server_address[1]}'  # noqa
+
+    summary = run_benchmark(relpaths, base_url, batch_size, iterations,
+                            trace_memory, timer, duplicate_ratio)
+
+    for server in [broker, datamart] + mirrors:
+        server.shutdown()
+
+    summary['published'] = broker.messages
+    summary['published_bytes'] = broker.bytes
+    summary['published_mirrors'] = [mirror.messages for mirror in mirrors]
+
+    results = {
+        'summary': summary,
+        'stages': timer.report(),
+        'broker_topics': broker.topics
+    }
+
+    click.echo(f"messages: {summary['messages']} "
+               f"(published: {summary['published']}, "
+               f"mirrors: {summary['published_mirrors']}, "
+               f"rejected: {summary['rejected']}, "
+               f"failed: {summary['failed']})")
+    click.echo(f"elapsed: {summary['elapsed_s']} s, "
+               f"throughput: {summary['messages_per_second']} msg/s")
+    click.echo(f"memory: {summary['memory']}")
+    if validation_sample_rate > 0:
+        click.echo(f"validation enabled: {summary['validation_enabled']}, "
+                   f"validated: {summary['validated']}, "
+                   f"violations: {summary['violations']}")
+    click.echo(f"{'stage':<20}{'count':>8}{'mean ms':>12}{'p50 ms':>12}"
+               f"{'p95 ms':>12}{'p99 ms':>12}")
+    for stage, values in results['stages'].items():
+        click.echo(f"{stage:<20}{values['count']:>8}{values['mean_ms']:>12}"
+                   f"{values['p50_ms']:>12}{values['p95_ms']:>12}"
+                   f"{values['p99_ms']:>12}")
+
+    if output is not None:
+        with output.open('w') as fh:
+            json.dump(results, fh, indent=4)
+
+    if validation_sample_rate > 0 and not summary['validation_enabled']:
+        click.echo('INVALID: WNM schema validation requested but disabled '
+                   '(missing or invalid schema)', err=True)
+        sys.exit(1)
+
+    if summary['violations']:
+        click.echo('INVALID: WIS2 notification messages failed WNM schema '
+                   'validation', err=True)
+        sys.exit(1)
+
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, tolerance)
+        for regression in regressions:
+            click.echo(f'REGRESSION: {regression}', err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmark()
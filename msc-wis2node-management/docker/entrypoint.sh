@@ -29,7 +29,20 @@ sudo service cron start
 service cron status
 
 echo "Setting up MSC dataset config"
-msc-wis2node dataset setup
+if [ "${MSC_WIS2NODE_PUBLISH_METADATA:-false}" = "true" ]; then
+    # only changes since the (persisted) metadata publication state
+    msc-wis2node dataset setup --publish-metadata
+else
+    msc-wis2node dataset setup
+fi
+
+if [ "${MSC_WIS2NODE_VALIDATION_SAMPLE_RATE:-0}" != "0" ]; then
+    echo "Syncing WIS2 notification message schema"
+    pywis-pubsub schema sync
+fi
+
+echo "Starting health endpoint"
+msc-wis2node health serve --port ${MSC_WIS2NODE_HEALTH_PORT:-8080} &
 
 echo "starting sr3..."
 sr3 --logStdout start subscribe/dd.weather.gc.ca-all && sleep infinity
@@ -20,19 +20,45 @@
 
 __version__ = '0.1.0'
 
+import importlib
+from typing import Union
+
 import click
 
-from msc_wis2node.dataset import dataset
-from msc_wis2node.metrics import metrics
+COMMANDS = {
+    'dataset': 'msc_wis2node.dataset.dataset',
+    'health': 'msc_wis2node.health.health',
+    'metrics': 'msc_wis2node.metrics.metrics',
+    'profile': 'msc_wis2node.profiling.profile',
+    'publish': 'msc_wis2node.publish.publish',
+    'subscribe': 'msc_wis2node.subscribe.subscribe'
+}
+
+
+class LazyGroup(click.Group):
+    """Command group importing subcommand modules only when invoked"""
+
+    def __init__(self, *args, lazy_commands: Union[dict, None] = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) |
+                      set(self.lazy_commands))
 
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_commands:
+            module_name, command_name = self.lazy_commands[cmd_name].rsplit('.', 1)  # noqa
+            module = importlib.import_module(module_name)
+            return getattr(module, command_name)
 
-@click.group()
+        return super().get_command(ctx, cmd_name)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
 @click.version_option(version=__version__)
 def cli():
     """MSC WIS2 Node management utility"""
 
     pass
-
-
-cli.add_command(dataset)
-cli.add_command(metrics)
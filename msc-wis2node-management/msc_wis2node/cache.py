@@ -0,0 +1,315 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+import logging
+import threading
+import time
+from typing import Union
+
+import redis
+
+from msc_wis2node.env import (CACHE, CACHE_FAILURE_THRESHOLD,
+                              CACHE_RETRY_INTERVAL, CACHE_SOCKET_TIMEOUT)
+
+LOGGER = logging.getLogger(__name__)
+
+MEMORY_MAX_KEYS = 100000
+
+
+class Cache:
+    """
+    Redis cache with a circuit breaker
+
+    After `failure_threshold` consecutive Redis errors, Redis is no longer
+    queried for `retry_interval` seconds and an in-memory store is used
+    instead.  Keys set and counters incremented in the meantime are written
+    to Redis once it is reachable again.
+    """
+
+    def __init__(self, url: Union[str, None] = CACHE,
+                 socket_timeout: float = CACHE_SOCKET_TIMEOUT,
+                 failure_threshold: int = CACHE_FAILURE_THRESHOLD,
+                 retry_interval: float = CACHE_RETRY_INTERVAL):
+        """
+        initialize
+
+        :param url: `str` of Redis URL (if `None`, only the in-memory
+                    store is used)
+        :param socket_timeout: `float` of Redis connect/read timeout
+        :param failure_threshold: `int` of consecutive errors before
+                                  falling back to the in-memory store
+        :param retry_interval: `float` of seconds before retrying Redis
+
+        :returns: `None`
+        """
+
+        self.redis = None
+        self.failure_threshold = failure_threshold
+        self.retry_interval = retry_interval
+
+        self.failures = 0
+        self.opened_at = None
+
+        self.memory = {}
+        self.pending_keys = {}
+        self.pending_counters = {}
+        self.lock = threading.Lock()
+
+        if url is not None:
+            self.redis = redis.Redis.from_url(
+                url, socket_timeout=socket_timeout,
+                socket_connect_timeout=socket_timeout)
+        else:
+            LOGGER.info('No cache configured; using in-memory store')
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether Redis should be queried (circuit closed, or open for longer
+        than the retry interval)
+
+        :returns: `bool` of Redis availability
+        """
+
+        if self.redis is None:
+            return False
+
+        if self.opened_at is None:
+            return True
+
+        return time.monotonic() - self.opened_at >= self.retry_interval
+
+    def _success(self) -> None:
+        if self.opened_at is not None:
+            LOGGER.info('Cache is available again')
+
+        self.opened_at = None
+        self.failures = 0
+
+        if self.pending_keys or self.pending_counters:
+            self.reconcile()
+
+    def _failure(self, err: Exception) -> None:
+        self.failures += 1
+        LOGGER.warning(f'Cache error ({self.failures}): {err}')
+
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                LOGGER.error('Cache unavailable; using in-memory store')
+            self.opened_at = time.monotonic()
+
+    def _memory_get(self, key: str) -> Union[str, None]:
+        with self.lock:
+            value, expires = self.memory.get(key, (None, None))
+
+        if expires is not None and expires < time.monotonic():
+            return None
+
+        return value
+
+    def _memory_set(self, key: str, value, ex: Union[int, None]) -> None:
+        expires = None if ex is None else time.monotonic() + ex
+
+        with self.lock:
+            if len(self.memory) >= MEMORY_MAX_KEYS:
+                self._memory_prune()
+            self.memory[key] = (value, expires)
+            if self.redis is not None:
+                self.pending_keys[key] = (value, expires)
+
+    def _memory_prune(self) -> None:
+        now = time.monotonic()
+
+        self.memory = {k: v for k, v in self.memory.items()
+                       if v[1] is None or v[1] >= now}
+
+        # drop oldest keys if still full
+        while len(self.memory) >= MEMORY_MAX_KEYS:
+            self.memory.pop(next(iter(self.memory)))
+
+        self.pending_keys = {k: v for k, v in self.pending_keys.items()
+                             if k in self.memory}
+
+    def get(self, key: str) -> Union[bytes, str, None]:
+        """
+        Get a value
+
+        :param key: `str` of key
+
+        :returns: value of key, or `None` if not set
+        """
+
+        if self.available:
+            try:
+                value = self.redis.get(key)
+                if value is None:
+                    # set while Redis was unavailable, not yet reconciled
+                    value = self._memory_get(key)
+                self._success()
+                return value
+            except redis.RedisError as err:
+                self._failure(err)
+
+        return self._memory_get(key)
+
+    def set(self, key: str, value, ex: Union[int, None] = None) -> None:
+        """
+        Set a value
+
+        :param key: `str` of key
+        :param value: value
+        :param ex: `int` of expiry in seconds
+
+        :returns: `None`
+        """
+
+        if self.available:
+            try:
+                self.redis.set(key, value, ex=ex)
+                self._success()
+                return
+            except redis.RedisError as err:
+                self._failure(err)
+
+        self._memory_set(key, value, ex)
+
+    def add(self, key: str, value, ex: Union[int, None] = None) -> bool:
+        """
+        Set a value only if the key does not exist
+
+        :param key: `str` of key
+        :param value: value
+        :param ex: `int` of expiry in seconds
+
+        :returns: `bool` of whether the key was set
+        """
+
+        if self.available:
+            try:
+                result = self.redis.set(key, value, ex=ex, nx=True)
+                self._success()
+                return bool(result) and self._memory_get(key) is None
+            except redis.RedisError as err:
+                self._failure(err)
+
+        if self._memory_get(key) is not None:
+            return False
+
+        self._memory_set(key, value, ex)
+
+        return True
+
+    def delete(self, key: str) -> None:
+        """
+        Delete a key
+
+        :param key: `str` of key
+
+        :returns: `None`
+        """
+
+        with self.lock:
+            self.memory.pop(key, None)
+            self.pending_keys.pop(key, None)
+
+        if self.available:
+            try:
+                self.redis.delete(key)
+                self._success()
+            except redis.RedisError as err:
+                self._failure(err)
+
+    def incrby_many(self, counters: dict) -> bool:
+        """
+        Increment counters in one pipelined batch
+
+        :param counters: `dict` of increments keyed by counter key
+
+        :returns: `bool` of whether counters were written to Redis
+                  (otherwise they are kept until Redis is available, or
+                  dropped if no Redis is configured)
+        """
+
+        if self.redis is None:
+            return False
+
+        if self.available:
+            try:
+                pipeline = self.redis.pipeline(transaction=False)
+                for key, value in counters.items():
+                    pipeline.incrby(key, value)
+                pipeline.execute()
+                self._success()
+                return True
+            except redis.RedisError as err:
+                self._failure(err)
+
+        with self.lock:
+            for key, value in counters.items():
+                self.pending_counters[key] = self.pending_counters.get(key, 0) + value  # noqa
+
+        return False
+
+    def reconcile(self) -> None:
+        """
+        Write keys and counters accumulated while Redis was unavailable
+
+        :returns: `None`
+        """
+
+        with self.lock:
+            pending_keys = self.pending_keys
+            pending_counters = self.pending_counters
+            self.pending_keys = {}
+            self.pending_counters = {}
+
+        if not pending_keys and not pending_counters:
+            return
+
+        LOGGER.info(f'Reconciling {len(pending_keys)} keys and '
+                    f'{len(pending_counters)} counters')
+
+        now = time.monotonic()
+
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for key, (value, expires) in pending_keys.items():
+                if expires is None:
+                    pipeline.set(key, value)
+                elif expires > now:
+                    pipeline.set(key, value, ex=max(int(expires - now), 1))
+            for key, value in pending_counters.items():
+                pipeline.incrby(key, value)
+            pipeline.execute()
+        except redis.RedisError as err:
+            LOGGER.warning(f'Reconciliation failed: {err}')
+            with self.lock:
+                pending_keys.update(self.pending_keys)
+                self.pending_keys = pending_keys
+                for key, value in pending_counters.items():
+                    self.pending_counters[key] = self.pending_counters.get(key, 0) + value  # noqa
+            self._failure(err)
+            return
+
+        with self.lock:
+            for key in pending_keys:
+                self.memory.pop(key, None)
+
+    def __repr__(self):
+        return f'<Cache available={self.available}>'
@@ -17,10 +17,13 @@
 #
 ###############################################################################
 
+from fnmatch import fnmatch
+import hashlib
 from io import BytesIO
 import json
 import logging
 from pathlib import Path
+import re
 import tempfile
 from typing import Union
 from urllib.request import urlopen
@@ -28,17 +31,19 @@ import uuid
 import zipfile
 
 import click
-from paho.mqtt import publish
-from pygeometa.core import read_mcf
-from pywis_pubsub.publish import create_message, get_url_info
+from pygeometa.core import MCFReadError, read_mcf
+from pygeometa.schemas.wmo_wcmp2 import WMOWCMP2OutputSchema
+from pywis_pubsub.publish import create_message, generate_checksum
 import yaml
 
 from msc_wis2node import cli_options
-from msc_wis2node.env import (BROKER_HOSTNAME, BROKER_PORT, BROKER_USERNAME,
-                              BROKER_PASSWORD, CENTRE_ID, DATASET_CONFIG,
-                              DISCOVERY_METADATA_ZIP, TOPIC_PREFIX,
-                              WIS2_GDC)
-from msc_wis2node.util import get_mqtt_client_id, get_mqtt_tls_settings
+from msc_wis2node.env import (CENTRE_ID, DATASET_CONFIG,
+                              DISCOVERY_METADATA_ZIP, METADATA_BASEURL,
+                              METADATA_DIRECTORY, METADATA_STATE,
+                              TOPIC_PREFIX, WIS2_GDC, check_environment)
+from msc_wis2node.mqtt import MQTTPublisher, get_broker_targets
+from msc_wis2node.util import (PRIORITIES, DatetimeExtractor,
+                               subtopic2dirpath)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -53,31 +58,59 @@ FORMATS = {
     'XML': 'application/xml'
 }
 
+HIGH_PRIORITY_WIS2_TOPICS = [
+    'advisories-warnings',
+    'surface-based-observations',
+    'space-based-observations'
+]
+
+LOW_PRIORITY_MEDIA_TYPES = [
+    'application/grib'
+]
+
+METADATA_OPERATIONS = ['create', 'update', 'delete']
+
+# maximum size of inline content (WIS2 Notification Message)
+MAX_INLINE_CONTENT_SIZE = 4096
+
 
 def create_datasets_conf(metadata_zipfile: Union[Path, None],
-                         output: Path) -> None:
+                         output: Path,
+                         publish_metadata: bool = False,
+                         state: Union[Path, None] = None) -> dict:
     """
     Create dataset definition configuration
 
+    Metadata changes are derived against the metadata publication state
+    (the content hashes of published metadata), which is only updated for
+    notifications actually published.  Published metadata is only deleted
+    when its MCF is decommissioned or no longer published to WIS2, not when
+    its MCF cannot be processed.
+
     :param metadata_zipfile: path to zipfile of MCF repository
     :param output: `Path` object of output file
-
-    :returns: `None`
+    :param publish_metadata: whether to publish WIS2 Notifications for
+                             metadata changed since the last publication
+    :param state: `Path` object of metadata publication state (default is
+                  `MSC_WIS2NODE_METADATA_STATE`, or
+                  `<output>-metadata-state.yml`)
+
+    :returns: `dict` of metadata changes (see `diff_metadata_state`) and
+              of metadata identifiers which failed to publish (`failed`)
     """
 
-    skips = ['decommissioned', 'other', 'shared', 'template']
+    skips = ['other', 'shared', 'template']
 
     datasets_conf = {
         'datasets': []
     }
 
-    if metadata_zipfile is not None or not DISCOVERY_METADATA_ZIP.startswith('http'):  # noqa
-        LOGGER.debug('zipfile is a local file')
-        with metadata_zipfile.open('rb') as fh:
-            zipfile_content = fh.read()
-    else:
-        LOGGER.debug('zipfile is a URL')
-        zipfile_content = urlopen(DISCOVERY_METADATA_ZIP).read()
+    mcfs = {}
+    hashes = {}
+    retired = set()
+    invalid = []
+
+    zipfile_content = get_metadata_zipfile_content(metadata_zipfile)
 
     with tempfile.TemporaryDirectory() as td:
         fh = BytesIO(zipfile_content)
@@ -94,6 +127,13 @@ def create_datasets_conf(metadata_zipfile: Union[Path, None],
                     LOGGER.debug('Skipping')
                     continue
 
+                if 'decommissioned' in str(path_object):
+                    LOGGER.debug('Decommissioned')
+                    identifier = get_wis2_identifier(path_object)
+                    if identifier is not None:
+                        retired.add(identifier)
+                    continue
+
                 try:
                     LOGGER.info(f'Processing {path_object}')
                     mcf = read_mcf(path_object)
@@ -102,6 +142,9 @@ def create_datasets_conf(metadata_zipfile: Union[Path, None],
                         _ = mcf['msc-metadata']['publish-to']['wmo-wis2']
                     except KeyError:
                         LOGGER.info('Metadata not in scope for publishing to WIS2')  # noqa
+                        if isinstance(mcf['msc-metadata'].get('publish-to'), dict):  # noqa
+                            LOGGER.debug('Metadata unpublished from WIS2')
+                            retired.add(mcf['metadata']['identifier'])
                         continue
 
                     if mcf['msc-metadata']['status'] not in ['completed', 'published']:  # noqa
@@ -129,27 +172,490 @@ def create_datasets_conf(metadata_zipfile: Union[Path, None],
                     except KeyError:
                         pass
 
+                    LOGGER.debug('Handling filename datetime regular expression')  # noqa
+                    datetime_regex = mcf['distribution']['amqps_eng-CAN'].get('msc-filename-datetime-regex')  # noqa
+                    if datetime_regex is not None:
+                        try:
+                            DatetimeExtractor(datetime_regex)
+                            dataset['msc-filename-datetime-regex'] = datetime_regex  # noqa
+                        except (re.error, ValueError) as err:
+                            LOGGER.warning(f'{path_object.name} invalid datetime regex: {err}')  # noqa
+
                     LOGGER.debug('Handling caching')
                     try:
                         dataset['cache'] = mcf['msc-metadata']['publish-to']['wmo-wis2'].get('cache', True)  # noqa
                     except KeyError:
                         pass
 
+                    LOGGER.debug('Handling priority and rate limit')
+                    dataset['priority'] = get_priority(mcf, dataset)
+                    try:
+                        rate_limit = mcf['msc-metadata']['publish-to']['wmo-wis2']['rate-limit']  # noqa
+                        dataset['rate-limit'] = rate_limit
+                    except (KeyError, TypeError):
+                        pass
+
                     datasets_conf['datasets'].append(dataset)
+                    mcfs[dataset['metadata-id']] = mcf
+                    hashes[dataset['metadata-id']] = get_mcf_hash(mcf)
 
-                except (yaml.parser.ParserError, yaml.scanner.ScannerError) as err:  # noqa
+                except (MCFReadError, yaml.parser.ParserError, yaml.scanner.ScannerError) as err:  # noqa
                     LOGGER.warning(f'{path_object.name} YAML parsing error: {err}')  # noqa
                     LOGGER.warning('Skipping')
+                    invalid.append(path_object.name)
                 except (KeyError, TypeError) as err:
                     LOGGER.warning(f'{path_object.name} key not defined: {err}')  # noqa
+                    invalid.append(path_object.name)
                 except AttributeError as err:
                     LOGGER.warning(f'{path_object.name} missing distribution: {err}')  # noqa
+                    invalid.append(path_object.name)
+
+    if invalid:
+        LOGGER.error(f"{len(invalid)} MCFs could not be processed (their published metadata is kept): {', '.join(invalid)}")  # noqa
+
+    LOGGER.debug('Detecting overlapping datasets')
+    pin_overlapping_datasets(datasets_conf['datasets'])
 
     LOGGER.debug(f'Dumping YAML document to {output}')
     with output.open('wb') as fh:
         yaml.dump(datasets_conf, fh, sort_keys=False, encoding='utf8',
                   indent=4, default_flow_style=False)
 
+    state = get_metadata_state_path(output, state)
+    published = load_metadata_state(state)
+
+    changes = diff_metadata_state(published, hashes, retired)
+    changes['failed'] = []
+
+    if not publish_metadata:
+        return changes
+
+    if not datasets_conf['datasets']:
+        LOGGER.error('No datasets found; not publishing metadata changes')
+        return changes
+
+    if not any(changes[operation] for operation in METADATA_OPERATIONS):
+        LOGGER.info('No metadata changes to publish')
+        return changes
+
+    summary = publish_metadata_changes(changes, mcfs)
+
+    for metadata_id in summary['published']:
+        if metadata_id in changes['delete']:
+            published.pop(metadata_id, None)
+        else:
+            published[metadata_id] = hashes[metadata_id]
+
+    LOGGER.debug(f'Saving metadata publication state to {state}')
+    save_metadata_state(state, published)
+
+    changes['failed'] = summary['failed']
+
+    return changes
+
+
+def get_priority(mcf: dict, dataset: dict) -> str:
+    """
+    Derives notification priority of dataset
+
+    :param mcf: `dict` of MCF
+    :param dataset: `dict` of dataset definition
+
+    :returns: `str` of priority (`high`, `normal` or `low`), from
+              `msc-metadata.publish-to.wmo-wis2.priority` if set, else
+              from WIS2 topic and media type
+    """
+
+    try:
+        priority = mcf['msc-metadata']['publish-to']['wmo-wis2']['priority']
+        if priority in PRIORITIES:
+            return priority
+        LOGGER.warning(f'Invalid priority {priority}; ignoring')
+    except (KeyError, TypeError):
+        pass
+
+    if any(t in dataset['wis2-topic'] for t in HIGH_PRIORITY_WIS2_TOPICS):
+        return 'high'
+
+    if dataset['media-type'] in LOW_PRIORITY_MEDIA_TYPES:
+        return 'low'
+
+    return 'normal'
+
+
+def datasets_overlap(dataset1: dict, dataset2: dict) -> bool:
+    """
+    Whether a data granule may match both datasets, in which case the
+    order in which datasets are tested determines the result
+
+    Directory path patterns (`*<path>*`) match any path containing their
+    path, so this is a best-effort heuristic: subtopics overlap when the
+    path of one contains the path of the other, or when the path of one
+    continues the other from one of its directories (e.g.
+    `*/WXO-DD/a/15km*` and `*/15km/grib2*` both match
+    `/WXO-DD/a/15km/grib2`).  Paths which are only both found in a path
+    repeating directories (e.g. `/WXO-DD/a/b/WXO-DD/a/c`) are considered
+    disjoint.  Regular expressions cannot be proven disjoint in general, so
+    datasets with overlapping subtopics are considered to overlap
+    regardless of their regexes.
+
+    :param dataset1: `dict` of dataset definition
+    :param dataset2: `dict` of dataset definition
+
+    :returns: `bool` of whether datasets overlap
+    """
+
+    dirpath1 = subtopic2dirpath(dataset1['subtopic'])
+    dirpath2 = subtopic2dirpath(dataset2['subtopic'])
+    path1 = dirpath1.strip('*')
+    path2 = dirpath2.strip('*')
+
+    if fnmatch(path1, dirpath2) or fnmatch(path2, dirpath1):
+        return True
+
+    for path, other in [(path1, path2), (path2, path1)]:
+        for i, char in enumerate(path):
+            if i > 0 and char == '/' and other.startswith(path[i:]):
+                return True
+
+    return False
+
+
+def pin_overlapping_datasets(datasets: list) -> int:
+    """
+    Set `pinned` on dataset definitions: overlapping datasets keep their
+    configuration order, other datasets may be reordered by the publisher
+    by match frequency
+
+    :param datasets: `list` of dataset definitions
+
+    :returns: `int` of number of pinned datasets
+    """
+
+    pinned = set()
+
+    for i, dataset1 in enumerate(datasets):
+        for dataset2 in datasets[i + 1:]:
+            if datasets_overlap(dataset1, dataset2):
+                LOGGER.debug(f"Overlapping datasets: {dataset1['metadata-id']}, {dataset2['metadata-id']}")  # noqa
+                pinned.update([id(dataset1), id(dataset2)])
+
+    for dataset in datasets:
+        dataset['pinned'] = id(dataset) in pinned
+
+    LOGGER.info(f'{len(pinned)} of {len(datasets)} datasets pinned')
+
+    return len(pinned)
+
+
+def get_mcf_hash(mcf: dict) -> str:
+    """
+    Generate content hash of an MCF
+
+    :param mcf: `dict` of MCF
+
+    :returns: `str` of SHA-256 hexdigest
+    """
+
+    content = json.dumps(mcf, sort_keys=True, default=str)
+
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def get_metadata_state_path(output: Path,
+                            state: Union[Path, None] = None) -> Path:
+    """
+    Derive path of metadata publication state
+
+    :param output: `Path` object of dataset definition configuration
+    :param state: `Path` object of metadata publication state (if set)
+
+    :returns: `Path` object of metadata publication state
+    """
+
+    if state is not None:
+        return state
+
+    if METADATA_STATE is not None:
+        return Path(METADATA_STATE)
+
+    return output.with_name(f'{output.stem}-metadata-state.yml')
+
+
+def load_metadata_state(state: Path) -> dict:
+    """
+    Read content hashes of published metadata
+
+    :param state: `Path` object of metadata publication state
+
+    :returns: `dict` of content hashes keyed by metadata identifier
+    """
+
+    if not state.exists():
+        LOGGER.info(f'No metadata publication state {state}')
+        return {}
+
+    with state.open() as fh:
+        return (yaml.safe_load(fh) or {}).get('metadata', {})
+
+
+def save_metadata_state(state: Path, published: dict) -> None:
+    """
+    Write content hashes of published metadata
+
+    :param state: `Path` object of metadata publication state
+    :param published: `dict` of content hashes keyed by metadata identifier
+
+    :returns: `None`
+    """
+
+    state.parent.mkdir(parents=True, exist_ok=True)
+
+    with state.open('w') as fh:
+        yaml.safe_dump({'metadata': published}, fh, default_flow_style=False)
+
+
+def diff_metadata_state(published: dict, current: dict,
+                        retired: Union[set, None] = None) -> dict:
+    """
+    Compare metadata content hashes to those of published metadata
+
+    Published metadata missing from the current metadata is only deleted
+    if retired (decommissioned or unpublished from WIS2); otherwise (e.g.
+    invalid MCF or status change) it is kept.
+
+    :param published: `dict` of content hashes of published metadata
+    :param current: `dict` of content hashes of current metadata
+    :param retired: `set` of metadata identifiers of retired metadata
+
+    :returns: `dict` of `list` of metadata identifiers to create, update
+              and delete
+    """
+
+    retired = retired or set()
+
+    changes = {
+        'create': [],
+        'update': [],
+        'delete': []
+    }
+
+    for identifier, hash_ in current.items():
+        if identifier not in published:
+            changes['create'].append(identifier)
+        elif published[identifier] != hash_:
+            changes['update'].append(identifier)
+
+    for identifier in published:
+        if identifier in current:
+            continue
+        if identifier in retired:
+            changes['delete'].append(identifier)
+        else:
+            LOGGER.warning(f'Published metadata {identifier} not found or not processed; not deleting')  # noqa
+
+    LOGGER.debug(f'Metadata changes: {changes}')
+
+    return changes
+
+
+def write_metadata_record(identifier: str, record: bytes) -> str:
+    """
+    Write a WCMP2 record to the metadata directory (served at
+    `MSC_WIS2NODE_METADATA_BASEURL`)
+
+    :param identifier: WCMP2 identifier
+    :param record: `bytes` of WCMP2 record
+
+    :returns: `str` of URL of record
+    """
+
+    check_environment('METADATA_DIRECTORY', 'METADATA_BASEURL')
+
+    filename = f'{identifier}.json'
+
+    directory = Path(METADATA_DIRECTORY)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    LOGGER.debug(f'Writing WCMP2 record to {directory / filename}')
+    (directory / filename).write_bytes(record)
+
+    return f"{METADATA_BASEURL.rstrip('/')}/{filename}"
+
+
+def create_metadata_message(identifier: str, record: bytes, url: str,
+                            operation: str = 'create') -> dict:
+    """
+    Generate a WIS2 Notification to create or update a metadata record,
+    with the WCMP2 record included inline if small enough
+
+    :param identifier: WCMP2 identifier
+    :param record: `bytes` of WCMP2 record
+    :param url: `str` of URL of WCMP2 record
+    :param operation: `str` of message operation (`create` or `update`)
+
+    :returns: `dict` of WIS2 Notification Message
+    """
+
+    topic = f'{TOPIC_PREFIX}/{CENTRE_ID}/metadata'
+
+    checksum_type = 'sha512'
+
+    url_info = {
+        'url': url,
+        'filename': identifier,
+        'checksum_type': checksum_type,
+        'checksum_value': generate_checksum(record, checksum_type),
+        'size': len(record)
+    }
+
+    message = create_message(
+        identifier=str(uuid.uuid4()),
+        metadata_id=identifier,
+        topic=topic,
+        content_type='application/geo+json',
+        url_info=url_info,
+        operation=operation
+    )
+
+    message['properties']['data_id'] = topic
+
+    if len(record) < MAX_INLINE_CONTENT_SIZE:
+        message['properties']['content'] = {
+            'encoding': 'utf-8',
+            'value': record.decode(),
+            'size': len(record)
+        }
+    else:
+        LOGGER.debug(f'WCMP2 record of {identifier} not inline ({len(record)} bytes)')  # noqa
+
+    return message
+
+
+def publish_metadata_changes(changes: dict, mcfs: dict) -> dict:
+    """
+    Publishes WIS2 Notifications of metadata changes in one broker session
+
+    :param changes: `dict` of metadata changes (see `diff_metadata_state`)
+    :param mcfs: `dict` of MCFs keyed by metadata identifier
+
+    :returns: `dict` of published and failed metadata identifiers
+    """
+
+    messages = []
+    failed = []
+
+    if changes['create'] or changes['update']:
+        check_environment('METADATA_DIRECTORY', 'METADATA_BASEURL')
+
+    for operation in ['create', 'update']:
+        for metadata_id in changes[operation]:
+            identifier = f'urn:wmo:md:{CENTRE_ID}:{metadata_id}'
+            try:
+                record = WMOWCMP2OutputSchema().write(mcfs[metadata_id]).encode()  # noqa
+                url = write_metadata_record(identifier, record)
+                message = create_metadata_message(identifier, record, url,
+                                                  operation)
+            except Exception as err:
+                LOGGER.error(f'Cannot generate WCMP2 for {metadata_id}: {err}')  # noqa
+                failed.append(metadata_id)
+                continue
+
+            messages.append((metadata_id, message))
+
+    for metadata_id in changes['delete']:
+        identifier = f'urn:wmo:md:{CENTRE_ID}:{metadata_id}'
+        messages.append(
+            (metadata_id, create_metadata_deletion_message(identifier)))
+
+    summary = {
+        'published': [],
+        'failed': []
+    }
+
+    if messages:
+        summary = publish_metadata_messages(messages)
+
+    summary['failed'].extend(failed)
+
+    return summary
+
+
+def get_metadata_zipfile_content(metadata_zipfile: Union[Path, None]) -> bytes:  # noqa
+    """
+    Read zipfile of MCF repository
+
+    :param metadata_zipfile: path to zipfile of MCF repository (if `None`,
+                             `MSC_WIS2NODE_DISCOVERY_METADATA_ZIP` is used)
+
+    :returns: `bytes` of zipfile content
+    """
+
+    if metadata_zipfile is None:
+        check_environment('DISCOVERY_METADATA_ZIP')
+
+    if metadata_zipfile is None and DISCOVERY_METADATA_ZIP.startswith('http'):
+        LOGGER.debug('zipfile is a URL')
+        return urlopen(DISCOVERY_METADATA_ZIP).read()
+
+    LOGGER.debug('zipfile is a local file')
+    with Path(metadata_zipfile or DISCOVERY_METADATA_ZIP).open('rb') as fh:
+        return fh.read()
+
+
+def get_wis2_identifier(path_object: Path) -> Union[str, None]:
+    """
+    Read metadata identifier of an MCF published to WIS2
+
+    :param path_object: `Path` object of MCF
+
+    :returns: `str` of metadata identifier, or `None` if the MCF is invalid
+              or not published to WIS2
+    """
+
+    try:
+        mcf = read_mcf(path_object)
+        _ = mcf['msc-metadata']['publish-to']['wmo-wis2']
+        return mcf['metadata']['identifier']
+    except (MCFReadError, yaml.parser.ParserError, yaml.scanner.ScannerError) as err:  # noqa
+        LOGGER.warning(f'{path_object.name} MCF parsing error: {err}')
+    except (KeyError, TypeError):
+        LOGGER.debug('Metadata not published to WIS2; skipping')
+
+    return None
+
+
+def get_decommissioned_identifiers(metadata_zipfile: Union[Path, None]) -> list:  # noqa
+    """
+    Derive WCMP2 identifiers of decommissioned datasets previously
+    published to WIS2
+
+    :param metadata_zipfile: path to zipfile of MCF repository
+
+    :returns: `list` of WCMP2 identifiers
+    """
+
+    identifiers = []
+
+    zipfile_content = get_metadata_zipfile_content(metadata_zipfile)
+
+    with tempfile.TemporaryDirectory() as td:
+        with zipfile.ZipFile(BytesIO(zipfile_content)) as z:
+            LOGGER.debug(f'Extracting all MCFs to {td}')
+            z.extractall(td)
+
+            for path_object in Path(td).rglob('mcf/**/decommissioned/**/*.yml'):  # noqa
+                LOGGER.debug(f'Path: {path_object}')
+                identifier = get_wis2_identifier(path_object)
+                if identifier is None:
+                    continue
+
+                identifier = f'urn:wmo:md:{CENTRE_ID}:{identifier}'
+                if identifier not in identifiers:
+                    identifiers.append(identifier)
+
+    return identifiers
+
 
 def get_format(distribution: dict) -> Union[str, None]:
     """
@@ -172,19 +678,25 @@ def get_format(distribution: dict) -> Union[str, None]:
     return format_
 
 
-def delete_metadata_record(identifier: str) -> bool:
+def create_metadata_deletion_message(identifier: str) -> dict:
     """
-    Publishes a WIS2 Notification to delete a metadata record
+    Generate a WIS2 Notification to delete a metadata record
 
     :param identifier: WCMP2 identifier
 
-    :returns: `bool` of message publishing result
+    :returns: `dict` of WIS2 Notification Message
     """
 
     topic = f'{TOPIC_PREFIX}/{CENTRE_ID}/metadata'
     LOGGER.debug(f'Topic: {topic}')
 
-    url_info = get_url_info('https://dd.weather.gc.ca')
+    url_info = {
+        'url': 'https://dd.weather.gc.ca',
+        'filename': identifier,
+        'checksum_type': None,
+        'checksum_value': None,
+        'size': 0
+    }
 
     message = create_message(
         identifier=str(uuid.uuid4()),
@@ -211,21 +723,77 @@ def delete_metadata_record(identifier: str) -> bool:
 
     LOGGER.debug(f'Message: {message}')
 
-    publish.single(
-        topic,
-        payload=json.dumps(message),
-        qos=1,
-        hostname=BROKER_HOSTNAME,
-        port=BROKER_PORT,
-        client_id=get_mqtt_client_id(),
-        tls=get_mqtt_tls_settings(),
-        auth={
-            'username': BROKER_USERNAME,
-            'password': BROKER_PASSWORD
-        }
-    )
+    return message
+
+
+def delete_metadata_records(identifiers: list) -> dict:
+    """
+    Publishes WIS2 Notifications to delete metadata records over a single
+    broker connection
+
+    :param identifiers: `list` of WCMP2 identifiers
+
+    :returns: `dict` of published and failed identifiers
+    """
+
+    return publish_metadata_messages(
+        [(i, create_metadata_deletion_message(i)) for i in identifiers])
+
+
+def publish_metadata_messages(messages: list) -> dict:
+    """
+    Publishes metadata WIS2 Notifications over a single connection per
+    broker.  A notification is published if at least one broker confirms
+    it.
+
+    :param messages: `list` of identifier (e.g. WCMP2 identifier) and
+                     message pairs
+
+    :returns: `dict` of published and failed identifiers
+    """
+
+    check_environment('CENTRE_ID', 'WIS2_GDC')
+
+    topic = f'{TOPIC_PREFIX}/{CENTRE_ID}/metadata'
 
-    return True
+    summary = {
+        'published': [],
+        'failed': []
+    }
+
+    payloads = [(topic, json.dumps(message)) for _, message in messages]
+    results = [False] * len(messages)
+
+    for target in get_broker_targets():
+        try:
+            with MQTTPublisher(**target) as mqtt_publisher:
+                broker_results = mqtt_publisher.publish_many(payloads, qos=1)
+        except (OSError, ConnectionError) as err:
+            LOGGER.error(f"Broker {target['hostname']} unavailable: {err}")
+            continue
+
+        results = [a or b for a, b in zip(results, broker_results)]
+
+    for (identifier, message), result in zip(messages, results):
+        if result:
+            summary['published'].append(identifier)
+        else:
+            LOGGER.error(f'Failed to publish metadata notification for {identifier}')  # noqa
+            summary['failed'].append(identifier)
+
+    return summary
+
+
+def delete_metadata_record(identifier: str) -> bool:
+    """
+    Publishes a WIS2 Notification to delete a metadata record
+
+    :param identifier: WCMP2 identifier
+
+    :returns: `bool` of message publishing result
+    """
+
+    return not delete_metadata_records([identifier])['failed']
 
 
 @click.group()
@@ -242,12 +810,31 @@ def dataset():
 @click.option('--metadata-zipfile', '-mz',
               type=click.Path(exists=True, dir_okay=False, path_type=Path),
               help='Zipfile of discovery metadata repository')
-def setup(ctx, metadata_zipfile, output, verbosity):
+@click.option('--publish-metadata', is_flag=True, default=False,
+              help='Publish WIS2 Notifications for changed metadata')
+@click.option('--metadata-state',
+              type=click.Path(dir_okay=False, path_type=Path),
+              help='Metadata publication state (default is '
+                   '<output>-metadata-state.yml)')
+def setup(ctx, metadata_zipfile, output, publish_metadata, metadata_state,
+          verbosity):
     """Setup dataset definitions"""
 
     click.echo('Setting up runtime dataset definition configuration')
 
-    create_datasets_conf(metadata_zipfile, Path(output or DATASET_CONFIG))
+    if output is None:
+        check_environment('DATASET_CONFIG')
+
+    changes = create_datasets_conf(metadata_zipfile,
+                                   Path(output or DATASET_CONFIG),
+                                   publish_metadata, metadata_state)
+
+    for operation in METADATA_OPERATIONS:
+        click.echo(f'Metadata to {operation}: {len(changes[operation])}')
+
+    if changes['failed']:
+        raise click.ClickException(
+            f"Failed to publish metadata: {', '.join(changes['failed'])}")
 
     click.echo('Done')
 
@@ -255,16 +842,49 @@ def setup(ctx, metadata_zipfile, output, verbosity):
 @click.command()
 @click.pass_context
 @cli_options.OPTION_VERBOSITY
-@click.option('--identifier', '-i', help='Metadata identifier')
-def delete_metadata(ctx, identifier, verbosity):
-    """Delete metadata record"""
+@click.option('--identifier', '-i', 'identifiers', multiple=True,
+              help='Metadata identifier (can be repeated)')
+@click.option('--identifier-file', '-if', type=click.File('r'),
+              help='File of metadata identifiers (one per line)')
+@click.option('--decommissioned', is_flag=True, default=False,
+              help='Delete all WIS2 metadata records of decommissioned MCFs')
+@click.option('--metadata-zipfile', '-mz',
+              type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='Zipfile of discovery metadata repository')
+def delete_metadata(ctx, identifiers, identifier_file, decommissioned,
+                    metadata_zipfile, verbosity):
+    """Delete metadata records"""
+
+    identifiers = list(identifiers)
+
+    if identifier_file is not None:
+        identifiers.extend([line.strip() for line in identifier_file
+                            if line.strip() and not line.startswith('#')])
+
+    if decommissioned:
+        click.echo('Deriving identifiers of decommissioned metadata')
+        identifiers.extend(get_decommissioned_identifiers(metadata_zipfile))
+
+    identifiers = list(dict.fromkeys(identifiers))
+
+    if not identifiers:
+        raise click.ClickException(
+            'Missing metadata identifier(s) (-i, -if or --decommissioned)')
+
+    click.echo(f'Deleting {len(identifiers)} metadata record(s)')
+
+    summary = delete_metadata_records(identifiers)
 
-    if identifier is None:
-        raise click.ClickException('Missing metadata identifier (-i)')
+    for identifier in summary['published']:
+        click.echo(f'Deleted: {identifier}')
+    for identifier in summary['failed']:
+        click.echo(f'Failed: {identifier}')
 
-    click.echo(f'Deleting metadata record {identifier}')
+    click.echo(f"Published: {len(summary['published'])}, "
+               f"failed: {len(summary['failed'])}")
 
-    delete_metadata_record(identifier)
+    if summary['failed']:
+        raise click.ClickException('Some metadata deletions failed')
 
     click.echo('Done')
 
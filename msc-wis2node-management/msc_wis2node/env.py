@@ -27,17 +27,54 @@ BROKER_HOSTNAME = os.environ.get('MSC_WIS2NODE_BROKER_HOSTNAME')
 BROKER_PORT = int(os.environ.get('MSC_WIS2NODE_BROKER_PORT', 8883))
 BROKER_USERNAME = os.environ.get('MSC_WIS2NODE_BROKER_USERNAME')
 BROKER_PASSWORD = os.environ.get('MSC_WIS2NODE_BROKER_PASSWORD')
+BROKER_TARGETS = os.environ.get('MSC_WIS2NODE_BROKER_TARGETS')
+BROKER_RETRY_INTERVAL = int(os.environ.get('MSC_WIS2NODE_BROKER_RETRY_INTERVAL', 30))  # noqa
 MSC_DATAMART_AMQP = os.environ.get('MSC_WIS2NODE_MSC_DATAMART_AMQP')
 DATASET_CONFIG = os.environ.get('MSC_WIS2NODE_DATASET_CONFIG')
+METADATA_STATE = os.environ.get('MSC_WIS2NODE_METADATA_STATE')
+METADATA_DIRECTORY = os.environ.get('MSC_WIS2NODE_METADATA_DIRECTORY')
+METADATA_BASEURL = os.environ.get('MSC_WIS2NODE_METADATA_BASEURL')
 TOPIC_PREFIX = os.environ.get('MSC_WIS2NODE_TOPIC_PREFIX', 'origin/a/wis2')
 DISCOVERY_METADATA_ZIP = os.environ.get('MSC_WIS2NODE_DISCOVERY_METADATA_ZIP')
 CACHE = os.environ.get('MSC_WIS2NODE_CACHE')
 CACHE_EXPIRY_SECONDS = int(os.environ.get('MSC_WIS2NODE_CACHE_EXPIRY_SECONDS',86400))  # noqa
+CACHE_SOCKET_TIMEOUT = float(os.environ.get('MSC_WIS2NODE_CACHE_SOCKET_TIMEOUT', 0.5))  # noqa
+CACHE_FAILURE_THRESHOLD = int(os.environ.get('MSC_WIS2NODE_CACHE_FAILURE_THRESHOLD', 3))  # noqa
+CACHE_RETRY_INTERVAL = int(os.environ.get('MSC_WIS2NODE_CACHE_RETRY_INTERVAL', 30))  # noqa
+DUPLICATE_WINDOW_SECONDS = int(os.environ.get('MSC_WIS2NODE_DUPLICATE_WINDOW_SECONDS', 600))  # noqa
+DATASET_REORDER_INTERVAL = int(os.environ.get('MSC_WIS2NODE_DATASET_REORDER_INTERVAL', 10000))  # noqa
+PROFILE_SAMPLE_RATE = float(os.environ.get('MSC_WIS2NODE_PROFILE_SAMPLE_RATE', 0))  # noqa
+PROFILE_DIRECTORY = os.environ.get('MSC_WIS2NODE_PROFILE_DIRECTORY', '/tmp/msc-wis2node-profiles')  # noqa
+PROFILE_DUMP_INTERVAL = int(os.environ.get('MSC_WIS2NODE_PROFILE_DUMP_INTERVAL', 300))  # noqa
+PROFILE_MAX_DUMPS = int(os.environ.get('MSC_WIS2NODE_PROFILE_MAX_DUMPS', 12))  # noqa
+VALIDATION_SAMPLE_RATE = float(os.environ.get('MSC_WIS2NODE_VALIDATION_SAMPLE_RATE', 0))  # noqa
+VALIDATION_SCHEMA = os.environ.get('MSC_WIS2NODE_VALIDATION_SCHEMA')
+METRICS_FLUSH_INTERVAL = int(os.environ.get('MSC_WIS2NODE_METRICS_FLUSH_INTERVAL', 60))  # noqa
+METRICS_FLUSH_MAX_MESSAGES = int(os.environ.get('MSC_WIS2NODE_METRICS_FLUSH_MAX_MESSAGES', 1000))  # noqa
+HEALTH_PORT = int(os.environ.get('MSC_WIS2NODE_HEALTH_PORT', 8080))
+HEALTH_REPORT_INTERVAL = int(os.environ.get('MSC_WIS2NODE_HEALTH_REPORT_INTERVAL', 10))  # noqa
+HEALTH_MAX_LAG_SECONDS = float(os.environ.get('MSC_WIS2NODE_HEALTH_MAX_LAG_SECONDS', 300))  # noqa
+HEALTH_MAX_IDLE_SECONDS = float(os.environ.get('MSC_WIS2NODE_HEALTH_MAX_IDLE_SECONDS', 900))  # noqa
 CENTRE_ID = os.environ.get('MSC_WIS2NODE_CENTRE_ID')
 WIS2_GDC = os.environ.get('MSC_WIS2NODE_WIS2_GDC')
 
-if None in [BROKER_HOSTNAME, BROKER_PORT, BROKER_USERNAME, BROKER_PASSWORD,
-            MSC_DATAMART_AMQP, DATASET_CONFIG, TOPIC_PREFIX, WIS2_GDC]:
-    msg = 'Environment variables not set!'
-    LOGGER.error(msg)
-    raise EnvironmentError(msg)
+
+def check_environment(*settings: str) -> None:
+    """
+    Ensure that settings are set from their environment variables
+
+    Settings are only validated by the functionality that requires them,
+    so that commands only need the environment they actually use.
+
+    :param settings: names of settings (e.g. `BROKER_HOSTNAME`)
+
+    :returns: `None`
+    """
+
+    missing = [f'MSC_WIS2NODE_{setting}' for setting in settings
+               if globals()[setting] is None]
+
+    if missing:
+        msg = f"Environment variables not set! ({', '.join(missing)})"
+        LOGGER.error(msg)
+        raise EnvironmentError(msg)
@@ -0,0 +1,410 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from typing import Union
+
+import click
+import redis
+
+from msc_wis2node import cli_options
+from msc_wis2node.env import (CACHE, HEALTH_MAX_IDLE_SECONDS,
+                              HEALTH_MAX_LAG_SECONDS, HEALTH_PORT,
+                              HEALTH_REPORT_INTERVAL, check_environment)
+
+LOGGER = logging.getLogger(__name__)
+
+HEALTH_KEY_PREFIX = 'health_'
+WINDOWS = [60, 300, 900]
+
+# statuses reported as unhealthy (idle instances may just have nothing to
+# publish)
+UNHEALTHY_STATUSES = ['down', 'lagging']
+
+
+class HealthMonitor:
+    """
+    Recent publishing activity of an instance
+
+    Published messages are counted in a ring buffer of one second buckets
+    (`[second, published, failed, lagged, lag sum, lag max]`) spanning the
+    largest window.  Every `report_interval` seconds, a snapshot of rates
+    and Datamart-to-publish lag over each window is written to the cache
+    (`health_<hostname>-<pid>`), expiring if the instance stops reporting.
+    """
+
+    def __init__(self, cache, report_interval: int = HEALTH_REPORT_INTERVAL,
+                 windows: Union[list, None] = None):
+        """
+        initialize
+
+        :param cache: `msc_wis2node.cache.Cache` (snapshots are written to
+                      it)
+        :param report_interval: `int` of seconds between snapshots
+        :param windows: `list` of rolling windows in seconds (default is
+                        `WINDOWS`)
+
+        :returns: `None`
+        """
+
+        self.cache = cache
+        self.report_interval = report_interval
+        self.windows = sorted(windows or WINDOWS)
+        self.instance = f'{socket.gethostname()}-{os.getpid()}'
+        self.key = f'{HEALTH_KEY_PREFIX}{self.instance}'
+
+        self.buckets = deque(maxlen=self.windows[-1])
+        self.started = time.time()
+        self.last_publish = None
+        self.last_lag = None
+        self.published = 0
+        self.failed = 0
+        self.last_report = time.monotonic()
+
+    def _bucket(self, now: float) -> list:
+        second = int(now)
+
+        if not self.buckets or self.buckets[-1][0] != second:
+            self.buckets.append([second, 0, 0, 0, 0.0, 0.0])
+
+        return self.buckets[-1]
+
+    def record(self, pubtime: Union[float, None] = None) -> None:
+        """
+        Record a published message
+
+        :param pubtime: `float` of Datamart publication time of the message
+                        (seconds since the epoch), if known
+
+        :returns: `None`
+        """
+
+        now = time.time()
+        bucket = self._bucket(now)
+
+        bucket[1] += 1
+        self.published += 1
+        self.last_publish = now
+
+        if pubtime is not None:
+            lag = max(now - pubtime, 0)
+            bucket[3] += 1
+            bucket[4] += lag
+            bucket[5] = max(bucket[5], lag)
+            self.last_lag = lag
+
+    def record_failure(self) -> None:
+        """
+        Record a message which failed to publish
+
+        :returns: `None`
+        """
+
+        self._bucket(time.time())[2] += 1
+        self.failed += 1
+
+    def snapshot(self, queue_depth: int = 0,
+                 brokers: Union[list, None] = None) -> dict:
+        """
+        Summarize recent activity over each window
+
+        :param queue_depth: `int` of messages pending publication
+        :param brokers: `list` of broker status (`BrokerFanout.status`)
+
+        :returns: `dict` of instance health
+        """
+
+        now = time.time()
+        uptime = max(now - self.started, 1)
+
+        last_publish = last_lag = None
+        if self.last_publish is not None:
+            last_publish = round(self.last_publish, 3)
+        if self.last_lag is not None:
+            last_lag = round(self.last_lag, 3)
+
+        rates = {}
+        lags = {}
+
+        for window in self.windows:
+            since = int(now) - window
+            published = failed = lagged = 0
+            lag_sum = lag_max = 0.0
+
+            for second, published_, failed_, lagged_, lag_sum_, lag_max_ in reversed(self.buckets):  # noqa
+                if second <= since:
+                    break
+                published += published_
+                failed += failed_
+                lagged += lagged_
+                lag_sum += lag_sum_
+                lag_max = max(lag_max, lag_max_)
+
+            key = f'{window}s'
+            rates[key] = {
+                'published': round(published / min(window, uptime), 3),
+                'failed': round(failed / min(window, uptime), 3)
+            }
+            lags[key] = {
+                'mean': round(lag_sum / lagged, 3) if lagged else None,
+                'max': round(lag_max, 3) if lagged else None
+            }
+
+        return {
+            'instance': self.instance,
+            'started': round(self.started, 3),
+            'updated': round(now, 3),
+            'last_publish': last_publish,
+            'published': self.published,
+            'failed': self.failed,
+            'queue_depth': queue_depth,
+            'messages_per_second': rates,
+            'lag_seconds': lags,
+            'last_lag_seconds': last_lag,
+            'brokers': brokers or []
+        }
+
+    @property
+    def due(self) -> bool:
+        """
+        Whether the report interval has elapsed
+
+        :returns: `bool` of whether a snapshot is due
+        """
+
+        return time.monotonic() - self.last_report >= self.report_interval
+
+    def report(self, queue_depth: int = 0,
+               brokers: Union[list, None] = None) -> None:
+        """
+        Write snapshot to the cache
+
+        :param queue_depth: `int` of messages pending publication
+        :param brokers: `list` of broker status (`BrokerFanout.status`)
+
+        :returns: `None`
+        """
+
+        self.last_report = time.monotonic()
+
+        snapshot = self.snapshot(queue_depth, brokers)
+        self.cache.set(self.key, json.dumps(snapshot),
+                       ex=max(self.report_interval * 6, 60))
+
+    def clear(self) -> None:
+        """
+        Remove snapshot from the cache (when the instance stops)
+
+        :returns: `None`
+        """
+
+        self.cache.delete(self.key)
+
+    def __repr__(self):
+        return f'<HealthMonitor {self.instance}>'
+
+
+def evaluate_instance(snapshot: dict, now: float,
+                      max_lag: float = HEALTH_MAX_LAG_SECONDS,
+                      max_idle: float = HEALTH_MAX_IDLE_SECONDS) -> str:
+    """
+    Evaluate the status of an instance
+
+    :param snapshot: `dict` of instance health
+    :param now: `float` of current time (seconds since the epoch)
+    :param max_lag: `float` of maximum mean lag over the shortest window
+    :param max_idle: `float` of maximum seconds since the last publish
+
+    :returns: `str` of status (`ok`, `lagging` or `idle`)
+    """
+
+    lag = next(iter(snapshot['lag_seconds'].values()))['mean']
+    if lag is not None and lag > max_lag:
+        return 'lagging'
+
+    last_activity = snapshot['last_publish'] or snapshot['started']
+    if now - last_activity > max_idle:
+        return 'idle'
+
+    return 'ok'
+
+
+def get_health(max_lag: float = HEALTH_MAX_LAG_SECONDS,
+               max_idle: float = HEALTH_MAX_IDLE_SECONDS) -> dict:
+    """
+    Report health and lag of all publishing instances
+
+    :param max_lag: `float` of maximum mean lag over the shortest window
+    :param max_idle: `float` of maximum seconds since the last publish
+
+    :returns: `dict` of overall status (`ok`, `idle`, `lagging` or
+              `down`), totals and instances
+    """
+
+    check_environment('CACHE')
+
+    now = time.time()
+    instances = []
+
+    try:
+        r = redis.Redis().from_url(CACHE)
+        keys = list(r.scan_iter(f'{HEALTH_KEY_PREFIX}*'))
+        values = r.mget(keys) if keys else []
+    except redis.RedisError as err:
+        LOGGER.error(f'Cannot read instance health: {err}')
+        return {'status': 'down', 'error': str(err), 'instances': []}
+
+    for value in values:
+        if value is None:
+            continue
+
+        try:
+            snapshot = json.loads(value)
+            snapshot['status'] = evaluate_instance(snapshot, now, max_lag,
+                                                   max_idle)
+        except (ValueError, KeyError, TypeError) as err:
+            LOGGER.warning(f'Invalid instance health: {err}')
+            continue
+
+        snapshot['seconds_since_update'] = round(now - snapshot['updated'], 3)
+        if snapshot['last_publish'] is not None:
+            snapshot['seconds_since_last_publish'] = round(
+                now - snapshot['last_publish'], 3)
+
+        instances.append(snapshot)
+
+    instances.sort(key=lambda i: i['instance'])
+
+    statuses = [i['status'] for i in instances]
+
+    if not instances:
+        status = 'down'
+    elif 'lagging' in statuses:
+        status = 'lagging'
+    elif 'idle' in statuses:
+        status = 'idle'
+    else:
+        status = 'ok'
+
+    windows = instances[0]['messages_per_second'] if instances else {}
+    lags = [i['lag_seconds'][window]['max'] for i in instances
+            for window in windows]
+
+    return {
+        'status': status,
+        'instances_total': len(instances),
+        'queue_depth': sum(i['queue_depth'] for i in instances),
+        'messages_per_second': {
+            window: round(sum(i['messages_per_second'][window]['published']
+                              for i in instances), 3)
+            for window in windows
+        },
+        'max_lag_seconds': max([lag for lag in lags if lag is not None],
+                               default=None),
+        'instances': instances
+    }
+
+
+class HealthRequestHandler(BaseHTTPRequestHandler):
+    """Health endpoint (`/health`): HTTP 503 if down or lagging, else 200"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/health']:
+            self.send_error(404)
+            return
+
+        report = get_health(self.server.max_lag, self.server.max_idle)
+        body = json.dumps(report, indent=4).encode()
+
+        if report['status'] in UNHEALTHY_STATUSES:
+            self.send_response(503)
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+
+@click.group()
+def health():
+    """Health and lag monitoring"""
+
+    pass
+
+
+@click.command()
+@click.pass_context
+@cli_options.OPTION_VERBOSITY
+@click.option('--max-lag', default=HEALTH_MAX_LAG_SECONDS, type=float,
+              help='Maximum mean Datamart-to-publish lag (seconds)')
+@click.option('--max-idle', default=HEALTH_MAX_IDLE_SECONDS, type=float,
+              help='Maximum time since the last publish (seconds)')
+def get(ctx, max_lag, max_idle, verbosity):
+    """Get health and lag of publishing instances (exits 1 if down or lagging)"""  # noqa
+
+    report = get_health(max_lag, max_idle)
+    click.echo(json.dumps(report, indent=4))
+
+    if report['status'] in UNHEALTHY_STATUSES:
+        sys.exit(1)
+
+
+@click.command()
+@click.pass_context
+@cli_options.OPTION_VERBOSITY
+@click.option('--host', default='0.0.0.0', help='Host to listen on')
+@click.option('--port', '-p', default=HEALTH_PORT, type=int,
+              help='Port to listen on')
+@click.option('--max-lag', default=HEALTH_MAX_LAG_SECONDS, type=float,
+              help='Maximum mean Datamart-to-publish lag (seconds)')
+@click.option('--max-idle', default=HEALTH_MAX_IDLE_SECONDS, type=float,
+              help='Maximum time since the last publish (seconds)')
+def serve(ctx, host, port, max_lag, max_idle, verbosity):
+    """Serve health and lag endpoint"""
+
+    check_environment('CACHE')
+
+    server = ThreadingHTTPServer((host, port), HealthRequestHandler)
+    server.max_lag = max_lag
+    server.max_idle = max_idle
+
+    click.echo(f'Serving health endpoint on http://{host}:{port}/health')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+health.add_command(get)
+health.add_command(serve)
@@ -18,42 +18,61 @@
 
 ###############################################################################
 
+from datetime import date, datetime, timedelta, timezone
+import gzip
 import json
 import logging
+from pathlib import Path
+import re
+from typing import Union
 
 import click
 import redis
 import yaml
 
 from msc_wis2node import cli_options
-from msc_wis2node.env import CACHE, DATASET_CONFIG, WIS2_GDC
+from msc_wis2node.env import (CACHE, DATASET_CONFIG, WIS2_GDC,
+                              check_environment)
 
 LOGGER = logging.getLogger(__name__)
 
 DATASET_METRICS_KEY_PATTERN = 'metrics_20*'
 TOTAL_METRICS_KEY_PATTERN = 'metrics_total_20*'
 
+DAILY_METRICS_FILENAME_REGEX = re.compile(r'^\d{4}-\d{2}-\d{2}\.json$')
+DATASET_PROPERTIES = ['title', 'wis2-topic', 'gdc-url']
+BYTE_UNITS = {'Kb': 1, 'Mb': 2, 'Gb': 3, 'Tb': 4, 'Pb': 5, 'Eb': 6}
 
-def get_metrics() -> dict:
+
+def get_metrics(raw: bool = False) -> dict:
     """
-    Export and purge data distribution metrics
+    Export data distribution metrics of the current day
 
-    :returns: `None`
+    Metrics of previous days still in the cache (e.g. flushed after
+    `metrics delete` at midnight) are ignored.
+
+    :param raw: whether to report bytes as numbers instead of human
+                readable values
+
+    :returns: `dict` of metrics
     """
 
+    check_environment('CACHE', 'DATASET_CONFIG', 'WIS2_GDC')
+
     metrics = {}
     gdc_baseurl = f'{WIS2_GDC}/items/urn:wmo:md:ca-eccc-msc:'
+    today = datetime.today().strftime('%Y-%m-%d')
 
     r = redis.Redis().from_url(CACHE)
 
-    for key in r.scan_iter(DATASET_METRICS_KEY_PATTERN):
+    for key in r.scan_iter(f'metrics_{today}_*'):
         LOGGER.debug(f'Key: {key}')
 
         _, _, dataset, metric = key.decode().split('_')
 
         dataset = dataset.split(':')[-1]
 
-        if metric.endswith('bytes'):
+        if metric.endswith('bytes') and not raw:
             value = prettybytes(int(r.get(key)))
         else:
             value = int(r.get(key))
@@ -76,11 +95,17 @@ def get_metrics() -> dict:
                 metrics[ds['metadata-id']]['wis2-topic'] = topic
                 metrics[ds['metadata-id']]['gdc-url'] = url
 
-    for key in r.scan_iter(f'{TOTAL_METRICS_KEY_PATTERN}files'):
+    total_files = 0
+    total_bytes = 0
+
+    for key in r.scan_iter(f'metrics_total_{today}_files'):
         total_files = int(r.get(key))
 
-    for key in r.scan_iter(f'{TOTAL_METRICS_KEY_PATTERN}bytes'):
-        total_bytes = prettybytes(int(r.get(key)))
+    for key in r.scan_iter(f'metrics_total_{today}_bytes'):
+        total_bytes = int(r.get(key))
+
+    if not raw:
+        total_bytes = prettybytes(total_bytes)
 
     metrics['total'] = {
         'bytes': total_bytes,
@@ -92,15 +117,26 @@ def get_metrics() -> dict:
 
 def delete_metrics() -> None:
     """
-    Delete metrics against a given pattern
+    Delete dataset and total metrics of previous days
+
+    Metrics of the current day are kept, so that counters of the previous
+    day flushed late by publishers are deleted at the next run instead of
+    being reported as current.
 
     :returns: `None`
     """
 
+    check_environment('CACHE')
+
+    today = datetime.today().strftime('%Y-%m-%d')
+
     r = redis.Redis().from_url(CACHE)
-    for key in r.scan_iter(DATASET_METRICS_KEY_PATTERN):
-        LOGGER.debug(f'Deleting key: {key}')
-        r.delete(key)
+    for pattern in [DATASET_METRICS_KEY_PATTERN, TOTAL_METRICS_KEY_PATTERN]:
+        for key in r.scan_iter(pattern):
+            if f'_{today}_' in key.decode():
+                continue
+            LOGGER.debug(f'Deleting key: {key}')
+            r.delete(key)
 
 
 def prettybytes(numbytes: int) -> str:
@@ -138,6 +174,340 @@ def prettybytes(numbytes: int) -> str:
     return f'{value} {to}'
 
 
+def parse_bytes(value) -> int:
+    """
+    Convert a byte count (number or `prettybytes` value) to bytes
+
+    :param value: `int` of bytes or `str` of human readable bytesize
+
+    :returns: `int` of bytes
+    """
+
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    number, unit = value.split()
+
+    return int(float(number) * 1024 ** BYTE_UNITS[unit])
+
+
+def load_daily_metrics(directory: Path) -> dict:
+    """
+    Load daily metrics files (`YYYY-MM-DD.json`, as written by
+    `metrics get`) with numeric values
+
+    :param directory: `Path` of metrics directory
+
+    :returns: `dict` of daily metrics keyed by `datetime.date`
+    """
+
+    daily_metrics = {}
+
+    for path in sorted(directory.iterdir()):
+        if not DAILY_METRICS_FILENAME_REGEX.match(path.name):
+            continue
+
+        LOGGER.debug(f'Reading {path}')
+        try:
+            with path.open() as fh:
+                content = json.load(fh)
+        except json.decoder.JSONDecodeError as err:
+            LOGGER.warning(f'Invalid metrics file {path.name}: {err}')
+            continue
+
+        if not isinstance(content, dict):
+            LOGGER.warning(f'Invalid metrics file {path.name}: not an object')  # noqa
+            continue
+
+        day = {
+            'datasets': {},
+            'total': {'files': 0, 'bytes': 0}
+        }
+
+        for key, values in content.items():
+            if not isinstance(values, dict):
+                LOGGER.warning(f'Invalid metrics of {key} in {path.name}')
+                continue
+
+            numeric = {
+                'files': int(values.get('files', 0)),
+                'bytes': parse_bytes(values.get('bytes', 0))
+            }
+
+            if key == 'total':
+                day['total'] = numeric
+                continue
+
+            for property_ in DATASET_PROPERTIES:
+                if property_ in values:
+                    numeric[property_] = values[property_]
+
+            day['datasets'][key] = numeric
+
+        daily_metrics[date.fromisoformat(path.stem)] = day
+
+    return daily_metrics
+
+
+def rollup_metrics(period: str, daily_metrics: dict) -> dict:
+    """
+    Aggregate daily metrics over a period
+
+    :param period: `str` of period name
+    :param daily_metrics: `dict` of daily metrics keyed by `datetime.date`
+
+    :returns: `dict` of aggregated metrics
+    """
+
+    days = sorted(daily_metrics)
+
+    rollup = {
+        'period': period,
+        'start': days[0].isoformat(),
+        'end': days[-1].isoformat(),
+        'days': len(days),
+        'datasets': {},
+        'total': {'files': 0, 'bytes': 0}
+    }
+
+    for day in days:
+        for dataset, values in daily_metrics[day]['datasets'].items():
+            if dataset not in rollup['datasets']:
+                rollup['datasets'][dataset] = {'files': 0, 'bytes': 0}
+
+            rollup['datasets'][dataset]['files'] += values['files']
+            rollup['datasets'][dataset]['bytes'] += values['bytes']
+
+            for property_ in DATASET_PROPERTIES:
+                if property_ in values:
+                    rollup['datasets'][dataset][property_] = values[property_]
+
+        rollup['total']['files'] += daily_metrics[day]['total']['files']
+        rollup['total']['bytes'] += daily_metrics[day]['total']['bytes']
+
+    return rollup
+
+
+def trend_metrics(daily_metrics: dict, days: int) -> dict:
+    """
+    Generate per-day series of the most recent days of metrics
+
+    :param daily_metrics: `dict` of daily metrics keyed by `datetime.date`
+    :param days: `int` of number of days
+
+    :returns: `dict` of per-day series (missing days are reported as `0`)
+    """
+
+    end = max(daily_metrics)
+    dates = [end - timedelta(days=i) for i in reversed(range(days))]
+
+    trend = {
+        'dates': [d.isoformat() for d in dates],
+        'total': {'files': [], 'bytes': []},
+        'datasets': {}
+    }
+
+    for dataset in sorted({ds for d in dates if d in daily_metrics
+                           for ds in daily_metrics[d]['datasets']}):
+        trend['datasets'][dataset] = {'files': [], 'bytes': []}
+
+    for d in dates:
+        day = daily_metrics.get(d, {'datasets': {}, 'total': {}})
+
+        for metric in ['files', 'bytes']:
+            trend['total'][metric].append(day['total'].get(metric, 0))
+
+            for dataset, series in trend['datasets'].items():
+                value = day['datasets'].get(dataset, {}).get(metric, 0)
+                series[metric].append(value)
+
+    return trend
+
+
+def write_metrics_file(path: Path, content: dict,
+                       precompress: bool = False) -> None:
+    """
+    Write a metrics JSON file (and optionally a gzip precompressed copy)
+
+    :param path: `Path` of output file
+    :param content: `dict` of metrics
+    :param precompress: whether to also write `<path>.gz`
+
+    :returns: `None`
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    data = json.dumps(content, separators=(',', ':')).encode()
+
+    LOGGER.debug(f'Writing {path}')
+    path.write_bytes(data)
+
+    if precompress:
+        with gzip.open(f'{path}.gz', 'wb') as fh:
+            fh.write(data)
+
+
+def load_rollup_metrics(path: Path) -> Union[dict, None]:
+    """
+    Load a previously generated rollup file
+
+    :param path: `Path` of rollup file
+
+    :returns: `dict` of rollup metrics, or `None` if missing or invalid
+    """
+
+    if not path.exists():
+        return None
+
+    try:
+        with path.open() as fh:
+            rollup = json.load(fh)
+    except json.decoder.JSONDecodeError as err:
+        LOGGER.warning(f'Invalid rollup file {path}: {err}')
+        return None
+
+    if not isinstance(rollup, dict):
+        LOGGER.warning(f'Invalid rollup file {path}: not an object')
+        return None
+
+    if not all(key in rollup for key in ['start', 'end', 'days', 'total']):
+        LOGGER.warning(f'Invalid rollup file {path}: missing properties')
+        return None
+
+    return rollup
+
+
+def get_period_start(period_type: str, period: str) -> date:
+    """
+    Get first day of a rollup period
+
+    :param period_type: `str` of period type (`weekly` or `monthly`)
+    :param period: `str` of period (`YYYY-Www` or `YYYY-MM`)
+
+    :returns: `datetime.date` of first day of period
+    """
+
+    if period_type == 'weekly':
+        year, week = period.split('-W')
+        return date.fromisocalendar(int(year), int(week), 1)
+
+    year, month = period.split('-')
+    return date(int(year), int(month), 1)
+
+
+def create_metrics_index(directory: Path, precompress: bool = False,
+                         trend_days: int = 30) -> dict:
+    """
+    Generate weekly/monthly rollups, a trend file and a manifest
+    (`index.json`) of available metrics periods from daily metrics files
+
+    Daily metrics files are purged over time: rollups of periods whose
+    first daily files are no longer available are not overwritten by
+    rollups covering fewer days, and rollups of fully purged periods are
+    kept in the manifest.
+
+    :param directory: `Path` of metrics directory
+    :param precompress: whether to also write gzip precompressed files
+    :param trend_days: `int` of number of days in trend file
+
+    :returns: `dict` of manifest
+    """
+
+    daily_metrics = load_daily_metrics(directory)
+
+    index = {
+        'generated': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),  # noqa
+        'daily': [],
+        'weekly': [],
+        'monthly': [],
+        'trend': None
+    }
+
+    if not daily_metrics:
+        LOGGER.warning(f'No daily metrics files found in {directory}')
+        write_metrics_file(directory / 'index.json', index, precompress)
+        return index
+
+    periods = {
+        'weekly': {},
+        'monthly': {}
+    }
+
+    for day, values in daily_metrics.items():
+        year, week, _ = day.isocalendar()
+        periods['weekly'].setdefault(f'{year}-W{week:02d}', {})[day] = values
+        periods['monthly'].setdefault(day.strftime('%Y-%m'), {})[day] = values
+
+        index['daily'].append({
+            'period': day.isoformat(),
+            'href': f'{day.isoformat()}.json',
+            'files': values['total']['files'],
+            'bytes': values['total']['bytes']
+        })
+
+    first_day = min(daily_metrics)
+
+    for period_type, rollups in periods.items():
+        for path in (directory / period_type).glob('*.json'):
+            if path.stem not in rollups:
+                rollups[path.stem] = None
+
+        for period, period_metrics in sorted(rollups.items()):
+            href = f'{period_type}/{period}.json'
+            rollup = None
+
+            if (period_metrics is None or
+                    get_period_start(period_type, period) < first_day):
+                rollup = load_rollup_metrics(directory / href)
+
+            if period_metrics is None and rollup is None:
+                continue
+
+            if (rollup is not None and period_metrics is not None and
+                    rollup['days'] < len(period_metrics)):
+                rollup = None
+
+            if rollup is None:
+                rollup = rollup_metrics(period, period_metrics)
+                write_metrics_file(directory / href, rollup, precompress)
+            else:
+                newer = {day: values
+                         for day, values in (period_metrics or {}).items()
+                         if day.isoformat() > rollup['end']}
+
+                if newer:
+                    # add days since the rollup to the kept rollup
+                    days = rollup['days'] + len(newer)
+                    newer[date.fromisoformat(rollup['start'])] = rollup
+                    rollup = rollup_metrics(period, newer)
+                    rollup['days'] = days
+                    write_metrics_file(directory / href, rollup, precompress)
+                else:
+                    LOGGER.debug(f'Keeping {href} (daily metrics purged)')
+
+            index[period_type].append({
+                'period': period,
+                'href': href,
+                'start': rollup['start'],
+                'end': rollup['end'],
+                'files': rollup['total']['files'],
+                'bytes': rollup['total']['bytes']
+            })
+
+    href = f'trend-{trend_days}d.json'
+    write_metrics_file(directory / href,
+                       trend_metrics(daily_metrics, trend_days), precompress)
+    index['trend'] = {
+        'days': trend_days,
+        'href': href
+    }
+
+    write_metrics_file(directory / 'index.json', index, precompress)
+
+    return index
+
+
 @click.group()
 def metrics():
     """Metrics management"""
@@ -148,10 +518,35 @@ def metrics():
 @click.command()
 @click.pass_context
 @cli_options.OPTION_VERBOSITY
-def get(ctx, verbosity):
+@click.option('--raw', is_flag=True, default=False,
+              help='Report bytes as numbers instead of human readable values')  # noqa
+def get(ctx, raw, verbosity):
     """Get data distribution metrics"""
 
-    click.echo(json.dumps(get_metrics(), indent=4))
+    click.echo(json.dumps(get_metrics(raw), indent=4))
+
+
+@click.command()
+@click.pass_context
+@cli_options.OPTION_VERBOSITY
+@click.option('--directory', '-d', required=True,
+              type=click.Path(exists=True, file_okay=False, path_type=Path),
+              help='Directory of daily metrics files')
+@click.option('--precompress', is_flag=True, default=False,
+              help='Also write gzip precompressed files')
+@click.option('--trend-days', type=int, default=30,
+              help='Number of days in trend file')
+def index(ctx, directory, precompress, trend_days, verbosity):
+    """Generate metrics index and rollups from daily metrics files"""
+
+    click.echo(f'Generating metrics index in {directory}')
+
+    index_ = create_metrics_index(directory, precompress, trend_days)
+
+    click.echo(f"Daily: {len(index_['daily'])}, "
+               f"weekly: {len(index_['weekly'])}, "
+               f"monthly: {len(index_['monthly'])}")
+    click.echo('Done')
 
 
 @click.command()
@@ -166,4 +561,5 @@ def delete(ctx, verbosity):
 
 
 metrics.add_command(get)
+metrics.add_command(index)
 metrics.add_command(delete)
@@ -0,0 +1,541 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+import logging
+import threading
+import time
+from typing import Union
+from urllib.parse import unquote, urlparse
+
+from paho.mqtt import client as mqtt_client
+
+from msc_wis2node.env import (BROKER_HOSTNAME, BROKER_PASSWORD, BROKER_PORT,
+                              BROKER_RETRY_INTERVAL, BROKER_TARGETS,
+                              BROKER_USERNAME, check_environment)
+from msc_wis2node.util import get_mqtt_client_id, get_mqtt_tls_settings
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MQTTPublisher:
+    """Persistent MQTT connection for publishing many messages"""
+
+    def __init__(self, hostname: str, port: int, username: str,
+                 password: str, client_id: Union[str, None] = None,
+                 timeout: float = 30, tls: Union[bool, None] = None):
+        """
+        initialize
+
+        :param hostname: `str` of broker hostname
+        :param port: `int` of broker port
+        :param username: `str` of broker username
+        :param password: `str` of broker password
+        :param client_id: `str` of MQTT client id
+        :param timeout: `float` of seconds to wait for connection and
+                        publish confirmation
+        :param tls: `bool` of whether to use TLS (default is TLS on
+                    port 8883)
+
+        :returns: `None`
+        """
+
+        self.hostname = hostname
+        self.port = port
+        self.timeout = timeout
+        self.connected = threading.Event()
+        self.connections = 0
+        self.last_error = None
+
+        # callable of confirmed messages (publisher, mid, result)
+        self.on_confirm = None
+
+        self.client = mqtt_client.Client(
+            mqtt_client.CallbackAPIVersion.VERSION2,
+            client_id=client_id or get_mqtt_client_id())
+
+        self.client.username_pw_set(username, password)
+
+        if tls or (tls is None and self.port == 8883):
+            LOGGER.debug('Setting TLS settings')
+            self.client.tls_set(**get_mqtt_tls_settings())
+
+        self.client.on_connect = self._on_connect
+        self.client.on_connect_fail = self._on_connect_fail
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            LOGGER.error(f'Connection refused by {self.hostname}: {reason_code}')  # noqa
+            self.last_error = f'connection refused: {reason_code}'
+            return
+
+        LOGGER.debug(f'Connected to {self.hostname}')
+        self.connections += 1
+        self.last_error = None
+        self.connected.set()
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        if self.on_confirm is not None:
+            self.on_confirm(self, mid, not reason_code.is_failure)
+
+    def _on_connect_fail(self, client, userdata):
+        LOGGER.debug(f'Could not connect to {self.hostname}')
+        self.last_error = 'connection failed'
+
+    def _on_disconnect(self, client, userdata, flags, reason_code,
+                       properties):
+        LOGGER.debug(f'Disconnected from {self.hostname}: {reason_code}')
+        self.connected.clear()
+
+    def connect(self) -> None:
+        """
+        Connect to broker and start the network loop
+
+        :returns: `None`
+        """
+
+        LOGGER.debug(f'Connecting to host={self.hostname}, port={self.port}')
+        self.client.connect(self.hostname, self.port)
+        self.client.loop_start()
+
+        if not self.connected.wait(self.timeout):
+            self.close()
+            msg = f'Could not connect to {self.hostname}:{self.port}'
+            LOGGER.error(msg)
+            raise ConnectionError(msg)
+
+    def connect_async(self, retry_interval: float = 30) -> None:
+        """
+        Connect to broker in the background: the network loop retries
+        until connected (see `connected`), and reconnects after
+        disconnections
+
+        :param retry_interval: `float` of maximum seconds between
+                               connection attempts
+
+        :returns: `None`
+        """
+
+        LOGGER.debug(f'Connecting to host={self.hostname}, port={self.port} (background)')  # noqa
+        self.client.reconnect_delay_set(1, max(int(retry_interval), 1))
+        self.client.connect_async(self.hostname, self.port)
+        self.client.loop_start()
+
+    def publish(self, topic: str, payload: str, qos: int = 1) -> bool:
+        """
+        Publish a message and wait for broker confirmation
+
+        :param topic: `str` of topic
+        :param payload: `str` of message payload
+        :param qos: `int` of quality of service
+
+        :returns: `bool` of publishing result
+        """
+
+        return self.publish_many([(topic, payload)], qos)[0]
+
+    def publish_many(self, messages: list, qos: int = 1) -> list:
+        """
+        Publish messages, then wait for all broker confirmations, so that
+        acknowledgements of in-flight messages overlap
+
+        :param messages: `list` of topic and payload pairs
+        :param qos: `int` of quality of service
+
+        :returns: `list` of `bool` publishing results (in message order)
+        """
+
+        infos = [self.submit(topic, payload, qos)
+                 for topic, payload in messages]
+
+        return [self.wait(info) for info in infos]
+
+    def submit(self, topic: str, payload: str,
+               qos: int = 1) -> mqtt_client.MQTTMessageInfo:
+        """
+        Publish a message without waiting for broker confirmation
+
+        :param topic: `str` of topic
+        :param payload: `str` of message payload
+        :param qos: `int` of quality of service
+
+        :returns: `paho.mqtt.client.MQTTMessageInfo`
+        """
+
+        LOGGER.debug(f'Publishing to topic {topic}')
+        return self.client.publish(topic, payload, qos)
+
+    def wait(self, info: mqtt_client.MQTTMessageInfo) -> bool:
+        """
+        Wait for broker confirmation of a message
+
+        :param info: `paho.mqtt.client.MQTTMessageInfo` of message
+
+        :returns: `bool` of publishing result
+        """
+
+        try:
+            info.wait_for_publish(self.timeout)
+            return info.is_published()
+        except (RuntimeError, ValueError) as err:
+            LOGGER.error(f'Publishing error: {err}')
+            return False
+
+    @staticmethod
+    def is_queued(info: mqtt_client.MQTTMessageInfo, qos: int = 1) -> bool:
+        """
+        Whether a message was accepted by the client, which keeps sending
+        it (QoS > 0 messages are also resent after reconnecting) until
+        confirmed
+
+        :param info: `paho.mqtt.client.MQTTMessageInfo` of message
+        :param qos: `int` of quality of service
+
+        :returns: `bool` of whether the message is queued by the client
+        """
+
+        if info.rc == mqtt_client.MQTT_ERR_QUEUE_SIZE:
+            return False
+
+        return qos > 0 or info.rc == mqtt_client.MQTT_ERR_SUCCESS
+
+    def close(self) -> None:
+        """
+        Disconnect from broker
+
+        :returns: `None`
+        """
+
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f'<MQTTPublisher {self.hostname}:{self.port}>'
+
+
+def get_broker_targets(targets: Union[str, None] = BROKER_TARGETS) -> list:
+    """
+    Get MQTT brokers to publish to
+
+    :param targets: `str` of comma-separated broker URLs
+                    (`mqtt[s]://username:password@hostname[:port]`),
+                    default is the broker of `MSC_WIS2NODE_BROKER_*`
+                    settings
+
+    :returns: `list` of `dict` of `MQTTPublisher` arguments
+    """
+
+    if not targets:
+        check_environment('BROKER_HOSTNAME', 'BROKER_USERNAME',
+                          'BROKER_PASSWORD')
+
+        return [{
+            'hostname': BROKER_HOSTNAME,
+            'port': BROKER_PORT,
+            'username': BROKER_USERNAME,
+            'password': BROKER_PASSWORD
+        }]
+
+    brokers = []
+
+    for target in targets.split(','):
+        url = urlparse(target.strip())
+
+        if url.scheme not in ['mqtt', 'mqtts'] or url.hostname is None:
+            msg = f'Invalid broker target: {url.scheme}://{url.hostname}'
+            LOGGER.error(msg)
+            raise ValueError(msg)
+
+        brokers.append({
+            'hostname': url.hostname,
+            'port': url.port or (8883 if url.scheme == 'mqtts' else 1883),
+            'username': unquote(url.username or ''),
+            'password': unquote(url.password or ''),
+            'tls': url.scheme == 'mqtts'
+        })
+
+    return brokers
+
+
+class BrokerFanout:
+    """
+    Publishes messages to several MQTT brokers concurrently, over a
+    persistent connection per broker
+
+    A message is sent to all connected brokers, then publishing waits (up
+    to `timeout` overall) until one broker confirms it: confirmations of
+    other brokers are recorded when they arrive, without blocking
+    publishing.  Brokers are connected to in the background, by the
+    network loop of their MQTT client (retrying at most every
+    `retry_interval` seconds), and are skipped until connected.  A message
+    rejected by the client of a connected broker is resubmitted once;
+    unconfirmed messages queued by the client are not, as the client keeps
+    sending them.  Publishing succeeds if at least one broker confirms the
+    message.
+    """
+
+    def __init__(self, targets: list,
+                 retry_interval: float = BROKER_RETRY_INTERVAL,
+                 timeout: float = 10):
+        """
+        initialize
+
+        :param targets: `list` of `dict` of `MQTTPublisher` arguments
+        :param retry_interval: `float` of maximum seconds before retrying
+                               to connect to an unavailable broker
+        :param timeout: `float` of seconds to wait for a connected broker
+                        and publish confirmation
+
+        :returns: `None`
+        """
+
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.brokers = []
+        self.states = {}
+        self.condition = threading.Condition()
+
+        for target in targets:
+            broker = MQTTPublisher(timeout=timeout, **target)
+            broker.on_confirm = self._on_confirm
+            self.brokers.append(broker)
+            self.states[id(broker)] = {
+                'broker': f"{target['hostname']}:{target['port']}",
+                'started': False,
+                'published': 0,
+                'failed': 0,
+                'skipped': 0,
+                'retries': 0,
+                'latency_ms': None,
+                'max_latency_ms': 0,
+                'last_publish': None,
+                'last_error': None,
+                # unconfirmed messages: mid -> (submission time, message)
+                'inflight': {},
+                # confirmations received before the message was tracked
+                'confirmed': {}
+            }
+
+        # connect in the background, ahead of the first message
+        for broker in self.brokers:
+            self._ensure_connected(broker)
+
+    def _ensure_connected(self, broker: MQTTPublisher) -> bool:
+        if broker.connected.is_set():
+            return True
+
+        state = self.states[id(broker)]
+
+        if not state['started']:
+            LOGGER.info(f"Connecting to broker {state['broker']}")
+            broker.connect_async(self.retry_interval)
+            state['started'] = True
+
+        # (re)connecting in the background
+        return False
+
+    def _wait_connected(self, deadline: float) -> bool:
+        """
+        Wait for any broker to be connected (when none is)
+
+        :param deadline: `float` of `time.monotonic` deadline
+
+        :returns: `bool` of whether a broker is connected
+        """
+
+        while not any(broker.connected.is_set() for broker in self.brokers):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+        return True
+
+    def _on_confirm(self, broker: MQTTPublisher, mid: int,
+                    result: bool) -> None:
+        # called from the network loop of the broker client
+        with self.condition:
+            state = self.states[id(broker)]
+            inflight = state['inflight'].pop(mid, None)
+
+            if inflight is None:
+                state['confirmed'][mid] = result
+                return
+
+            self._settle(broker, result, *inflight)
+            self.condition.notify_all()
+
+    def _track(self, broker: MQTTPublisher, mid: int, start: float,
+               message: dict) -> None:
+        state = self.states[id(broker)]
+        message['pending'] += 1
+
+        if mid in state['confirmed']:
+            self._settle(broker, state['confirmed'].pop(mid), start,
+                         message)
+        else:
+            state['inflight'][mid] = (start, message)
+
+    def _settle(self, broker: MQTTPublisher, result: bool, start: float,
+                message: dict) -> None:
+        message['pending'] -= 1
+        message['confirmed'] += result
+        self._record(broker, result, start)
+
+    def _record(self, broker: MQTTPublisher, result: bool,
+                start: float) -> None:
+        state = self.states[id(broker)]
+
+        if not result:
+            state['failed'] += 1
+            state['last_error'] = 'publish not confirmed'
+            return
+
+        latency_ms = (time.monotonic() - start) * 1000
+
+        state['published'] += 1
+        state['last_publish'] = time.time()
+        state['max_latency_ms'] = max(state['max_latency_ms'], latency_ms)
+
+        if state['latency_ms'] is None:
+            state['latency_ms'] = latency_ms
+        else:
+            # exponentially weighted moving average
+            state['latency_ms'] += 0.1 * (latency_ms - state['latency_ms'])
+
+    def publish(self, topic: str, payload: str, qos: int = 1) -> int:
+        """
+        Publish a message to all brokers
+
+        :param topic: `str` of topic
+        :param payload: `str` of message payload
+        :param qos: `int` of quality of service
+
+        :returns: `int` of number of brokers which confirmed the message
+                  when publishing returned
+        """
+
+        deadline = time.monotonic() + self.timeout
+
+        connected = [self._ensure_connected(broker)
+                     for broker in self.brokers]
+
+        if not any(connected) and self._wait_connected(deadline):
+            connected = [broker.connected.is_set()
+                         for broker in self.brokers]
+
+        message = {'pending': 0, 'confirmed': 0}
+
+        for broker, connected_ in zip(self.brokers, connected):
+            state = self.states[id(broker)]
+
+            if not connected_:
+                state['skipped'] += 1
+                continue
+
+            start = time.monotonic()
+            info = broker.submit(topic, payload, qos)
+
+            if not broker.is_queued(info, qos) and broker.connected.is_set():
+                LOGGER.warning(f"Retrying publish to {state['broker']}")
+                state['retries'] += 1
+                info = broker.submit(topic, payload, qos)
+
+            with self.condition:
+                if broker.is_queued(info, qos):
+                    self._track(broker, info.mid, start, message)
+                else:
+                    self._record(broker, False, start)
+
+        # wait for a first confirmation; the others are recorded by
+        # _on_confirm when they arrive
+        with self.condition:
+            self.condition.wait_for(
+                lambda: message['confirmed'] or not message['pending'],
+                max(deadline - time.monotonic(), 0))
+            published = message['confirmed']
+
+        if published == 0:
+            msg = f'Message not published to any of {len(self.brokers)} brokers'  # noqa
+            LOGGER.error(msg)
+            raise ConnectionError(msg)
+
+        return published
+
+    def status(self) -> list:
+        """
+        Get health, retry and lag metrics of brokers
+
+        :returns: `list` of `dict` of broker metrics
+        """
+
+        status = []
+        now = time.time()
+
+        with self.condition:
+            for broker in self.brokers:
+                state = self.states[id(broker)]
+
+                since = None
+                if state['last_publish'] is not None:
+                    since = round(now - state['last_publish'], 3)
+
+                latency_ms = state['latency_ms']
+                if latency_ms is not None:
+                    latency_ms = round(latency_ms, 3)
+
+                status.append({
+                    'broker': state['broker'],
+                    'healthy': broker.connected.is_set(),
+                    'published': state['published'],
+                    'failed': state['failed'],
+                    'skipped': state['skipped'],
+                    'retries': state['retries'],
+                    'inflight': len(state['inflight']),
+                    'connections': broker.connections,
+                    'latency_ms': latency_ms,
+                    'max_latency_ms': round(state['max_latency_ms'], 3),
+                    'seconds_since_last_publish': since,
+                    'last_error': broker.last_error or state['last_error']
+                })
+
+        return status
+
+    def close(self) -> None:
+        """
+        Disconnect from brokers
+
+        :returns: `None`
+        """
+
+        for broker in self.brokers:
+            state = self.states[id(broker)]
+            if state['started']:
+                broker.close()
+                state['started'] = False
+
+    def __repr__(self):
+        return f'<BrokerFanout brokers={len(self.brokers)}>'
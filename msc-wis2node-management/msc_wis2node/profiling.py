@@ -0,0 +1,240 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from contextlib import contextmanager
+import cProfile
+import io
+import logging
+import os
+from pathlib import Path
+import pstats
+import random
+import socket
+import time
+from typing import Union
+
+import click
+
+from msc_wis2node import cli_options
+from msc_wis2node.env import (PROFILE_DIRECTORY, PROFILE_DUMP_INTERVAL,
+                              PROFILE_MAX_DUMPS, PROFILE_SAMPLE_RATE)
+
+LOGGER = logging.getLogger(__name__)
+
+PROFILE_SUFFIX = '.prof'
+SORT_KEYS = ['cumulative', 'tottime', 'ncalls']
+
+
+class SampledProfiler:
+    """
+    cProfile profiler of a sample of worklists
+
+    Profiles of sampled worklists are accumulated and written every
+    `dump_interval` seconds to a new dump file of the instance
+    (`<hostname>-<pid>-<timestamp>.prof`), keeping the `max_dumps` most
+    recent dumps of the instance.
+    """
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 directory: Union[str, None] = PROFILE_DIRECTORY,
+                 dump_interval: int = PROFILE_DUMP_INTERVAL,
+                 max_dumps: int = PROFILE_MAX_DUMPS):
+        """
+        initialize
+
+        :param sample_rate: `float` of fraction of worklists to profile
+                            (`0` disables profiling)
+        :param directory: `str` of directory of profile dumps
+        :param dump_interval: `int` of seconds between dumps
+        :param max_dumps: `int` of dumps kept per instance
+
+        :returns: `None`
+        """
+
+        self.sample_rate = sample_rate
+        self.directory = Path(directory)
+        self.dump_interval = dump_interval
+        self.max_dumps = max_dumps
+        self.instance = f'{socket.gethostname()}-{os.getpid()}'
+
+        self.profiler = None
+        self.samples = 0
+        self.last_dump = time.monotonic()
+
+        if self.enabled:
+            LOGGER.info(f'Profiling {self.sample_rate:.2%} of worklists to {self.directory}')  # noqa
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+            except OSError as err:
+                LOGGER.error(f'Cannot create profile directory; profiling disabled: {err}')  # noqa
+                self.sample_rate = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    @contextmanager
+    def sample(self):
+        """
+        Profile the enclosed block if sampled
+
+        :returns: `None`
+        """
+
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+            self.samples += 1
+
+    def dump_if_due(self) -> None:
+        """
+        Write profile dump if the dump interval has elapsed
+
+        :returns: `None`
+        """
+
+        if time.monotonic() - self.last_dump >= self.dump_interval:
+            self.dump()
+
+    def dump(self) -> Union[Path, None]:
+        """
+        Write accumulated profile to a new dump and remove old dumps of
+        the instance
+
+        :returns: `Path` of dump, or `None` if nothing was profiled
+        """
+
+        self.last_dump = time.monotonic()
+
+        if self.profiler is None:
+            return None
+
+        timestamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        filepath = self.directory / f'{self.instance}-{timestamp}{PROFILE_SUFFIX}'  # noqa
+
+        LOGGER.info(f'Writing profile of {self.samples} worklists to {filepath}')  # noqa
+        try:
+            self.profiler.dump_stats(filepath)
+        except OSError as err:
+            LOGGER.error(f'Cannot write profile: {err}')
+            return None
+
+        self.profiler = None
+        self.samples = 0
+
+        dumps = sorted(self.directory.glob(f'{self.instance}-*{PROFILE_SUFFIX}'))  # noqa
+        for old_dump in dumps[:-self.max_dumps]:
+            LOGGER.debug(f'Removing {old_dump}')
+            old_dump.unlink(missing_ok=True)
+
+        return filepath
+
+    def __repr__(self):
+        return f'<SampledProfiler sample_rate={self.sample_rate}>'
+
+
+def merge_profiles(dumps: list) -> Union[pstats.Stats, None]:
+    """
+    Merge profile dumps (invalid dumps are skipped)
+
+    :param dumps: `list` of `Path` objects of profile dumps
+
+    :returns: `pstats.Stats` of merged profiles, or `None` if no dump is
+              valid
+    """
+
+    LOGGER.debug(f'Merging {len(dumps)} profile dumps')
+    stats = None
+
+    for dump in dumps:
+        try:
+            stats_ = pstats.Stats(str(dump), stream=io.StringIO())
+        except (AttributeError, EOFError, TypeError, ValueError) as err:
+            LOGGER.warning(f'Skipping invalid dump {dump}: {err}')
+            continue
+
+        if stats is None:
+            stats = stats_
+        else:
+            stats.add(stats_)
+
+    return stats
+
+
+@click.group()
+def profile():
+    """Profiling"""
+
+    pass
+
+
+@click.command()
+@click.pass_context
+@cli_options.OPTION_VERBOSITY
+@click.option('--directory', '-d', default=PROFILE_DIRECTORY,
+              type=click.Path(exists=True, file_okay=False, path_type=Path),
+              help='Directory of profile dumps')
+@click.option('--instance', '-i', default='*',
+              help='Instance (hostname-pid) pattern of dumps to merge')
+@click.option('--sort', '-s', type=click.Choice(SORT_KEYS),
+              default='cumulative', help='Sort order of hotspots')
+@click.option('--limit', '-l', default=30, type=int,
+              help='Number of hotspots to report')
+@click.option('--output', '-o',
+              type=click.Path(dir_okay=False, path_type=Path),
+              help='Write merged profile (e.g. for snakeviz)')
+def report(ctx, directory, instance, sort, limit, output, verbosity):
+    """Report hotspots of merged profile dumps"""
+
+    dumps = sorted(directory.glob(f'{instance}-*{PROFILE_SUFFIX}'))
+
+    if not dumps:
+        raise click.ClickException(f'No profile dumps in {directory}')
+
+    stats = merge_profiles(dumps)
+
+    if stats is None:
+        raise click.ClickException(f'No valid profile dumps in {directory}')
+
+    if output is not None:
+        stats.dump_stats(output)
+
+    instances = set(dump.name.rsplit('-', 1)[0] for dump in dumps)
+    click.echo(f'Dumps: {len(dumps)}, instances: {len(instances)}, '
+               f'total time: {stats.total_tt:.3f} s')
+
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    click.echo(stream.getvalue())
+
+    if output is not None:
+        click.echo(f'Merged profile written to {output}')
+
+
+profile.add_command(report)
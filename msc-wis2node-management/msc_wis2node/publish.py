@@ -0,0 +1,270 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+import logging
+import re
+import threading
+import time
+from typing import Iterator, TextIO, Tuple
+
+import click
+
+from msc_wis2node import cli_options
+from msc_wis2node.publisher import WIS2Publisher
+from msc_wis2node.util import RateLimiter
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://dd.weather.gc.ca'
+
+SR3_LOG_REGEX = re.compile(r'baseUrl: (?P<base_url>\S+) .*relPath: (?P<relpath>\S+)')  # noqa
+URL_REGEX = re.compile(r'^(?P<base_url>https?://[^/]+)(?P<relpath>/.*)$')
+
+
+def read_relpaths(fh: TextIO,
+                  base_url: str = DEFAULT_BASE_URL) -> Iterator[Tuple[str, str]]:  # noqa
+    """
+    Stream base URL and relPath pairs from a file list or sr3 log
+
+    Each line can be a relPath, a full URL or an sr3 log line of an
+    accepted message (as logged by `sarracenia.flowcb.log`).  Blank lines,
+    comments and unrelated log lines are skipped.  relPaths are normalized
+    with a leading slash, as announced by the Datamart.
+
+    :param fh: file object of relPaths, URLs or sr3 log
+    :param base_url: base URL to apply to relPaths
+
+    :returns: generator of `tuple` of base URL and relPath
+    """
+
+    for line in fh:
+        line = line.strip()
+
+        if not line or line.startswith('#'):
+            continue
+
+        match = SR3_LOG_REGEX.search(line) or URL_REGEX.match(line)
+
+        if match is not None:
+            base_url_ = match.group('base_url')
+            relpath = match.group('relpath')
+        elif ' ' in line:
+            LOGGER.debug(f'Skipping unrecognized line: {line}')
+            continue
+        else:
+            base_url_ = base_url
+            relpath = line
+
+        yield base_url_, f"/{relpath.lstrip('/')}"
+
+
+def batched(iterable, size: int) -> Iterator[list]:
+    """
+    Split an iterable into lists of at most `size` items
+
+    :param iterable: iterable to split
+    :param size: `int` of batch size
+
+    :returns: generator of `list` batches
+    """
+
+    iterator = iter(iterable)
+
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Replayer:
+    """Replay of notifications through the WIS2 publisher"""
+
+    def __init__(self, rate: float = 0, workers: int = 1,
+                 batch_size: int = 100, dry_run: bool = False):
+        """
+        initialize
+
+        :param rate: `float` of maximum notifications per second
+                     (`0` for unlimited)
+        :param workers: `int` of parallel publishing workers
+        :param batch_size: `int` of relPaths handed to a worker at a time
+        :param dry_run: `bool` of whether to only identify datasets
+
+        :returns: `None`
+        """
+
+        self.workers = max(workers, 1)
+        self.batch_size = max(batch_size, 1)
+        self.dry_run = dry_run
+        self.rate_limiter = RateLimiter(rate, burst=self.workers)
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.publishers = []
+        self.summary = {
+            'published': 0,
+            'skipped': 0,
+            'failed': 0
+        }
+
+    def _get_publisher(self) -> WIS2Publisher:
+        """
+        Get the WIS2 publisher of the current worker thread
+
+        :returns: `WIS2Publisher` instance
+        """
+
+        if not hasattr(self.local, 'publisher'):
+            self.local.publisher = WIS2Publisher()
+            with self.lock:
+                self.publishers.append(self.local.publisher)
+
+        return self.local.publisher
+
+    def _process_batch(self, batch: list) -> dict:
+        """
+        Publish a batch of notifications
+
+        :param batch: `list` of base URL and relPath pairs
+
+        :returns: `dict` of batch summary
+        """
+
+        publisher = self._get_publisher()
+        summary = dict.fromkeys(self.summary, 0)
+
+        for base_url, relpath in batch:
+            try:
+                if self.dry_run:
+                    if publisher.identify(relpath) is None:
+                        summary['skipped'] += 1
+                    else:
+                        summary['published'] += 1
+                    continue
+
+                self.rate_limiter.acquire()
+
+                if publisher.publish(base_url, relpath):
+                    summary['published'] += 1
+                else:
+                    summary['skipped'] += 1
+            except Exception as err:
+                LOGGER.error(f'Error publishing {relpath}: {err}')
+                summary['failed'] += 1
+
+        with self.lock:
+            for key, value in summary.items():
+                self.summary[key] += value
+
+        return summary
+
+    def replay(self, relpaths: Iterator[Tuple[str, str]]) -> dict:
+        """
+        Replay notifications
+
+        :param relpaths: iterable of base URL and relPath pairs
+
+        :returns: `dict` of replay summary
+        """
+
+        start = time.monotonic()
+        max_pending = self.workers * 2
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+
+            for batch in batched(relpaths, self.batch_size):
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    LOGGER.info(f'Progress: {self.summary}')
+
+                pending.add(executor.submit(self._process_batch, batch))
+
+            for future in pending:
+                future.result()
+
+        for publisher in self.publishers:
+            publisher.metrics.flush()
+            publisher.close()
+
+        elapsed = time.monotonic() - start
+
+        summary = dict(self.summary)
+        summary['elapsed'] = round(elapsed, 2)
+
+        total = summary['published'] + summary['skipped'] + summary['failed']
+        if elapsed > 0:
+            summary['rate'] = round(total / elapsed, 2)
+
+        return summary
+
+    def __repr__(self):
+        return f'<Replayer workers={self.workers}>'
+
+
+@click.group()
+def publish():
+    """Notification publishing"""
+
+    pass
+
+
+@click.command()
+@click.pass_context
+@cli_options.OPTION_VERBOSITY
+@click.option('--input', '-i', 'input_', type=click.File('r'), default='-',
+              help='File of relPaths, URLs or sr3 log (default: stdin)')
+@click.option('--base-url', '-u', default=DEFAULT_BASE_URL,
+              help='Base URL of relPaths')
+@click.option('--rate', '-r', type=float, default=0,
+              help='Maximum notifications per second (default: unlimited)')
+@click.option('--batch-size', '-b', type=int, default=100,
+              help='Number of relPaths per worker batch')
+@click.option('--workers', '-w', type=int, default=4,
+              help='Number of parallel publishing workers')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Only identify datasets, do not publish')
+def replay(ctx, input_, base_url, rate, batch_size, workers, dry_run,
+           verbosity):
+    """Replay notifications from a file list or sr3 log"""
+
+    click.echo('Replaying notifications')
+
+    replayer = Replayer(rate=rate, workers=workers, batch_size=batch_size,
+                        dry_run=dry_run)
+
+    summary = replayer.replay(read_relpaths(input_, base_url))
+
+    click.echo(f"Published: {summary['published']}")
+    click.echo(f"Skipped (no matching dataset): {summary['skipped']}")
+    click.echo(f"Failed: {summary['failed']}")
+    click.echo(f"Elapsed: {summary['elapsed']}s ({summary.get('rate', 0)}/s)")
+
+    if summary['failed'] > 0:
+        raise click.ClickException('Some notifications failed to publish')
+
+    click.echo('Done')
+
+
+publish.add_command(replay)
@@ -18,56 +18,485 @@
 ###############################################################################
 
 from copy import deepcopy
-from datetime import date, datetime, timezone
+from datetime import datetime
 from fnmatch import fnmatch
+import hashlib
+import heapq
+from itertools import count
 import json
 import logging
 import re
+import threading
+import time
 from typing import Union
 import uuid
 
-from paho.mqtt import publish
 from pywis_pubsub.publish import create_message, get_url_info
-import redis
 from sarracenia.flowcb import FlowCB
 import yaml
 
-from msc_wis2node.env import (BROKER_HOSTNAME, BROKER_PORT, BROKER_USERNAME,
-                              BROKER_PASSWORD, CACHE, CACHE_EXPIRY_SECONDS,
-                              CENTRE_ID, DATASET_CONFIG, TOPIC_PREFIX)
-from msc_wis2node.util import get_mqtt_client_id, get_mqtt_tls_settings
+from msc_wis2node.cache import Cache
+from msc_wis2node.env import (CACHE_EXPIRY_SECONDS, CENTRE_ID,
+                              DATASET_CONFIG, DATASET_REORDER_INTERVAL,
+                              DUPLICATE_WINDOW_SECONDS,
+                              METRICS_FLUSH_INTERVAL,
+                              METRICS_FLUSH_MAX_MESSAGES, TOPIC_PREFIX,
+                              check_environment)
+from msc_wis2node.health import HealthMonitor
+from msc_wis2node.mqtt import BrokerFanout, get_broker_targets
+from msc_wis2node.profiling import SampledProfiler
+from msc_wis2node.util import (PRIORITIES, DatetimeExtractor, RateLimiter,
+                               get_message_datetime, get_message_pubtime,
+                               subtopic2dirpath)
+from msc_wis2node.validation import MessageValidator
 
 LOGGER = logging.getLogger(__name__)
 
+# publishing attempts of deferred messages already acknowledged upstream
+MAX_DEFERRED_RETRIES = 5
+
+# identity methods which are checksums of file content (others, such as
+# md5name, cod or arbitrary, do not identify content changes)
+CONTENT_IDENTITY_METHODS = ['md5', 'sha512']
+
 
 class WIS2FlowCB(FlowCB):
+    def __init__(self, options):
+        """initialize"""
+
+        super().__init__(options)
+
+        self.wis2_publisher = WIS2Publisher()
+        self.scheduler = PriorityScheduler()
+        self.profiler = SampledProfiler()
+        self.health = HealthMonitor(self.wis2_publisher.cache)
+        self.duplicate_keys = {}
+
+        # failed attempts of scheduled messages acknowledged upstream (sr3
+        # acknowledges the messages of a worklist, including those deferred
+        # by rate limits), by message id
+        self.acknowledged = {}
+
     def after_accept(self, worklist) -> None:
         """
-        sarracenia dispatcher
+        sarracenia dispatcher (profiled when sampled)
+
+        :param worklist: `sarracenia.flowcb`
+
+        :returns: None
+        """
+
+        with self.profiler.sample():
+            self._after_accept(worklist)
+
+    def _after_accept(self, worklist) -> None:
+        """
+        Process worklist
+
+        Messages are matched to datasets, re-announcements of identical
+        content are dropped, then messages are published in order of
+        dataset priority.  Messages of rate limited datasets are deferred
+        to subsequent worklists.  As sr3 acknowledges deferred messages with
+        their worklist, deferred messages which fail to publish are
+        rescheduled (up to `MAX_DEFERRED_RETRIES` times), and are lost if
+        the process stops or crashes before they are published.
 
         :param worklist: `sarracenia.flowcb`
 
         :returns: None
         """
 
-        new_incoming = []
+        new_incoming = self.schedule(worklist)
+
+        failed = {id(msg) for msg in self.publish_scheduled()}
+
+        for msg in new_incoming:
+            if id(msg) in failed:
+                worklist.failed.append(msg)
+
+        worklist.incoming = [msg for msg in new_incoming
+                             if id(msg) not in failed]
+
+        deferred = {id(entry[3]) for entry in self.scheduler.queue}
+        for msg in worklist.incoming:
+            if id(msg) in deferred:
+                self.acknowledged[id(msg)] = 0
+
+        self.report_health_if_due()
+
+    def schedule(self, worklist) -> list:
+        """
+        Match incoming messages to datasets and schedule them for
+        publishing
+
+        Unmatched messages and duplicate announcements are added to the
+        rejected messages of the worklist, messages which cannot be
+        identified to its failed messages.
+
+        :param worklist: `sarracenia.flowcb`
+
+        :returns: `list` of scheduled messages
+        """
+
+        scheduled = []
 
         for msg in worklist.incoming:
             try:
                 LOGGER.debug('Processing message')
 
-                wis2_publisher = WIS2Publisher()
+                dataset = self.wis2_publisher.identify(msg['relPath'])
+
+                if dataset is None:
+                    LOGGER.debug('Dataset not found; skipping')
+                    worklist.rejected.append(msg)
+                    continue
 
-                if wis2_publisher.publish(msg['baseUrl'], msg['relPath']):
-                    new_incoming.append(msg)
-                else:
-                    return
+                duplicate_key = self._get_duplicate_key(msg)
+                if duplicate_key is not None:
+                    if not self.wis2_publisher.cache.add(
+                            duplicate_key, 1, ex=DUPLICATE_WINDOW_SECONDS):
+                        LOGGER.debug(f"Duplicate announcement: {msg['relPath']}")  # noqa
+                        worklist.rejected.append(msg)
+                        continue
+                    self.duplicate_keys[id(msg)] = duplicate_key
+
+                self.scheduler.submit(dataset, msg)
+                scheduled.append(msg)
             except Exception as err:
-                LOGGER.error(f'Error publishing message: {err}', exc_info=True)
+                LOGGER.error(f'Error identifying message: {err}', exc_info=True)  # noqa
                 worklist.failed.append(msg)
+
+        return scheduled
+
+    def _get_duplicate_key(self, msg) -> Union[str, None]:
+        """
+        Generate duplicate suppression key of a message from its relPath and
+        checksum
+
+        :param msg: `sarracenia.Message`
+
+        :returns: `str` of cache key, or `None` if suppression is disabled
+                  or the message has no content checksum
+        """
+
+        identity = msg.get('identity')
+
+        if DUPLICATE_WINDOW_SECONDS <= 0 or not isinstance(identity, dict):
+            return None
+
+        if (identity.get('method') not in CONTENT_IDENTITY_METHODS or
+                identity.get('value') is None):
+            return None
+
+        token = f"{msg['relPath']} {identity.get('method')} {identity['value']}"  # noqa
+
+        return f'duplicate_{hashlib.sha1(token.encode()).hexdigest()}'
+
+    def publish_scheduled(self, force: bool = False) -> list:
+        """
+        Publish scheduled messages in priority order
+
+        Messages acknowledged upstream which fail to publish are
+        rescheduled for the next call, up to `MAX_DEFERRED_RETRIES` times.
+
+        :param force: whether to ignore dataset rate limits
+
+        :returns: `list` of messages which failed to publish and are not
+                  rescheduled
+        """
+
+        failed = []
+        retries = []
+
+        for dataset, msg in self.scheduler.drain(force):
+            duplicate_key = self.duplicate_keys.pop(id(msg), None)
+            attempts = self.acknowledged.pop(id(msg), None)
+            try:
+                url = self.wis2_publisher.get_url(msg['baseUrl'],
+                                                  msg['relPath'])
+                LOGGER.debug(f'Publishing dataset notification: {url}')
+                self.wis2_publisher.publish_to_wis2(
+                    dataset, url, get_message_datetime(msg))
+                self.health.record(get_message_pubtime(msg))
+            except Exception as err:
+                LOGGER.error(f'Error publishing message: {err}', exc_info=True)
+                self.health.record_failure()
+
+                if attempts is not None and attempts < MAX_DEFERRED_RETRIES:
+                    LOGGER.warning(f"Rescheduling deferred message: {msg['relPath']}")  # noqa
+                    self.acknowledged[id(msg)] = attempts + 1
+                    if duplicate_key is not None:
+                        self.duplicate_keys[id(msg)] = duplicate_key
+                    retries.append((dataset, msg))
+                    continue
+
+                if attempts is not None:
+                    LOGGER.error(f"Deferred message not published after {attempts + 1} attempts: {msg['relPath']}")  # noqa
+
+                failed.append(msg)
+                if duplicate_key is not None:
+                    # allow a retry to be published
+                    self.wis2_publisher.cache.delete(duplicate_key)
+
+        # rescheduled after draining, so as not to retry immediately
+        for dataset, msg in retries:
+            self.scheduler.submit(dataset, msg)
+
+        return failed
+
+    def report_health_if_due(self) -> None:
+        """
+        Write health snapshot (queue depth, publishing rates and lag, broker
+        status) to the cache if due
+
+        :returns: None
+        """
+
+        if self.health.due:
+            self.health.report(len(self.scheduler),
+                               self.wis2_publisher.brokers.status())
+
+    def on_housekeeping(self) -> None:
+        """
+        sarracenia housekeeping: publish deferred messages, flush metrics
+        when due and report validation and broker status
+
+        :returns: None
+        """
+
+        self.publish_scheduled()
+        self.wis2_publisher.metrics.flush_if_due()
+        self.profiler.dump_if_due()
+        self.report_health_if_due()
+
+        validator = self.wis2_publisher.validator
+        if validator.enabled:
+            LOGGER.info(f'Validated messages: {validator.checked}, violations: {validator.violations}')  # noqa
+
+        for status in self.wis2_publisher.brokers.status():
+            LOGGER.info(f'Broker status: {status}')
+
+    def on_stop(self) -> None:
+        """
+        sarracenia stop: publish deferred messages, flush pending metrics,
+        remove health snapshot and disconnect from brokers
+
+        :returns: None
+        """
+
+        self.publish_scheduled(force=True)
+
+        if self.acknowledged:
+            LOGGER.error(f'{len(self.acknowledged)} deferred messages not published')  # noqa
+
+        self.wis2_publisher.metrics.flush()
+        self.profiler.dump()
+        self.health.clear()
+        self.wis2_publisher.close()
+
+
+class PriorityScheduler:
+    """Priority queue of notifications with per-dataset rate limits"""
+
+    def __init__(self, max_deferred: int = 10000):
+        """
+        initialize
+
+        :param max_deferred: `int` of maximum number of deferred items
+                             (beyond which rate limits are ignored)
+
+        :returns: `None`
+        """
+
+        self.max_deferred = max_deferred
+        self.queue = []
+        self.sequence = count()
+        self.rate_limiters = {}
+
+    def submit(self, dataset: dict, item) -> None:
+        """
+        Schedule an item of a dataset
+
+        :param dataset: `dict` of dataset definition (`priority` is one of
+                        `high`, `normal` (default) or `low`, and
+                        `rate-limit` is the maximum messages per second)
+        :param item: item to schedule
+
+        :returns: `None`
+        """
+
+        priority = PRIORITIES.get(dataset.get('priority'), PRIORITIES['normal'])  # noqa
+
+        heapq.heappush(self.queue,
+                       (priority, next(self.sequence), dataset, item))
+
+    def _rate_limiter(self, dataset: dict) -> Union[RateLimiter, None]:
+        rate = dataset.get('rate-limit')
+
+        if not rate:
+            return None
+
+        metadata_id = dataset['metadata-id']
+        if metadata_id not in self.rate_limiters:
+            self.rate_limiters[metadata_id] = RateLimiter(
+                rate, burst=max(int(rate), 1))
+
+        return self.rate_limiters[metadata_id]
+
+    def drain(self, force: bool = False):
+        """
+        Get scheduled items in priority order (then in order of
+        submission).  Items exceeding their dataset rate limit stay
+        scheduled.
+
+        :param force: whether to ignore rate limits
+
+        :returns: generator of `tuple` of dataset and item
+        """
+
+        deferred = []
+
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            dataset = entry[2]
+
+            rate_limiter = self._rate_limiter(dataset)
+            if (not force and rate_limiter is not None and
+                    len(deferred) < self.max_deferred and
+                    not rate_limiter.try_acquire()):
+                deferred.append(entry)
                 continue
 
-        worklist.incoming = new_incoming
+            yield dataset, entry[3]
+
+        for entry in deferred:
+            heapq.heappush(self.queue, entry)
+
+        if deferred:
+            LOGGER.debug(f'{len(deferred)} rate limited items deferred')
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __repr__(self):
+        return f'<PriorityScheduler items={len(self.queue)}>'
+
+
+class MetricsAggregator:
+    """In-process aggregation of dataset distribution metrics"""
+
+    def __init__(self, cache, interval: int = METRICS_FLUSH_INTERVAL,
+                 max_messages: int = METRICS_FLUSH_MAX_MESSAGES):
+        """
+        initialize
+
+        :param cache: `msc_wis2node.cache.Cache` (metrics are flushed to it)
+        :param interval: `int` of seconds between flushes
+        :param max_messages: `int` of maximum number of messages aggregated
+                             before a flush (bounds metrics lost on crash)
+
+        :returns: `None`
+        """
+
+        self.cache = cache
+        self.interval = interval
+        self.max_messages = max_messages
+
+        self.counters = {}
+        self.messages = 0
+        self.last_flush = time.monotonic()
+        self.today = datetime.today().strftime('%Y-%m-%d')
+        self.lock = threading.Lock()
+
+        if self.cache.redis is None:
+            LOGGER.warning('No cache configured; metrics are not recorded')
+
+    def add(self, metadata_id: str, filesize: int) -> None:
+        """
+        Add a published file to dataset and total metrics
+
+        :param metadata_id: metadata identifier
+        :param filesize: `int` of file size
+
+        :returns: `None`
+        """
+
+        today = datetime.today().strftime('%Y-%m-%d')
+
+        if today != self.today:
+            # flush counters of the previous day as soon as the day changes
+            self.today = today
+            self.flush()
+
+        increments = {
+            f'metrics_{today}_{metadata_id}_files': 1,
+            f'metrics_{today}_{metadata_id}_bytes': filesize,
+            f'metrics_total_{today}_files': 1,
+            f'metrics_total_{today}_bytes': filesize
+        }
+
+        with self.lock:
+            for key, value in increments.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.messages += 1
+
+        self.flush_if_due()
+
+    def add_violation(self, metadata_id: str) -> None:
+        """
+        Add a WIS2 notification message schema violation to dataset metrics
+
+        :param metadata_id: metadata identifier
+
+        :returns: `None`
+        """
+
+        today = datetime.today().strftime('%Y-%m-%d')
+        key = f'metrics_{today}_{metadata_id}_invalid'
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def flush_if_due(self) -> None:
+        """
+        Flush metrics if the flush interval or message bound is reached
+
+        :returns: `None`
+        """
+
+        if (self.messages >= self.max_messages or
+                time.monotonic() - self.last_flush >= self.interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Flush aggregated metrics to the cache in one pipelined batch
+
+        :returns: `None`
+        """
+
+        with self.lock:
+            counters = self.counters
+            messages = self.messages
+            self.counters = {}
+            self.messages = 0
+            self.last_flush = time.monotonic()
+
+        if not counters:
+            return
+
+        LOGGER.debug(f'Flushing metrics of {messages} messages')
+
+        if self.cache.incrby_many(counters):
+            return
+
+        if self.cache.redis is None:
+            LOGGER.debug(f'Metrics of {messages} messages dropped (no cache)')
+        else:
+            LOGGER.debug('Metrics kept in memory until cache is available')
+
+    def __repr__(self):
+        return f'<MetricsAggregator messages={self.messages}>'
 
 
 class WIS2Publisher:
@@ -76,21 +505,33 @@ class WIS2Publisher:
     def __init__(self):
         """initialize"""
 
-        self.cache = None
+        check_environment('CENTRE_ID', 'DATASET_CONFIG')
+
         self.datasets = []
-        self.tls = None
 
-        self.client_id = get_mqtt_client_id()
+        # connections are opened on first publish
+        self.brokers = BrokerFanout(get_broker_targets())
+
+        self.cache = Cache()
 
-        if CACHE is not None:
-            self.cache = redis.Redis().from_url(CACHE)
+        self.metrics = MetricsAggregator(self.cache)
 
-        if BROKER_PORT == 8883:
-            self.tls = get_mqtt_tls_settings()
+        self.validator = MessageValidator()
 
         with open(DATASET_CONFIG) as fh:
             self.datasets = yaml.load(fh, Loader=yaml.SafeLoader)['datasets']
 
+        self.datetime_extractors = self._load_datetime_extractors()
+
+        # (dataset, subtopic directory path, compiled regexes), in match order
+        self.candidates = [
+            (dataset, self._subtopic2dirpath(dataset['subtopic']),
+             [re.compile(regex) for regex in dataset.get('regexes', [])])
+            for dataset in self.datasets
+        ]
+        self.match_counts = {}
+        self.identified = 0
+
     def publish(self, base_url: str, relative_path: str) -> bool:
         """
         Publish notification message
@@ -107,15 +548,28 @@ class WIS2Publisher:
             LOGGER.debug('Dataset not found; skipping')
             return False
 
-        relative_path2 = relative_path.lstrip('/')
-        base_url2 = base_url.rstrip('/')
-        url = f'{base_url2}/{relative_path2}'
+        url = self.get_url(base_url, relative_path)
 
         LOGGER.debug(f'Publishing dataset notification: {url}')
         self.publish_to_wis2(dataset, url)
 
         return True
 
+    def get_url(self, base_url: str, relative_path: str) -> str:
+        """
+        Generate URL of a resource
+
+        :param base_url: base URL of HTTP endpoint of filepath
+        :param relative_path: relative filepath
+
+        :returns: `str` of URL
+        """
+
+        relative_path2 = relative_path.lstrip('/')
+        base_url2 = base_url.rstrip('/')
+
+        return f'{base_url2}/{relative_path2}'
+
     def identify(self, path: str) -> Union[dict, None]:
         """
         Determines whether data granule is part of a configured
@@ -126,26 +580,32 @@ class WIS2Publisher:
         :returns: `dict` of dataset definition or `None`
         """
 
-        for dataset in self.datasets:
+        self.identified += 1
+        if (DATASET_REORDER_INTERVAL > 0 and
+                self.identified % DATASET_REORDER_INTERVAL == 0):
+            self._reorder_candidates()
+
+        for dataset, subtopic_dirpath, regexes in self.candidates:
             LOGGER.debug(f'Dataset: {dataset}')
             match = False
-            subtopic_dirpath = self._subtopic2dirpath(dataset['subtopic'])
 
             LOGGER.debug(f'Testing subtopic match: {subtopic_dirpath}')
             if fnmatch(path, subtopic_dirpath):
                 LOGGER.debug('Found matching subtopic')
                 match = True
 
-                for regex in dataset.get('regexes', []):
+                for regex in regexes:
                     match = False
-                    LOGGER.debug(f'Testing regex match: {regex}')
-                    if re.search(regex, path) is not None:
+                    LOGGER.debug(f'Testing regex match: {regex.pattern}')
+                    if regex.search(path) is not None:
                         LOGGER.debug('Found matching regex')
                         match = True
                         break
 
                 if match:
                     LOGGER.debug('Found matching dataset definition')
+                    metadata_id = dataset['metadata-id']
+                    self.match_counts[metadata_id] = self.match_counts.get(metadata_id, 0) + 1  # noqa
                     return dataset
             else:
                 LOGGER.debug('NO MATCH')
@@ -156,12 +616,47 @@ class WIS2Publisher:
 
         return None
 
-    def publish_to_wis2(self, dataset: dict, url: str) -> None:
+    def _reorder_candidates(self) -> None:
+        """
+        Reorder datasets not pinned at setup (i.e. not overlapping any other
+        dataset) by descending match count, so that the most frequent
+        datasets are tested first.  Pinned datasets (or datasets set up
+        before pinning) keep their positions, so that results are unchanged.
+
+        Match counts are halved afterwards, to follow changes in traffic.
+
+        :returns: `None`
+        """
+
+        unpinned = [candidate for candidate in self.candidates
+                    if not candidate[0].get('pinned', True)]
+
+        if not unpinned:
+            return
+
+        unpinned.sort(key=lambda c: self.match_counts.get(
+            c[0]['metadata-id'], 0), reverse=True)
+        unpinned_iter = iter(unpinned)
+
+        self.candidates = [
+            candidate if candidate[0].get('pinned', True)
+            else next(unpinned_iter)
+            for candidate in self.candidates
+        ]
+
+        LOGGER.debug(f'Dataset match counts: {self.match_counts}')
+        self.match_counts = {key: value // 2
+                             for key, value in self.match_counts.items()}
+
+    def publish_to_wis2(self, dataset: dict, url: str,
+                        fallback_datetime: Union[str, None] = None) -> None:
         """
         WIS2 publisher
 
         :param dataset: `dict` of dataset definition
         :param url: `str` of URL of resource
+        :param fallback_datetime: `str` of RFC3339 datetime used when no
+                                  datetime can be extracted from the URL
 
         :returns: `bool` of dispatch result
         """
@@ -169,8 +664,13 @@ class WIS2Publisher:
         topic = f"{TOPIC_PREFIX}/{CENTRE_ID}/{dataset['wis2-topic']}"
         LOGGER.info(f'URL: {url}')
 
-        datetime_ = self._topic_regex2datetime(
-            url, dataset.get('msc-filename-datetime-regex'))
+        temporal = None
+        extractor = self.datetime_extractors.get(dataset['metadata-id'])
+        if extractor is not None:
+            temporal = extractor.extract(url)
+
+        if temporal is None:
+            temporal = {'datetime': fallback_datetime}
 
         metadata_id = f"urn:wmo:md:{CENTRE_ID}:{dataset['metadata-id']}"
 
@@ -179,12 +679,18 @@ class WIS2Publisher:
         message = create_message(
             identifier=str(uuid.uuid4()),
             metadata_id=metadata_id,
-            datetime_=datetime_,
+            datetime_=temporal.get('datetime'),
             topic=topic,
             content_type=dataset['media-type'],
             url_info=url_info
         )
 
+        if 'start_datetime' in temporal:
+            # set directly, as create_message names end_datetime incorrectly
+            LOGGER.debug('Setting time extent')
+            message['properties'].pop('datetime', None)
+            message['properties'].update(temporal)
+
         cache = dataset.get('cache', True)
         if not cache:
             LOGGER.info(f'Setting properties.cache={cache}')
@@ -195,84 +701,51 @@ class WIS2Publisher:
         tokens = data_id.split('/')
         message['properties']['data_id'] = '/'.join(tokens[2:])
 
-        if self.cache is not None:
-            LOGGER.info(f"Checking for duplicate: {message['properties']['data_id']}")  # noqa
-            if self.cache.get(message['properties']['data_id']) is not None:
-                update_link = deepcopy(message['links'][0])
-                update_link['rel'] = 'update'
-                message['links'] = [update_link]
+        LOGGER.info(f"Checking for duplicate: {message['properties']['data_id']}")  # noqa
+        if self.cache.get(message['properties']['data_id']) is not None:
+            update_link = deepcopy(message['links'][0])
+            update_link['rel'] = 'update'
+            message['links'] = [update_link]
+
+        if self.validator.validate(metadata_id, message) is False:
+            self.metrics.add_violation(metadata_id)
 
         LOGGER.info(json.dumps(message, indent=4))
         msg = (f'Publishing WIS2 notification message to '
-               f'host={BROKER_HOSTNAME}, port={BROKER_PORT}, topic={topic}')
+               f'{len(self.brokers.brokers)} broker(s), topic={topic}')
         LOGGER.info(msg)
 
-        publish.single(
-            topic,
-            payload=json.dumps(message),
-            qos=1,
-            hostname=BROKER_HOSTNAME,
-            port=BROKER_PORT,
-            client_id=self.client_id,
-            tls=self.tls,
-            auth={
-                'username': BROKER_USERNAME,
-                'password': BROKER_PASSWORD
-            }
-        )
+        self.brokers.publish(topic, json.dumps(message), qos=1)
 
-        if self.cache is not None:
-            LOGGER.info(f"Setting cache key for {message['properties']['data_id']}")  # noqa
-            self.cache.set(message['properties']['data_id'], 'published',
-                           ex=CACHE_EXPIRY_SECONDS)
+        LOGGER.info(f"Setting cache key for {message['properties']['data_id']}")  # noqa
+        self.cache.set(message['properties']['data_id'], 'published',
+                       ex=CACHE_EXPIRY_SECONDS)
 
         LOGGER.info('Updating dataset distribution metrics')
         self._update_dataset_distribution_metrics(
             metadata_id, message['links'][0]['length'])
 
-    def _update_dataset_distribution_metrics(self, metadata_id, filesize) -> None:  # noqa
+    def close(self) -> None:
         """
-        Set/update dataset distrubution metrics
-
-        :param metadata_id: metadata identifier
-        :param length: metadata identifier
+        Disconnect from brokers
 
         :returns: `None`
         """
 
-        today = datetime.today().strftime('%Y-%m-%d')
-
-        dataset_files_cache_key = f'metrics_{today}_{metadata_id}_files'
-        dataset_bytes_cache_key = f'metrics_{today}_{metadata_id}_bytes'
-
-        total_files_cache_key = f'metrics_total_{today}_files'
-        total_bytes_cache_key = f'metrics_total_{today}_bytes'
+        self.brokers.close()
 
-        LOGGER.debug('Incrementing dataset number of files published')
-        self.cache.incr(dataset_files_cache_key)
-
-        LOGGER.debug('Incrementing all total number of files published')
-        self.cache.incr(total_files_cache_key)
-
-        LOGGER.debug('Updating dataset total bytes')
-        dataset_bytes = self.cache.get(dataset_bytes_cache_key)
+    def _update_dataset_distribution_metrics(self, metadata_id, filesize) -> None:  # noqa
+        """
+        Set/update dataset distrubution metrics (aggregated in process and
+        flushed periodically)
 
-        if dataset_bytes is None:
-            self.cache.set(dataset_bytes_cache_key, filesize)
-        else:
-            self.cache.set(
-                dataset_bytes_cache_key, int(dataset_bytes) + filesize
-            )
+        :param metadata_id: metadata identifier
+        :param filesize: `int` of file size
 
-        LOGGER.debug('Updating all total bytes')
-        total_bytes = self.cache.get(total_bytes_cache_key)
+        :returns: `None`
+        """
 
-        if total_bytes is None:
-            self.cache.set(total_bytes_cache_key, filesize)
-        else:
-            self.cache.set(
-                total_bytes_cache_key, int(total_bytes) + filesize
-            )
+        self.metrics.add(metadata_id, filesize)
 
         return None
 
@@ -285,49 +758,29 @@ class WIS2Publisher:
         :returns: `str` of directory path
         """
 
-        LOGGER.debug(f'AMQP subtopic: {subtopic}')
-
-        dirpath = '/' + subtopic.replace('*.', '/').replace('.', '/').rstrip('/#')  # noqa
-        dirpath = dirpath.replace('//', '/')
-        dirpath = f'*{dirpath}*'
-
-        LOGGER.debug(f'directory path: {dirpath}')
+        return subtopic2dirpath(subtopic)
 
-        return dirpath
-
-    def _topic_regex2datetime(self, topic: str,
-                              pattern: Union[str, None]) -> Union[str, None]:
+    def _load_datetime_extractors(self) -> dict:
         """
-        Generate RFC3339 string
-
-        :param topic: topic
-        :param pattern: regular expression of date pattern
+        Compile datetime extractors of datasets defining a
+        `msc-filename-datetime-regex`
 
-        :returns: `str` of resulting RFC3339 datetime, or `None` if not found
+        :returns: `dict` of `DatetimeExtractor` keyed by metadata identifier
         """
 
-        if pattern is None:
-            return None
-
-        match = re.search(topic, pattern)
-
-        if match is None:
-            LOGGER.debug(f'No match ({pattern} not in {topic})')
-            return None
+        extractors = {}
 
-        groups = [int(m) for m in match.groups()]
-        LOGGER.debug(f'datetime regex groups found: {groups}')
+        for dataset in self.datasets:
+            pattern = dataset.get('msc-filename-datetime-regex')
+            if pattern is None:
+                continue
 
-        if len(groups) < 3:
-            LOGGER.debug('Casting date')
-            obj = date(*groups)
-            value = obj.isoformat()
-        else:
-            LOGGER.debug('Casting datetime')
-            dt = datetime(*groups, tzinfo=timezone.utc)
-            value = f'{dt.isoformat()}Z'
+            try:
+                extractors[dataset['metadata-id']] = DatetimeExtractor(pattern)  # noqa
+            except (re.error, ValueError) as err:
+                LOGGER.error(f"Invalid datetime regex for {dataset['metadata-id']}: {err}")  # noqa
 
-        return value
+        return extractors
 
     def __repr__(self):
         return '<WIS2Publisher>'
@@ -0,0 +1,390 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import signal
+import time
+from types import SimpleNamespace
+from typing import Tuple, Union
+from urllib.parse import urlparse
+import uuid
+
+import aio_pika
+import click
+
+from msc_wis2node import cli_options
+from msc_wis2node.env import MSC_DATAMART_AMQP, check_environment
+from msc_wis2node.publisher import WIS2FlowCB
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_EXCHANGE = 'xpublic'
+DEFAULT_TOPIC_PREFIX = 'v02.post'
+
+# v02 sum header algorithms, as v03 identity methods
+V02_SUM_METHODS = {
+    'd': 'md5',
+    'n': 'md5name',
+    's': 'sha512',
+    'a': 'arbitrary',
+    'z': 'cod'
+}
+
+
+def _decode(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode()
+
+    return str(value)
+
+
+def parse_message(body: bytes,
+                  headers: Union[dict, None] = None) -> Union[dict, None]:
+    """
+    Parse a Datamart notification (v02 or v03) into a sarracenia message
+
+    v02 notifications are `pubTime baseUrl relPath` bodies with the
+    checksum (`sum`) and modification time (`mtime`) in AMQP headers.
+    v03 notifications are JSON bodies.
+
+    :param body: `bytes` of AMQP message body
+    :param headers: `dict` of AMQP message headers
+
+    :returns: `dict` of message (`pubTime`, `baseUrl`, `relPath` and
+              optional `identity` and `mtime`), or `None` if invalid
+    """
+
+    headers = headers or {}
+
+    try:
+        if body.lstrip().startswith(b'{'):
+            msg = json.loads(body)
+            if 'identity' not in msg and 'integrity' in msg:
+                msg['identity'] = msg['integrity']
+        else:
+            fields = body.decode().split()
+            if len(fields) < 3:
+                return None
+
+            msg = {
+                'pubTime': fields[0],
+                'baseUrl': fields[1],
+                'relPath': fields[2]
+            }
+
+            if headers.get('sum') is not None:
+                method, _, value = _decode(headers['sum']).partition(',')
+                msg['identity'] = {
+                    'method': V02_SUM_METHODS.get(method, method),
+                    'value': value
+                }
+
+            if headers.get('mtime') is not None:
+                msg['mtime'] = _decode(headers['mtime'])
+    except (UnicodeDecodeError, json.JSONDecodeError) as err:
+        LOGGER.debug(f'Invalid message: {err}')
+        return None
+
+    if not isinstance(msg, dict) or None in [msg.get('baseUrl'),
+                                             msg.get('relPath')]:
+        return None
+
+    return msg
+
+
+class AMQPSubscriber:
+    """
+    asyncio AMQP consumer of Datamart notifications
+
+    Notifications are consumed in batches and processed by the
+    `WIS2FlowCB` logic (dataset matching, duplicate suppression,
+    prioritization and rate limiting) in a worker thread.  Each
+    notification is acknowledged once published (or rejected as unmatched
+    or duplicate), and requeued when publishing fails.  Notifications
+    deferred by dataset rate limits are acknowledged once scheduled, so
+    that they do not hold prefetch and delay other datasets: as with sr3,
+    they are kept in memory (up to the `max_deferred` items of the
+    scheduler), rescheduled if publishing fails, and published before
+    stopping.
+    """
+
+    def __init__(self, url: str, queue_name: Union[str, None] = None,
+                 exchange: str = DEFAULT_EXCHANGE,
+                 topic_prefix: str = DEFAULT_TOPIC_PREFIX,
+                 subtopics: Union[list, None] = None,
+                 prefetch: int = 500,
+                 batch_size: int = 100, batch_timeout: float = 0.5):
+        """
+        initialize
+
+        :param url: `str` of AMQP broker URL (anonymous if no credentials)
+        :param queue_name: `str` of queue name (if not set, a temporary
+                           queue is generated, deleted on disconnect)
+        :param exchange: `str` of exchange
+        :param topic_prefix: `str` of topic prefix
+        :param subtopics: `list` of subtopics to bind (default is the
+                          subtopics of configured datasets)
+        :param prefetch: `int` of maximum unacknowledged notifications
+        :param batch_size: `int` of maximum notifications per batch
+        :param batch_timeout: `float` of seconds to wait for a batch
+
+        :returns: `None`
+        """
+
+        url_ = urlparse(url)
+        if url_.username is None:
+            url_ = url_._replace(netloc=f'anonymous:anonymous@{url_.netloc}')
+        self.url = url_.geturl()
+        self.username = url_.username
+
+        self.exchange = exchange
+        self.topic_prefix = topic_prefix
+        self.prefetch = prefetch
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+
+        # generated queues are not durable, so restarts do not leave
+        # orphan queues on the broker
+        self.durable = queue_name is not None
+
+        if queue_name is None:
+            queue_name = f'q_{self.username}.msc-wis2node.subscribe.{uuid.uuid4().hex[:8]}'  # noqa
+            LOGGER.warning(f'No queue name set; using temporary queue {queue_name}')  # noqa
+        self.queue_name = queue_name
+
+        self.flowcb = WIS2FlowCB(SimpleNamespace())
+
+        if not subtopics:
+            subtopics = [dataset['subtopic']
+                         for dataset in self.flowcb.wis2_publisher.datasets]
+        self.bindings = sorted(set(f'{topic_prefix}.{subtopic}'
+                                   for subtopic in subtopics))
+
+        # unsettled messages by id: (message, AMQP delivery)
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.stopping = None
+
+        self.received = 0
+        self.acked = 0
+        self.requeued = 0
+
+    def process(self, deliveries: list) -> Tuple[list, list]:
+        """
+        Process a batch of deliveries (in the worker thread)
+
+        :param deliveries: `list` of `aio_pika.IncomingMessage`
+
+        :returns: `tuple` of `list` of deliveries to acknowledge and
+                  `list` of deliveries to requeue
+        """
+
+        ack = []
+        worklist = SimpleNamespace(incoming=[], ok=[], rejected=[],
+                                   failed=[])
+
+        for delivery in deliveries:
+            msg = parse_message(delivery.body, delivery.headers or {})
+            if msg is None:
+                LOGGER.warning(f'Dropping invalid notification: {delivery.body[:100]}')  # noqa
+                ack.append(delivery)
+                continue
+
+            self.pending[id(msg)] = (msg, delivery)
+            worklist.incoming.append(msg)
+
+        self.flowcb.schedule(worklist)
+
+        failed = worklist.failed + self.flowcb.publish_scheduled()
+
+        self.flowcb.wis2_publisher.metrics.flush_if_due()
+        self.flowcb.profiler.dump_if_due()
+        self.flowcb.report_health_if_due()
+
+        ack2, requeue = self._settle(failed)
+
+        return ack + ack2, requeue
+
+    def _settle(self, failed: list) -> Tuple[list, list]:
+        failed_ids = {id(msg) for msg in failed}
+        scheduled_ids = {id(entry[3]) for entry in self.flowcb.scheduler.queue}  # noqa
+
+        ack = []
+        requeue = []
+
+        for key in list(self.pending):
+            if key in failed_ids:
+                requeue.append(self.pending.pop(key)[1])
+                continue
+
+            if key in scheduled_ids:
+                # deferred: retried by the flow callback once acknowledged
+                self.flowcb.acknowledged[key] = 0
+
+            ack.append(self.pending.pop(key)[1])
+
+        return ack, requeue
+
+    def stop_processing(self) -> Tuple[list, list]:
+        """
+        Publish all scheduled notifications, flush metrics and remove the
+        health snapshot (in the worker thread)
+
+        :returns: `tuple` of `list` of deliveries to acknowledge and
+                  `list` of deliveries to requeue
+        """
+
+        failed = self.flowcb.publish_scheduled(force=True)
+        self.flowcb.wis2_publisher.metrics.flush()
+        self.flowcb.profiler.dump()
+        self.flowcb.health.clear()
+        self.flowcb.wis2_publisher.close()
+
+        return self._settle(failed)
+
+    async def _next_batch(self, buffer: asyncio.Queue) -> list:
+        batch = []
+
+        try:
+            batch.append(await asyncio.wait_for(buffer.get(),
+                                                self.batch_timeout))
+        except asyncio.TimeoutError:
+            return batch
+
+        while len(batch) < self.batch_size and not buffer.empty():
+            batch.append(buffer.get_nowait())
+
+        return batch
+
+    async def _settle_deliveries(self, ack: list, requeue: list) -> None:
+        for delivery in ack:
+            await delivery.ack()
+
+        for delivery in requeue:
+            await delivery.nack(requeue=True)
+
+        self.acked += len(ack)
+        self.requeued += len(requeue)
+
+    async def run(self) -> None:
+        """
+        Consume notifications until stopped (SIGINT/SIGTERM)
+
+        :returns: `None`
+        """
+
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+
+        for signal_ in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signal_, self.stopping.set)
+
+        LOGGER.info(f'Connecting to {urlparse(self.url).hostname}')
+        connection = await aio_pika.connect_robust(self.url)
+
+        async with connection:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=self.prefetch)
+
+            exchange = await channel.get_exchange(self.exchange)
+            queue = await channel.declare_queue(
+                self.queue_name, durable=self.durable,
+                auto_delete=not self.durable)
+
+            for binding in self.bindings:
+                LOGGER.debug(f'Binding {self.queue_name} to {binding}')
+                await queue.bind(exchange, routing_key=binding)
+
+            buffer = asyncio.Queue()
+            consumer_tag = await queue.consume(buffer.put)
+
+            LOGGER.info(f'Consuming {self.queue_name} ({len(self.bindings)} bindings)')  # noqa
+
+            backoff = 1
+            last_report = time.monotonic()
+
+            while not self.stopping.is_set():
+                deliveries = await self._next_batch(buffer)
+                self.received += len(deliveries)
+
+                ack, requeue = await loop.run_in_executor(
+                    self.executor, self.process, deliveries)
+
+                await self._settle_deliveries(ack, requeue)
+
+                if requeue:
+                    LOGGER.warning(f'{len(requeue)} notifications requeued; retrying in {backoff} s')  # noqa
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60)
+                else:
+                    backoff = 1
+
+                if time.monotonic() - last_report >= 60:
+                    LOGGER.info(f'Received: {self.received}, acked: {self.acked}, requeued: {self.requeued}, pending: {len(self.pending)}')  # noqa
+                    last_report = time.monotonic()
+
+            LOGGER.info('Stopping')
+            await queue.cancel(consumer_tag)
+
+            # return prefetched, unprocessed deliveries to the queue
+            while not buffer.empty():
+                await buffer.get_nowait().nack(requeue=True)
+
+            ack, requeue = await loop.run_in_executor(
+                self.executor, self.stop_processing)
+            await self._settle_deliveries(ack, requeue)
+
+        self.executor.shutdown()
+
+    def __repr__(self):
+        return f'<AMQPSubscriber {self.queue_name}>'
+
+
+@click.command()
+@click.pass_context
+@cli_options.OPTION_VERBOSITY
+@click.option('--url', '-u', default=MSC_DATAMART_AMQP,
+              help='AMQP broker URL')
+@click.option('--queue-name', '-q',
+              help='Queue name (set a stable name to resume consumption '
+                   'after restarts, else a temporary queue is used)')
+@click.option('--exchange', default=DEFAULT_EXCHANGE, help='Exchange')
+@click.option('--topic-prefix', default=DEFAULT_TOPIC_PREFIX,
+              help='Topic prefix')
+@click.option('--subtopic', '-s', 'subtopics', multiple=True,
+              help='Subtopic to bind (default is the subtopics of '
+                   'configured datasets)')
+@click.option('--prefetch', default=500, type=int,
+              help='Maximum unacknowledged notifications')
+@click.option('--batch-size', '-b', default=100, type=int,
+              help='Maximum notifications per batch')
+def subscribe(ctx, url, queue_name, exchange, topic_prefix, subtopics,
+              prefetch, batch_size, verbosity):
+    """Subscribe to Datamart notifications and publish to WIS2"""
+
+    if url is None:
+        check_environment('MSC_DATAMART_AMQP')
+
+    subscriber = AMQPSubscriber(url, queue_name, exchange, topic_prefix,
+                                list(subtopics), prefetch, batch_size)
+
+    asyncio.run(subscriber.run())
@@ -18,14 +18,51 @@
 #
 ###############################################################################
 
+from datetime import date, datetime, timezone
 import logging
-import random
+import re
 import ssl
+import threading
+import time
+from typing import Union
+import uuid
 
 import certifi
 
 LOGGER = logging.getLogger(__name__)
 
+# dataset notification priorities (lowest value is published first)
+PRIORITIES = {
+    'high': 0,
+    'normal': 1,
+    'low': 2
+}
+
+# regular expression group names of datetime components, in order
+DATETIME_FIELDS = ['year', 'month', 'day', 'hour', 'minute', 'second']
+
+RFC3339_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def subtopic2dirpath(subtopic: str) -> str:
+    """
+    Transforms AMQP subtopic to directory path (`fnmatch` pattern)
+
+    :param subtopic: `str` of AMQP subtopic
+
+    :returns: `str` of directory path
+    """
+
+    LOGGER.debug(f'AMQP subtopic: {subtopic}')
+
+    dirpath = '/' + subtopic.replace('*.', '/').replace('.', '/').rstrip('/#')  # noqa
+    dirpath = dirpath.replace('//', '/')
+    dirpath = f'*{dirpath}*'
+
+    LOGGER.debug(f'directory path: {dirpath}')
+
+    return dirpath
+
 
 def get_mqtt_client_id() -> str:
     """
@@ -34,7 +71,8 @@ def get_mqtt_client_id() -> str:
     :returns: `str` of client id
     """
 
-    return f'msc-wis2node id={random.randint(0, 1000)} (https://github.com/ECCC-MSC/msc-wis2node)'  # noqa
+    # unique per connection, as connections are persistent
+    return f'msc-wis2node id={uuid.uuid4().hex[:12]} (https://github.com/ECCC-MSC/msc-wis2node)'  # noqa
 
 
 def get_mqtt_tls_settings() -> dict:
@@ -46,3 +84,223 @@ def get_mqtt_tls_settings() -> dict:
         'ca_certs': certifi.where(),
         'tls_version': ssl.PROTOCOL_TLSv1_2
     }
+
+
+class RateLimiter:
+    """Token bucket rate limiter"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        initialize
+
+        :param rate: `float` of allowed operations per second
+                     (`0` disables rate limiting)
+        :param burst: `int` of operations allowed in a burst
+
+        :returns: `None`
+        """
+
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token if one is available, without waiting
+
+        :returns: `bool` of whether a token was taken
+        """
+
+        if self.rate <= 0:
+            return True
+
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+
+        return False
+
+    def acquire(self) -> None:
+        """
+        Take a token, waiting until one is available
+
+        :returns: `None`
+        """
+
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def __repr__(self):
+        return f'<RateLimiter rate={self.rate}>'
+
+
+class DatetimeExtractor:
+    """
+    Extracts the datetime of data from filenames with a precompiled regular
+    expression
+
+    The regular expression defines either positional groups (year, month,
+    day[, hour[, minute[, second]]]) or named groups (`year`, `month`,
+    `day`, `hour`, `minute`, `second`).  Time intervals are defined by named
+    groups prefixed with `start_` and `end_` (e.g. `start_year`,
+    `end_year`).  Dates are returned as `YYYY-MM-DD` when only year, month
+    and day are captured.
+    """
+
+    def __init__(self, pattern: str):
+        """
+        initialize
+
+        :param pattern: `str` of regular expression
+
+        :returns: `None`
+        """
+
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+
+        names = self.regex.groupindex
+
+        if 'start_year' in names and 'end_year' in names:
+            prefixes = ['start_', 'end_']
+        elif 'year' in names:
+            prefixes = ['']
+        else:
+            prefixes = None
+
+        # (property, groups) pairs, resolved once
+        self.properties = []
+
+        if prefixes is None:
+            if self.regex.groups < 3:
+                msg = f'Missing year, month and day groups: {pattern}'
+                raise ValueError(msg)
+            groups = tuple(range(1, min(self.regex.groups, 6) + 1))
+            self.properties.append(('datetime', groups))
+        else:
+            for prefix in prefixes:
+                groups = []
+                for field in DATETIME_FIELDS:
+                    if f'{prefix}{field}' not in names:
+                        break
+                    groups.append(f'{prefix}{field}')
+                if len(groups) < 3:
+                    msg = f'Missing {prefix}year, {prefix}month and {prefix}day groups: {pattern}'  # noqa
+                    raise ValueError(msg)
+                self.properties.append((f'{prefix}datetime', tuple(groups)))
+
+    def _cast(self, values: tuple) -> str:
+        values2 = []
+        for value in values:
+            if value is None:
+                break
+            values2.append(int(value))
+
+        if len(values2) == 3:
+            return date(*values2).isoformat()
+
+        # validate before formatting
+        dt = datetime(*values2)
+
+        return (f'{dt.year:04d}-{dt.month:02d}-{dt.day:02d}T'
+                f'{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}Z')
+
+    def extract(self, value: str) -> Union[dict, None]:
+        """
+        Extract datetime properties
+
+        :param value: `str` of filename or URL
+
+        :returns: `dict` of `datetime`, or `start_datetime` and
+                  `end_datetime` properties, or `None` if not found
+        """
+
+        match = self.regex.search(value)
+
+        if match is None:
+            LOGGER.debug(f'No match ({self.pattern} not in {value})')
+            return None
+
+        try:
+            return {name: self._cast(match.group(*groups))
+                    for name, groups in self.properties}
+        except (TypeError, ValueError) as err:
+            LOGGER.debug(f'Invalid datetime in {value}: {err}')
+            return None
+
+    def __repr__(self):
+        return f'<DatetimeExtractor {self.pattern}>'
+
+
+def _parse_message_time(msg: dict, key: str) -> Union[datetime, None]:
+    value = msg.get(key)
+    if not isinstance(value, str):
+        return None
+
+    # v03 (YYYYMMDDTHHMMSS.fff) or v02 (YYYYMMDDHHMMSS.fff)
+    value = value.replace('T', '')
+    try:
+        dt = datetime.strptime(value[:14], '%Y%m%d%H%M%S')
+        if value[14:15] == '.' and value[15:].isdigit():
+            dt = dt.replace(microsecond=int(value[15:21].ljust(6, '0')))
+        return dt.replace(tzinfo=timezone.utc)
+    except ValueError:
+        LOGGER.debug(f'Invalid {key}: {value}')
+
+    return None
+
+
+def get_message_datetime(msg: dict) -> Union[str, None]:
+    """
+    Get the datetime of a sarracenia message, from the file modification
+    time or else the time of publication
+
+    :param msg: `dict` of sarracenia message
+
+    :returns: `str` of RFC3339 datetime, or `None` if not available
+    """
+
+    for key in ['mtime', 'pubTime']:
+        dt = _parse_message_time(msg, key)
+        if dt is not None:
+            return dt.strftime(RFC3339_FORMAT)
+
+    return None
+
+
+def get_message_pubtime(msg: dict) -> Union[float, None]:
+    """
+    Get the time of publication of a sarracenia message (i.e. when the
+    Datamart announced it)
+
+    :param msg: `dict` of sarracenia message
+
+    :returns: `float` of seconds since the epoch, or `None` if not
+              available
+    """
+
+    dt = _parse_message_time(msg, 'pubTime')
+    if dt is None:
+        return None
+
+    return dt.timestamp()
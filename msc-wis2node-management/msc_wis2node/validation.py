@@ -0,0 +1,127 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+import json
+import logging
+from pathlib import Path
+import random
+from typing import Union
+
+from jsonschema.exceptions import SchemaError
+from jsonschema.validators import Draft202012Validator
+from pywis_pubsub.schema import MESSAGE_SCHEMA
+
+from msc_wis2node.env import VALIDATION_SAMPLE_RATE, VALIDATION_SCHEMA
+
+LOGGER = logging.getLogger(__name__)
+
+
+def load_validator(schema: Union[str, Path, None] = None) -> Draft202012Validator:  # noqa
+    """
+    Load and compile the WIS2 notification message (WNM) schema
+
+    :param schema: `str` or `Path` of schema file (default is the schema
+                   cached by `pywis-pubsub schema sync`)
+
+    :returns: `jsonschema.validators.Draft202012Validator`
+    """
+
+    schema = Path(schema or MESSAGE_SCHEMA)
+
+    LOGGER.debug(f'Loading WNM schema {schema}')
+    with schema.open() as fh:
+        schema_ = json.load(fh)
+
+    Draft202012Validator.check_schema(schema_)
+
+    return Draft202012Validator(schema_)
+
+
+class MessageValidator:
+    """
+    Sampled validation of WIS2 notification messages against the WNM schema
+
+    The schema is compiled once.  Valid messages are checked with
+    `is_valid`, so that errors are only collected for violations.
+    Violations are counted per dataset; messages are published regardless.
+    """
+
+    def __init__(self, sample_rate: float = VALIDATION_SAMPLE_RATE,
+                 schema: Union[str, None] = VALIDATION_SCHEMA):
+        """
+        initialize
+
+        :param sample_rate: `float` of fraction of messages to validate
+                            (`0` disables validation, `1` validates all)
+        :param schema: `str` of schema file (default is the schema cached
+                       by `pywis-pubsub schema sync`)
+
+        :returns: `None`
+        """
+
+        self.sample_rate = sample_rate
+        self.validator = None
+
+        self.checked = 0
+        self.violations = {}
+
+        if self.sample_rate > 0:
+            LOGGER.info(f'Validating {self.sample_rate:.2%} of messages')
+            try:
+                self.validator = load_validator(schema)
+            except FileNotFoundError as err:
+                LOGGER.error(f"WNM schema missing (run 'pywis-pubsub schema sync'); validation disabled: {err}")  # noqa
+            except (json.JSONDecodeError, SchemaError) as err:
+                LOGGER.error(f'Invalid WNM schema; validation disabled: {err}')  # noqa
+
+    @property
+    def enabled(self) -> bool:
+        return self.validator is not None
+
+    def validate(self, metadata_id: str, message: dict) -> Union[bool, None]:
+        """
+        Validate a message if sampled
+
+        :param metadata_id: metadata identifier of the message dataset
+        :param message: `dict` of WIS2 notification message
+
+        :returns: `bool` of validation result, or `None` if not sampled
+        """
+
+        if not self.enabled:
+            return None
+
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+
+        self.checked += 1
+
+        if self.validator.is_valid(message):
+            return True
+
+        self.violations[metadata_id] = self.violations.get(metadata_id, 0) + 1  # noqa
+
+        errors = [f'{error.json_path}: {error.message}'
+                  for error in self.validator.iter_errors(message)]
+        LOGGER.warning(f"Invalid WIS2 notification message {message.get('id')} ({metadata_id}): {'; '.join(errors)}")  # noqa
+
+        return False
+
+    def __repr__(self):
+        return f'<MessageValidator sample_rate={self.sample_rate}>'
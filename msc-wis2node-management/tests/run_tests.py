@@ -0,0 +1,1131 @@
+###############################################################################
+#
+# Copyright (C) 2025 Tom Kralidis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from http.server import ThreadingHTTPServer
+from io import StringIO
+import json
+from pathlib import Path
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+import unittest
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import fakeredis
+from paho.mqtt import client as mqtt_client
+import redis
+
+from msc_wis2node.cache import Cache
+from msc_wis2node.dataset import (datasets_overlap, diff_metadata_state,
+                                  get_metadata_state_path,
+                                  load_metadata_state,
+                                  pin_overlapping_datasets,
+                                  save_metadata_state)
+from msc_wis2node.health import (HealthMonitor, HealthRequestHandler,
+                                 evaluate_instance, get_health)
+from msc_wis2node.metrics import create_metrics_index
+from msc_wis2node.mqtt import BrokerFanout, MQTTPublisher
+from msc_wis2node.profiling import SampledProfiler, merge_profiles
+from msc_wis2node.publish import Replayer, read_relpaths
+from msc_wis2node.publisher import (MAX_DEFERRED_RETRIES,
+                                    MetricsAggregator, PriorityScheduler,
+                                    WIS2FlowCB)
+from msc_wis2node.subscribe import AMQPSubscriber, parse_message
+from msc_wis2node.util import DatetimeExtractor
+from msc_wis2node.validation import MessageValidator, load_validator
+
+
+class CacheTest(unittest.TestCase):
+    """Cache tests"""
+
+    def test_memory_only(self):
+        """Test cache without Redis"""
+
+        cache = Cache(None)
+
+        self.assertFalse(cache.available)
+        self.assertTrue(cache.add('key', 1))
+        self.assertFalse(cache.add('key', 1))
+        self.assertEqual(cache.get('key'), 1)
+        self.assertFalse(cache.incrby_many({'counter': 1}))
+        self.assertEqual(cache.pending_keys, {})
+
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+
+    def test_circuit_breaker(self):
+        """Test fallback to the in-memory store and reconciliation"""
+
+        server = fakeredis.FakeServer()
+        r = fakeredis.FakeRedis(server=server)
+
+        cache = Cache('redis://localhost', failure_threshold=2,
+                      retry_interval=60)
+        cache.redis = fakeredis.FakeRedis(server=server)
+
+        cache.set('key1', 'a')
+        self.assertEqual(r.get('key1'), b'a')
+
+        server.connected = False
+
+        cache.set('key2', 'b')
+        self.assertTrue(cache.available)
+        self.assertIsNone(cache.opened_at)
+
+        self.assertFalse(cache.incrby_many({'counter': 2}))
+        self.assertFalse(cache.available)
+        self.assertIsNotNone(cache.opened_at)
+
+        # circuit open: in-memory store only
+        self.assertEqual(cache.get('key2'), 'b')
+        self.assertTrue(cache.add('key3', 'c', ex=60))
+        self.assertFalse(cache.add('key3', 'c', ex=60))
+        self.assertFalse(cache.incrby_many({'counter': 3}))
+        self.assertEqual(cache.failures, 2)
+
+        server.connected = True
+
+        # still open until the retry interval has elapsed
+        self.assertIsNone(cache.get('key1'))
+
+        cache.opened_at -= 60
+
+        self.assertTrue(cache.available)
+        self.assertEqual(cache.get('key1'), b'a')
+        self.assertIsNone(cache.opened_at)
+        self.assertEqual(cache.failures, 0)
+
+        self.assertEqual(r.get('key2'), b'b')
+        self.assertEqual(r.get('key3'), b'c')
+        self.assertGreater(r.ttl('key3'), 0)
+        self.assertEqual(r.get('counter'), b'5')
+        self.assertEqual(cache.memory, {})
+        self.assertEqual(cache.pending_counters, {})
+
+
+class DatasetTest(unittest.TestCase):
+    """Dataset tests"""
+
+    def test_datasets_overlap(self):
+        """Test overlap of dataset subtopics"""
+
+        def get_dataset(subtopic):
+            return {'metadata-id': subtopic, 'subtopic': subtopic}
+
+        a_b = get_dataset('*.WXO-DD.a.b.#')
+
+        for subtopic, overlap in [('*.WXO-DD.a.b.#', True),
+                                  ('*.WXO-DD.a.b.c.#', True),
+                                  ('*.WXO-DD.a.#', True),
+                                  ('*.WXO-DD.a.bc.#', True),
+                                  ('*.b.c.#', True),
+                                  ('*.b.#', True),
+                                  ('*.WXO-DD.a.c.#', False),
+                                  ('*.WXO-DD.b.#', False),
+                                  ('*.c.b.#', False)]:
+            dataset = get_dataset(subtopic)
+            self.assertEqual(datasets_overlap(a_b, dataset), overlap,
+                             subtopic)
+            self.assertEqual(datasets_overlap(dataset, a_b), overlap,
+                             subtopic)
+
+        # wildcard patterns matching a common path
+        self.assertTrue(datasets_overlap(
+            get_dataset('*.WXO-DD.a.15km.#'),
+            get_dataset('*.15km.grib2.#')))
+
+        datasets = [get_dataset(subtopic) for subtopic in
+                    ['*.WXO-DD.a.#', '*.WXO-DD.b.#', '*.WXO-DD.a.b.#']]
+
+        self.assertEqual(pin_overlapping_datasets(datasets), 2)
+        self.assertEqual([dataset['pinned'] for dataset in datasets],
+                         [True, False, True])
+
+    def test_diff_metadata_state(self):
+        """Test metadata changes against published metadata"""
+
+        published = {'a': '1', 'b': '2', 'c': '3', 'd': '4'}
+        current = {'a': '1', 'b': '20', 'e': '5'}
+
+        changes = diff_metadata_state(published, current, {'c'})
+
+        self.assertEqual(changes, {
+            'create': ['e'],
+            'update': ['b'],
+            'delete': ['c']
+        })
+
+        # missing but not retired (e.g. invalid MCF): kept
+        changes = diff_metadata_state(published, {})
+        self.assertEqual(changes, {'create': [], 'update': [], 'delete': []})
+
+        # retired but never published
+        changes = diff_metadata_state({}, {}, {'a'})
+        self.assertEqual(changes['delete'], [])
+
+        changes = diff_metadata_state({}, current)
+        self.assertEqual(sorted(changes['create']), ['a', 'b', 'e'])
+
+    @patch('msc_wis2node.dataset.METADATA_STATE', None)
+    def test_metadata_state(self):
+        """Test reading and writing of metadata publication state"""
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = Path(tmpdir) / 'datasets.yml'
+            state = get_metadata_state_path(output)
+
+            self.assertEqual(state.name, 'datasets-metadata-state.yml')
+            self.assertEqual(get_metadata_state_path(output, output), output)
+
+            self.assertEqual(load_metadata_state(state), {})
+
+            save_metadata_state(state, {'a': '1'})
+            self.assertEqual(load_metadata_state(state), {'a': '1'})
+
+
+class HealthTest(unittest.TestCase):
+    """Health tests"""
+
+    @patch('msc_wis2node.health.time')
+    def test_snapshot(self, time_):
+        """Test rates and lag over each window"""
+
+        time_.time.return_value = 1000
+        time_.monotonic.return_value = 0
+
+        monitor = HealthMonitor(None, windows=[300, 60])
+        monitor.record(pubtime=990)
+
+        time_.time.return_value = 1100
+        monitor.record(pubtime=1070)
+        monitor.record_failure()
+
+        time_.time.return_value = 1130
+        snapshot = monitor.snapshot(queue_depth=5)
+
+        self.assertEqual(snapshot['published'], 2)
+        self.assertEqual(snapshot['failed'], 1)
+        self.assertEqual(snapshot['queue_depth'], 5)
+        self.assertEqual(snapshot['last_publish'], 1100)
+        self.assertEqual(snapshot['last_lag_seconds'], 30)
+
+        # rates over the uptime if shorter than the window
+        self.assertEqual(snapshot['messages_per_second'], {
+            '60s': {'published': 0.017, 'failed': 0.017},
+            '300s': {'published': 0.015, 'failed': 0.008}
+        })
+        self.assertEqual(snapshot['lag_seconds'], {
+            '60s': {'mean': 30, 'max': 30},
+            '300s': {'mean': 20, 'max': 30}
+        })
+
+        # outside of all windows
+        time_.time.return_value = 1500
+        snapshot = monitor.snapshot()
+
+        self.assertEqual(snapshot['messages_per_second']['300s'],
+                         {'published': 0, 'failed': 0})
+        self.assertEqual(snapshot['lag_seconds']['300s'],
+                         {'mean': None, 'max': None})
+
+    def test_evaluate_instance(self):
+        """Test status of an instance"""
+
+        snapshot = {
+            'started': 1000,
+            'last_publish': None,
+            'lag_seconds': {
+                '60s': {'mean': None, 'max': None},
+                '300s': {'mean': 400, 'max': 400}
+            }
+        }
+
+        self.assertEqual(evaluate_instance(snapshot, 1100, 300, 900), 'ok')
+        self.assertEqual(evaluate_instance(snapshot, 2000, 300, 900), 'idle')
+
+        snapshot['last_publish'] = 1900
+        self.assertEqual(evaluate_instance(snapshot, 2000, 300, 900), 'ok')
+
+        # lag over the shortest window only
+        snapshot['lag_seconds']['60s'] = {'mean': 301, 'max': 500}
+        self.assertEqual(evaluate_instance(snapshot, 2000, 300, 900),
+                         'lagging')
+
+    @patch('msc_wis2node.env.CACHE', 'redis://localhost')
+    @patch('msc_wis2node.health.CACHE', 'redis://localhost')
+    def test_get_health(self):
+        """Test aggregation of instance health, and HTTP status"""
+
+        server = fakeredis.FakeServer()
+        r = fakeredis.FakeRedis(server=server)
+        cache = Cache('redis://localhost')
+        cache.redis = fakeredis.FakeRedis(server=server)
+
+        def get_monitor(instance):
+            monitor = HealthMonitor(cache, windows=[60])
+            monitor.key = f'health_{instance}'
+            monitor.instance = instance
+            return monitor
+
+        def get_status(port):
+            try:
+                with urlopen(f'http://127.0.0.1:{port}/health') as response:
+                    return response.status, json.load(response)['status']
+            except HTTPError as err:
+                return err.code, json.load(err)['status']
+
+        http_server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          HealthRequestHandler)
+        http_server.max_lag = 300
+        http_server.max_idle = 900
+        port = http_server.server_address[1]
+        threading.Thread(target=http_server.serve_forever,
+                         daemon=True).start()
+        self.addCleanup(http_server.server_close)
+        self.addCleanup(http_server.shutdown)
+
+        with patch.object(redis.Redis, 'from_url', return_value=r):
+            self.assertEqual(get_health()['status'], 'down')
+            self.assertEqual(get_status(port), (503, 'down'))
+
+            busy = get_monitor('busy')
+            busy.record(pubtime=time.time() - 10)
+            busy.record(pubtime=time.time() - 20)
+            busy.report(queue_depth=3)
+
+            quiet = get_monitor('quiet')
+            quiet.started -= 1000
+            quiet.report(queue_depth=1)
+
+            r.set('health_invalid', 'not json')
+
+            with self.assertLogs('msc_wis2node.health', 'WARNING'):
+                report = get_health(300, 900)
+
+            self.assertEqual(report['status'], 'idle')
+            self.assertEqual(report['instances_total'], 2)
+            self.assertEqual(report['queue_depth'], 4)
+            self.assertEqual([(i['instance'], i['status'])
+                              for i in report['instances']],
+                             [('busy', 'ok'), ('quiet', 'idle')])
+            self.assertGreater(report['messages_per_second']['60s'], 0)
+            self.assertAlmostEqual(report['max_lag_seconds'], 20, delta=1)
+
+            # idle instances do not make the endpoint unhealthy
+            with self.assertLogs('msc_wis2node.health', 'WARNING'):
+                self.assertEqual(get_status(port), (200, 'idle'))
+
+            busy.record(pubtime=time.time() - 1000)
+            busy.report()
+
+            with self.assertLogs('msc_wis2node.health', 'WARNING'):
+                self.assertEqual(get_health(300, 900)['status'], 'lagging')
+                self.assertEqual(get_status(port), (503, 'lagging'))
+
+            server.connected = False
+
+            with self.assertLogs('msc_wis2node.health', 'ERROR'):
+                self.assertEqual(get_health()['status'], 'down')
+
+
+class MQTTTest(unittest.TestCase):
+    """MQTT tests"""
+
+    def test_is_queued(self):
+        """Test which unconfirmed messages are still queued by the client"""
+
+        def get_info(rc):
+            info = mqtt_client.MQTTMessageInfo(1)
+            info.rc = rc
+            return info
+
+        success = get_info(mqtt_client.MQTT_ERR_SUCCESS)
+        no_conn = get_info(mqtt_client.MQTT_ERR_NO_CONN)
+        queue_size = get_info(mqtt_client.MQTT_ERR_QUEUE_SIZE)
+
+        self.assertTrue(MQTTPublisher.is_queued(success))
+        self.assertTrue(MQTTPublisher.is_queued(no_conn))
+        self.assertFalse(MQTTPublisher.is_queued(queue_size))
+
+        self.assertTrue(MQTTPublisher.is_queued(success, qos=0))
+        self.assertFalse(MQTTPublisher.is_queued(no_conn, qos=0))
+
+    def test_fanout_confirmations(self):
+        """Test publishing does not wait for every broker confirmation"""
+
+        class FakeBroker:
+            is_queued = staticmethod(MQTTPublisher.is_queued)
+
+            def __init__(self, hostname, port, timeout):
+                self.confirm = hostname == 'fast'
+                self.connected = threading.Event()
+                self.connected.set()
+                self.connections = 1
+                self.last_error = None
+                self.on_confirm = None
+                self.mid = 0
+
+            def connect_async(self, retry_interval):
+                pass
+
+            def submit(self, topic, payload, qos):
+                self.mid += 1
+                info = mqtt_client.MQTTMessageInfo(self.mid)
+                info.rc = mqtt_client.MQTT_ERR_SUCCESS
+                if self.confirm:
+                    # confirmed before publishing tracks the message
+                    self.on_confirm(self, self.mid, True)
+                return info
+
+        targets = [{'hostname': name, 'port': 1883}
+                   for name in ['fast', 'slow']]
+
+        with patch('msc_wis2node.mqtt.MQTTPublisher', FakeBroker):
+            fanout = BrokerFanout(targets, timeout=5)
+
+        fast, slow = fanout.brokers
+
+        start = time.monotonic()
+        self.assertEqual(fanout.publish('topic', 'payload'), 1)
+        self.assertEqual(fanout.publish('topic', 'payload'), 1)
+        self.assertLess(time.monotonic() - start, 1)
+
+        status = fanout.status()
+        self.assertEqual(status[0]['published'], 2)
+        self.assertEqual(status[0]['inflight'], 0)
+        self.assertEqual(status[1]['published'], 0)
+        self.assertEqual(status[1]['inflight'], 2)
+
+        # late confirmations are recorded when they arrive
+        slow.on_confirm(slow, 1, True)
+        slow.on_confirm(slow, 2, False)
+
+        status = fanout.status()
+        self.assertEqual(status[1]['published'], 1)
+        self.assertEqual(status[1]['failed'], 1)
+        self.assertEqual(status[1]['inflight'], 0)
+
+        # no confirmation within the deadline
+        fast.confirm = False
+        fanout.timeout = 0.1
+
+        with self.assertRaises(ConnectionError):
+            fanout.publish('topic', 'payload')
+
+        self.assertEqual([s['inflight'] for s in fanout.status()], [1, 1])
+
+
+class MetricsTest(unittest.TestCase):
+    """Metrics tests"""
+
+    def test_create_metrics_index_purge(self):
+        """Test rollups are preserved once daily metrics are purged"""
+
+        def write_day(directory, day, content=None):
+            if content is None:
+                content = {
+                    'dataset1': {'files': 1, 'bytes': 100},
+                    'total': {'files': 1, 'bytes': 100}
+                }
+            with (directory / f'{day}.json').open('w') as fh:
+                json.dump(content, fh)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            directory = Path(tmpdir)
+
+            # week 2025-W02
+            for day in range(6, 13):
+                write_day(directory, f'2025-01-{day:02d}')
+            write_day(directory, '2025-01-13', [])
+
+            with self.assertLogs('msc_wis2node.metrics', 'WARNING'):
+                index = create_metrics_index(directory)
+
+            self.assertEqual(len(index['daily']), 7)
+            self.assertEqual(index['weekly'][0]['files'], 7)
+
+            for day in range(6, 9):
+                (directory / f'2025-01-{day:02d}.json').unlink()
+            (directory / '2025-01-13.json').unlink()
+            write_day(directory, '2025-01-14')
+
+            index = create_metrics_index(directory)
+
+            self.assertEqual(len(index['daily']), 5)
+            self.assertEqual([(weekly['period'], weekly['files'])
+                              for weekly in index['weekly']],
+                             [('2025-W02', 7), ('2025-W03', 1)])
+
+            with (directory / 'monthly' / '2025-01.json').open() as fh:
+                monthly = json.load(fh)
+
+            self.assertEqual(monthly['days'], 8)
+            self.assertEqual(monthly['start'], '2025-01-06')
+            self.assertEqual(monthly['end'], '2025-01-14')
+            self.assertEqual(monthly['datasets']['dataset1'],
+                             {'files': 8, 'bytes': 800})
+
+            # fully purged periods are kept
+            for path in directory.glob('2025-01-*.json'):
+                path.unlink()
+            write_day(directory, '2025-02-03')
+
+            index = create_metrics_index(directory)
+
+            self.assertEqual([weekly['period'] for weekly in index['weekly']],
+                             ['2025-W02', '2025-W03', '2025-W06'])
+            self.assertEqual([(monthly['period'], monthly['files'])
+                              for monthly in index['monthly']],
+                             [('2025-01', 8), ('2025-02', 1)])
+
+
+class ProfilingTest(unittest.TestCase):
+    """Profiling tests"""
+
+    def test_sampled_profiler(self):
+        """Test sampling, dumps and merging of profiles"""
+
+        def worklist():
+            return sum(range(1000))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            directory = Path(tmpdir)
+
+            profiler = SampledProfiler(0, directory)
+            with profiler.sample():
+                worklist()
+
+            self.assertIsNone(profiler.profiler)
+            self.assertIsNone(profiler.dump())
+
+            profiler = SampledProfiler(0.5, directory, dump_interval=60,
+                                       max_dumps=2)
+
+            with patch('msc_wis2node.profiling.random.random',
+                       side_effect=[0.7, 0.2, 0.1]):
+                for i in range(3):
+                    with profiler.sample():
+                        worklist()
+
+            self.assertEqual(profiler.samples, 2)
+
+            # dumps are written once the dump interval has elapsed
+            profiler.dump_if_due()
+            self.assertEqual(list(directory.iterdir()), [])
+
+            timestamps = [f'20250101T00000{i}' for i in range(3)]
+
+            with patch('msc_wis2node.profiling.time.strftime',
+                       side_effect=timestamps):
+                profiler.last_dump -= 60
+                profiler.dump_if_due()
+
+                for i in range(2):
+                    profiler.profiler = None
+                    with patch('msc_wis2node.profiling.random.random',
+                               return_value=0):
+                        with profiler.sample():
+                            worklist()
+                    profiler.dump()
+
+            self.assertEqual(profiler.samples, 0)
+
+            # the most recent dumps of the instance are kept
+            dumps = sorted(directory.iterdir())
+            self.assertEqual([dump.name for dump in dumps], [
+                f'{profiler.instance}-{timestamp}.prof'
+                for timestamp in timestamps[1:]])
+
+            invalid = directory / 'invalid.prof'
+            invalid.write_bytes(b'invalid')
+
+            with self.assertLogs('msc_wis2node.profiling', 'WARNING'):
+                stats = merge_profiles(dumps + [invalid])
+
+            calls = {function[2]: values[1]
+                     for function, values in stats.stats.items()}
+            self.assertEqual(calls['worklist'], 2)
+
+            with self.assertLogs('msc_wis2node.profiling', 'WARNING'):
+                self.assertIsNone(merge_profiles([invalid]))
+
+
+class PublishTest(unittest.TestCase):
+    """Publish (replay) tests"""
+
+    def test_read_relpaths(self):
+        """Test reading of relPaths, URLs and sr3 log lines"""
+
+        lines = [
+            '# replay of 2025-01-01',
+            '',
+            '   ',
+            '/20250101/WXO-DD/a/b.grib2',
+            '20250101/WXO-DD/a/c.grib2',
+            '  https://hpfx.collab.science.gc.ca/20250101/WXO-DD/a/d.grib2  ',
+            '2025-01-01 00:00:00,000 [INFO] 123 log after_accept accepted: (lag: 0.50 ) baseUrl: https://dd.weather.gc.ca relPath: 20250101/WXO-DD/a/e.grib2',  # noqa
+            '2025-01-01 00:00:00,000 [INFO] 123 sr3 starting'
+        ]
+
+        relpaths = list(read_relpaths(StringIO('\n'.join(lines)),
+                                      'https://example.org'))
+
+        self.assertEqual(relpaths, [
+            ('https://example.org', '/20250101/WXO-DD/a/b.grib2'),
+            ('https://example.org', '/20250101/WXO-DD/a/c.grib2'),
+            ('https://hpfx.collab.science.gc.ca', '/20250101/WXO-DD/a/d.grib2'),  # noqa
+            ('https://dd.weather.gc.ca', '/20250101/WXO-DD/a/e.grib2')
+        ])
+
+    def test_replayer(self):
+        """Test replay of notifications through stub publishers"""
+
+        published = []
+        publishers = []
+
+        class StubPublisher:
+            def __init__(self):
+                self.metrics = SimpleNamespace(flush=lambda: None)
+                self.closed = False
+                publishers.append(self)
+
+            def identify(self, relpath):
+                return {} if '/WXO-DD/' in relpath else None
+
+            def publish(self, base_url, relpath):
+                if relpath.endswith('fail'):
+                    raise ConnectionError('broker unavailable')
+                if self.identify(relpath) is None:
+                    return False
+                published.append(f'{base_url}{relpath}')
+                return True
+
+            def close(self):
+                self.closed = True
+
+        relpaths = [('https://example.org', f'/WXO-DD/{i}') for i in range(7)]
+        relpaths += [('https://example.org', '/other/0'),
+                     ('https://example.org', '/WXO-DD/fail')]
+
+        with patch('msc_wis2node.publish.WIS2Publisher', StubPublisher):
+            summary = Replayer(workers=2, batch_size=2).replay(relpaths)
+
+            self.assertEqual(summary['published'], 7)
+            self.assertEqual(summary['skipped'], 1)
+            self.assertEqual(summary['failed'], 1)
+            self.assertEqual(sorted(published),
+                             [f'https://example.org/WXO-DD/{i}'
+                              for i in range(7)])
+            self.assertTrue(publishers)
+            self.assertTrue(all(p.closed for p in publishers))
+
+            published.clear()
+            summary = Replayer(dry_run=True).replay(iter(relpaths))
+
+            self.assertEqual(summary['published'], 8)
+            self.assertEqual(summary['skipped'], 1)
+            self.assertEqual(summary['failed'], 0)
+            self.assertEqual(published, [])
+
+
+class PublisherTest(unittest.TestCase):
+    """Publisher tests"""
+
+    @patch('msc_wis2node.publisher.DUPLICATE_WINDOW_SECONDS', 600)
+    def test_get_duplicate_key(self):
+        """Test duplicate suppression keys of content checksums only"""
+
+        flowcb = WIS2FlowCB.__new__(WIS2FlowCB)
+
+        def get_key(method, value='abc123', relpath='/a/b.grib2'):
+            msg = {
+                'relPath': relpath,
+                'identity': {'method': method, 'value': value}
+            }
+            return flowcb._get_duplicate_key(msg)
+
+        self.assertTrue(get_key('md5').startswith('duplicate_'))
+        self.assertEqual(get_key('sha512'), get_key('sha512'))
+        self.assertNotEqual(get_key('sha512'), get_key('sha512', 'def456'))
+        self.assertNotEqual(get_key('sha512'), get_key('md5'))
+        self.assertNotEqual(get_key('md5'), get_key('md5', relpath='/c'))
+
+        for method in ['md5name', 'cod', 'arbitrary', 'random']:
+            self.assertIsNone(get_key(method))
+
+        self.assertIsNone(get_key('md5', None))
+        self.assertIsNone(flowcb._get_duplicate_key({'relPath': '/a/b'}))
+
+    def test_metrics_aggregator(self):
+        """Test aggregation of metrics and flush interval"""
+
+        server = fakeredis.FakeServer()
+        r = fakeredis.FakeRedis(server=server)
+
+        cache = Cache('redis://localhost')
+        cache.redis = fakeredis.FakeRedis(server=server)
+
+        metrics = MetricsAggregator(cache, interval=60, max_messages=3)
+        today = metrics.today
+
+        metrics.add('dataset1', 100)
+        metrics.add('dataset1', 50)
+        metrics.add_violation('dataset1')
+
+        self.assertEqual(metrics.messages, 2)
+        self.assertEqual(metrics.counters, {
+            f'metrics_{today}_dataset1_files': 2,
+            f'metrics_{today}_dataset1_bytes': 150,
+            f'metrics_total_{today}_files': 2,
+            f'metrics_total_{today}_bytes': 150,
+            f'metrics_{today}_dataset1_invalid': 1
+        })
+        self.assertEqual(r.keys(), [])
+
+        # flushed once the interval has elapsed
+        metrics.flush_if_due()
+        self.assertEqual(metrics.messages, 2)
+
+        metrics.last_flush -= 60
+        metrics.flush_if_due()
+
+        self.assertEqual(metrics.counters, {})
+        self.assertEqual(r.get(f'metrics_{today}_dataset1_bytes'), b'150')
+        self.assertEqual(r.get(f'metrics_{today}_dataset1_invalid'), b'1')
+
+        # or the message bound is reached
+        for i in range(3):
+            metrics.add('dataset2', 10)
+
+        self.assertEqual(metrics.messages, 0)
+        self.assertEqual(r.get(f'metrics_{today}_dataset2_files'), b'3')
+        self.assertEqual(r.get(f'metrics_total_{today}_files'), b'5')
+
+    def test_metrics_aggregator_cache_unavailable(self):
+        """Test metrics are kept while Redis is unavailable, by day"""
+
+        server = fakeredis.FakeServer()
+        r = fakeredis.FakeRedis(server=server)
+
+        cache = Cache('redis://localhost', failure_threshold=1,
+                      retry_interval=60)
+        cache.redis = fakeredis.FakeRedis(server=server)
+
+        metrics = MetricsAggregator(cache, interval=60)
+        metrics.today = yesterday = '2000-01-01'
+        metrics.counters = {f'metrics_total_{yesterday}_files': 4}
+
+        server.connected = False
+
+        # counters of the previous day are flushed on day change
+        with self.assertLogs('msc_wis2node.cache', 'WARNING'):
+            metrics.add('dataset1', 100)
+
+        today = metrics.today
+        self.assertNotEqual(today, yesterday)
+        self.assertEqual(cache.pending_counters,
+                         {f'metrics_total_{yesterday}_files': 4})
+
+        metrics.flush()
+
+        self.assertEqual(metrics.counters, {})
+        self.assertEqual(cache.pending_counters[f'metrics_total_{today}_files'], 1)  # noqa
+
+        server.connected = True
+        cache.opened_at -= 60
+
+        metrics.add('dataset1', 50)
+        metrics.flush()
+
+        self.assertEqual(cache.pending_counters, {})
+        self.assertEqual(r.get(f'metrics_total_{yesterday}_files'), b'4')
+        self.assertEqual(r.get(f'metrics_total_{today}_files'), b'2')
+        self.assertEqual(r.get(f'metrics_{today}_dataset1_bytes'), b'150')
+
+    def test_metrics_aggregator_no_cache(self):
+        """Test metrics are dropped without a cache"""
+
+        with self.assertLogs('msc_wis2node.publisher', 'WARNING'):
+            metrics = MetricsAggregator(Cache(None))
+
+        metrics.add('dataset1', 100)
+
+        with self.assertLogs('msc_wis2node.publisher', 'DEBUG') as logs:
+            metrics.flush()
+
+        self.assertIn('dropped', logs.output[-1])
+        self.assertEqual(metrics.counters, {})
+
+    def test_priority_scheduler_drain(self):
+        """Test scheduling in priority order with rate limits"""
+
+        scheduler = PriorityScheduler(max_deferred=2)
+
+        low = {'metadata-id': 'low', 'priority': 'low'}
+        normal = {'metadata-id': 'normal'}
+        high = {'metadata-id': 'high', 'priority': 'high'}
+        limited = {'metadata-id': 'limited', 'rate-limit': 0.001}
+
+        for dataset, item in [(low, 'low1'), (normal, 'normal1'),
+                              (high, 'high1'), (low, 'low2'),
+                              (high, 'high2'), (normal, 'normal2')]:
+            scheduler.submit(dataset, item)
+
+        self.assertEqual([item for _, item in scheduler.drain()],
+                         ['high1', 'high2', 'normal1', 'normal2', 'low1',
+                          'low2'])
+        self.assertEqual(len(scheduler), 0)
+
+        for i in range(5):
+            scheduler.submit(limited, f'limited{i}')
+
+        # burst of 1, then up to max_deferred items deferred
+        drained = [item for _, item in scheduler.drain()]
+        self.assertEqual(drained, ['limited0', 'limited3', 'limited4'])
+        self.assertEqual(len(scheduler), 2)
+
+        self.assertEqual(list(scheduler.drain()), [])
+        self.assertEqual(len(scheduler), 2)
+
+        drained = [item for _, item in scheduler.drain(force=True)]
+        self.assertEqual(drained, ['limited1', 'limited2'])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_publish_scheduled_retries(self):
+        """Test rescheduling of deferred messages failing to publish"""
+
+        flowcb = WIS2FlowCB.__new__(WIS2FlowCB)
+        flowcb.scheduler = PriorityScheduler()
+        flowcb.health = SimpleNamespace(record=lambda pubtime: None,
+                                        record_failure=lambda: None)
+        flowcb.duplicate_keys = {}
+        flowcb.acknowledged = {}
+
+        published = []
+
+        def publish_to_wis2(dataset, url, datetime_):
+            if url.endswith('fail'):
+                raise ConnectionError('broker unavailable')
+            published.append(url)
+
+        flowcb.wis2_publisher = SimpleNamespace(
+            get_url=lambda base_url, relpath: f'{base_url}{relpath}',
+            publish_to_wis2=publish_to_wis2,
+            cache=SimpleNamespace(delete=lambda key: None))
+
+        dataset = {'metadata-id': 'test'}
+        acknowledged = {'baseUrl': 'https://example.org', 'relPath': '/fail'}
+        unacknowledged = dict(acknowledged)
+        flowcb.acknowledged[id(acknowledged)] = 0
+
+        flowcb.scheduler.submit(dataset, acknowledged)
+        flowcb.scheduler.submit(dataset, unacknowledged)
+
+        with self.assertLogs('msc_wis2node.publisher', 'ERROR'):
+            failed = flowcb.publish_scheduled()
+
+        self.assertEqual(failed, [unacknowledged])
+        self.assertEqual(len(flowcb.scheduler), 1)
+        self.assertEqual(flowcb.acknowledged[id(acknowledged)], 1)
+
+        with self.assertLogs('msc_wis2node.publisher', 'ERROR'):
+            for i in range(MAX_DEFERRED_RETRIES):
+                failed = flowcb.publish_scheduled()
+
+        self.assertEqual(failed, [acknowledged])
+        self.assertEqual(len(flowcb.scheduler), 0)
+        self.assertEqual(flowcb.acknowledged, {})
+        self.assertEqual(published, [])
+
+        acknowledged['relPath'] = '/ok'
+        flowcb.acknowledged[id(acknowledged)] = 0
+        flowcb.scheduler.submit(dataset, acknowledged)
+
+        self.assertEqual(flowcb.publish_scheduled(), [])
+        self.assertEqual(published, ['https://example.org/ok'])
+        self.assertEqual(flowcb.acknowledged, {})
+
+
+class SubscribeTest(unittest.TestCase):
+    """Subscriber tests"""
+
+    def test_parse_message_v02(self):
+        """Test parsing of v02 notifications"""
+
+        body = b'20250101T000000.123 https://dd.weather.gc.ca /a/b.grib2'
+        headers = {'sum': b'd,abc123', 'mtime': '20250101T000000'}
+
+        msg = parse_message(body, headers)
+
+        self.assertEqual(msg['pubTime'], '20250101T000000.123')
+        self.assertEqual(msg['baseUrl'], 'https://dd.weather.gc.ca')
+        self.assertEqual(msg['relPath'], '/a/b.grib2')
+        self.assertEqual(msg['identity'], {'method': 'md5',
+                                           'value': 'abc123'})
+        self.assertEqual(msg['mtime'], '20250101T000000')
+
+        msg = parse_message(body)
+        self.assertNotIn('identity', msg)
+        self.assertNotIn('mtime', msg)
+
+        msg = parse_message(body, {'sum': 'n,abc123'})
+        self.assertEqual(msg['identity']['method'], 'md5name')
+
+    def test_parse_message_v03(self):
+        """Test parsing of v03 notifications"""
+
+        body = b'''{
+            "pubTime": "20250101T000000",
+            "baseUrl": "https://dd.weather.gc.ca",
+            "relPath": "/a/b.grib2",
+            "integrity": {"method": "sha512", "value": "abc123"}
+        }'''
+
+        msg = parse_message(body)
+
+        self.assertEqual(msg['relPath'], '/a/b.grib2')
+        self.assertEqual(msg['identity'], {'method': 'sha512',
+                                           'value': 'abc123'})
+
+    def test_parse_message_invalid(self):
+        """Test parsing of invalid notifications"""
+
+        self.assertIsNone(parse_message(b'20250101T000000 only-two'))
+        self.assertIsNone(parse_message(b'{"relPath": "/a/b.grib2"}'))
+        self.assertIsNone(parse_message(b'{invalid'))
+        self.assertIsNone(parse_message(b'\xff\xfe \xff \xff'))
+
+    def test_settle(self):
+        """Test settling of deliveries after publishing"""
+
+        subscriber = AMQPSubscriber.__new__(AMQPSubscriber)
+        subscriber.flowcb = SimpleNamespace(scheduler=PriorityScheduler(),
+                                            acknowledged={})
+
+        published, failed, deferred = [{'relPath': str(i)} for i in range(3)]
+        subscriber.pending = {
+            id(published): (published, 'published'),
+            id(failed): (failed, 'failed'),
+            id(deferred): (deferred, 'deferred')
+        }
+        subscriber.flowcb.scheduler.submit({'metadata-id': 'test'}, deferred)
+
+        ack, requeue = subscriber._settle([failed])
+
+        # deferred deliveries are acknowledged, and retried in memory
+        self.assertEqual(ack, ['published', 'deferred'])
+        self.assertEqual(requeue, ['failed'])
+        self.assertEqual(subscriber.pending, {})
+        self.assertEqual(subscriber.flowcb.acknowledged, {id(deferred): 0})
+
+    def test_rate_limited_prefetch(self):
+        """Test a saturated rate limited dataset does not hold prefetch"""
+
+        datasets = {
+            'limited': {'metadata-id': 'limited', 'rate-limit': 0.001},
+            'warnings': {'metadata-id': 'warnings', 'priority': 'high'}
+        }
+        published = []
+
+        flowcb = WIS2FlowCB.__new__(WIS2FlowCB)
+        flowcb.scheduler = PriorityScheduler()
+        flowcb.profiler = SimpleNamespace(dump_if_due=lambda: None)
+        flowcb.health = SimpleNamespace(record=lambda pubtime: None,
+                                        record_failure=lambda: None)
+        flowcb.report_health_if_due = lambda: None
+        flowcb.duplicate_keys = {}
+        flowcb.acknowledged = {}
+        flowcb.wis2_publisher = SimpleNamespace(
+            identify=lambda relpath: datasets[relpath.split('/')[1]],
+            get_url=lambda base_url, relpath: relpath,
+            publish_to_wis2=lambda dataset, url, datetime_: published.append(url),  # noqa
+            metrics=SimpleNamespace(flush_if_due=lambda: None))
+
+        subscriber = AMQPSubscriber.__new__(AMQPSubscriber)
+        subscriber.flowcb = flowcb
+        subscriber.pending = {}
+
+        def get_delivery(relpath):
+            body = f'20250101T000000 https://example.org {relpath}'
+            return SimpleNamespace(body=body.encode(), headers={})
+
+        prefetch = 10
+        unacknowledged = 0
+
+        for i in range(3):
+            # the broker delivers up to prefetch unacknowledged deliveries
+            deliveries = [get_delivery(f'/limited/{i}-{j}')
+                          for j in range(prefetch - unacknowledged)]
+            ack, requeue = subscriber.process(deliveries)
+            unacknowledged += len(deliveries) - len(ack) - len(requeue)
+
+        self.assertEqual(unacknowledged, 0)
+        self.assertEqual(published, ['/limited/0-0'])
+        self.assertEqual(len(flowcb.scheduler), 3 * prefetch - 1)
+
+        ack, requeue = subscriber.process([get_delivery('/warnings/1')])
+
+        self.assertEqual(len(ack), 1)
+        self.assertEqual(published, ['/limited/0-0', '/warnings/1'])
+
+    @patch('msc_wis2node.subscribe.WIS2FlowCB')
+    def test_queue_durability(self, flowcb):
+        """Test that only named queues are durable"""
+
+        subscriber = AMQPSubscriber('amqp://localhost', subtopics=['a.#'])
+
+        self.assertFalse(subscriber.durable)
+        self.assertTrue(subscriber.queue_name.startswith(
+            'q_anonymous.msc-wis2node.subscribe.'))
+        self.assertEqual(subscriber.bindings, ['v02.post.a.#'])
+
+        subscriber = AMQPSubscriber('amqp://localhost', 'q_anonymous.test',
+                                    subtopics=['a.#'])
+
+        self.assertTrue(subscriber.durable)
+        self.assertEqual(subscriber.queue_name, 'q_anonymous.test')
+
+
+class UtilTest(unittest.TestCase):
+    """Utility tests"""
+
+    def test_datetime_extractor_positional(self):
+        """Test datetime extraction with positional groups"""
+
+        extractor = DatetimeExtractor(r'(\d{4})(\d{2})(\d{2})T(\d{2})(\d{2})Z_MSC')  # noqa
+
+        self.assertEqual(
+            extractor.extract('https://dd.weather.gc.ca/a/20250102T0304Z_MSC_X.grib2'),  # noqa
+            {'datetime': '2025-01-02T03:04:00Z'})
+        self.assertIsNone(extractor.extract('/a/20250102T0304Z_X.grib2'))
+
+        extractor = DatetimeExtractor(r'(\d{4})(\d{2})(\d{2})')
+
+        self.assertEqual(extractor.extract('obs_20250102.csv'),
+                         {'datetime': '2025-01-02'})
+        self.assertIsNone(extractor.extract('obs_20251302.csv'))
+        self.assertIsNone(extractor.extract('obs.csv'))
+
+    def test_datetime_extractor_named(self):
+        """Test datetime extraction with named and interval groups"""
+
+        extractor = DatetimeExtractor(
+            r'(?P<hour>\d{2})h_(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})')  # noqa
+
+        self.assertEqual(extractor.extract('12h_2025-01-02.nc'),
+                         {'datetime': '2025-01-02T12:00:00Z'})
+
+        extractor = DatetimeExtractor(
+            r'(?P<start_year>\d{4})(?P<start_month>\d{2})(?P<start_day>\d{2})-'  # noqa
+            r'(?P<end_year>\d{4})(?P<end_month>\d{2})(?P<end_day>\d{2})')
+
+        self.assertEqual(extractor.extract('x_20250101-20250131.nc'), {
+            'start_datetime': '2025-01-01',
+            'end_datetime': '2025-01-31'
+        })
+
+    def test_datetime_extractor_invalid(self):
+        """Test invalid datetime extraction patterns"""
+
+        with self.assertRaises(ValueError):
+            DatetimeExtractor(r'(\d{4})(\d{2})')
+
+        with self.assertRaises(ValueError):
+            DatetimeExtractor(r'(?P<year>\d{4})(?P<day>\d{2})')
+
+
+class ValidationTest(unittest.TestCase):
+    """Validation tests"""
+
+    schema = {
+        '$schema': 'https://json-schema.org/draft/2020-12/schema',
+        'type': 'object',
+        'required': ['id', 'properties'],
+        'properties': {
+            'id': {'type': 'string'},
+            'properties': {
+                'type': 'object',
+                'required': ['data_id']
+            }
+        }
+    }
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        self.schema_file = Path(tmpdir.name) / 'schema.json'
+        with self.schema_file.open('w') as fh:
+            json.dump(self.schema, fh)
+
+    def test_load_validator(self):
+        """Test loading of the WNM schema"""
+
+        validator = load_validator(self.schema_file)
+        self.assertTrue(validator.is_valid(
+            {'id': '1', 'properties': {'data_id': 'a'}}))
+        self.assertFalse(validator.is_valid({'id': 1}))
+
+        with self.schema_file.open('w') as fh:
+            json.dump({'type': 'invalid'}, fh)
+
+        with self.assertLogs('msc_wis2node.validation', 'ERROR'):
+            self.assertFalse(MessageValidator(1, self.schema_file).enabled)
+
+        with self.assertLogs('msc_wis2node.validation', 'ERROR'):
+            self.assertFalse(MessageValidator(1, '/missing.json').enabled)
+
+    def test_validate(self):
+        """Test sampled validation and violation counts"""
+
+        valid = {'id': '1', 'properties': {'data_id': 'a'}}
+        invalid = {'id': '2', 'properties': {}}
+
+        validator = MessageValidator(0, self.schema_file)
+        self.assertFalse(validator.enabled)
+        self.assertIsNone(validator.validate('dataset1', invalid))
+
+        validator = MessageValidator(1, self.schema_file)
+        self.assertTrue(validator.enabled)
+        self.assertTrue(validator.validate('dataset1', valid))
+
+        with self.assertLogs('msc_wis2node.validation', 'WARNING') as logs:
+            self.assertFalse(validator.validate('dataset1', invalid))
+            self.assertFalse(validator.validate('dataset2', invalid))
+
+        self.assertIn("'data_id' is a required property", logs.output[0])
+        self.assertEqual(validator.checked, 3)
+        self.assertEqual(validator.violations, {'dataset1': 1,
+                                                'dataset2': 1})
+
+        validator = MessageValidator(0.5, self.schema_file)
+
+        with patch('msc_wis2node.validation.random.random',
+                   side_effect=[0.7, 0.2]):
+            self.assertIsNone(validator.validate('dataset1', valid))
+            self.assertTrue(validator.validate('dataset1', valid))
+
+        self.assertEqual(validator.checked, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
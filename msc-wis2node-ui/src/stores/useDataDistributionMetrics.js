@@ -10,6 +10,8 @@ export const useDataDistributionMetrics = defineStore('metrics', () => {
   const files = ref([]) // list of JSON file names or URLs
   const selectedFile = ref(null) // the currently selected file name
   const selectedFileData = ref(null) // parsed JSON of the selected file
+  const index = ref(null) // parsed index.json manifest (if available)
+  const trend = ref(null) // parsed trend file (per-day series)
   const loadingList = ref(false)
   const loadingFile = ref(false)
   const error = ref(null)
@@ -19,7 +21,20 @@ export const useDataDistributionMetrics = defineStore('metrics', () => {
 
   // Actions
 
-  // Fetch list of JSON files by scraping the HTML index
+  // Fetch the index.json manifest written by `msc-wis2node metrics index`
+  async function fetchIndex() {
+    const res = await fetch(`${metricsBaseUrl.value}/index.json`)
+
+    if (!res.ok) {
+      throw new Error(`Failed to fetch index: ${res.status} ${res.statusText}`)
+    }
+
+    index.value = await res.json()
+
+    return index.value
+  }
+
+  // Fetch list of JSON files from the manifest, or by scraping the HTML index
   async function fetchFileList() {
     if (!metricsBaseUrl.value) {
       error.value = 'VITE_DATA_DISTRIBUTION_METRICS_URL is not configured.'
@@ -29,6 +44,16 @@ export const useDataDistributionMetrics = defineStore('metrics', () => {
     loadingList.value = true
     error.value = null
 
+    try {
+      await fetchIndex()
+      files.value = index.value.daily.map((day) => day.href)
+      loadingList.value = false
+      return
+    } catch {
+      // no manifest available: fall back to the HTML directory listing
+      index.value = null
+    }
+
     try {
       // Get the HTML directory listing
       const res = await fetch(metricsBaseUrl.value)
@@ -96,6 +121,36 @@ export const useDataDistributionMetrics = defineStore('metrics', () => {
     }
   }
 
+  // Fetch per-day series of the most recent days (one request for all days)
+  async function fetchTrend() {
+    if (!metricsBaseUrl.value) {
+      error.value = 'VITE_DATA_DISTRIBUTION_METRICS_URL is not configured.'
+      return
+    }
+
+    error.value = null
+
+    try {
+      if (!index.value) {
+        await fetchIndex()
+      }
+      if (!index.value.trend) {
+        throw new Error('No trend available in index')
+      }
+
+      const res = await fetch(`${metricsBaseUrl.value}/${index.value.trend.href}`)
+
+      if (!res.ok) {
+        throw new Error(`Failed to fetch trend: ${res.status} ${res.statusText}`)
+      }
+
+      trend.value = await res.json()
+    } catch (e) {
+      error.value = e instanceof Error ? e.message : String(e)
+      trend.value = null
+    }
+  }
+
   // Convenience method: get raw JSON as a pretty string
   const rawJson = computed(() =>
     selectedFileData.value ? JSON.stringify(selectedFileData.value, null, 2) : '',
@@ -107,6 +162,8 @@ export const useDataDistributionMetrics = defineStore('metrics', () => {
     files,
     selectedFile,
     selectedFileData,
+    index,
+    trend,
     loadingList,
     loadingFile,
     error,
@@ -116,7 +173,9 @@ export const useDataDistributionMetrics = defineStore('metrics', () => {
     rawJson,
 
     // actions
+    fetchIndex,
     fetchFileList,
     fetchFile,
+    fetchTrend,
   }
 })